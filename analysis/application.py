@@ -5,23 +5,39 @@ Author: Ebad Kamil <ebad.kamil@xfel.eu>
 All rights reserved.
 """
 import argparse
-import multiprocessing as mp
+import logging
 import os
 import queue
 import sys
+import threading
 import time
 from getpass import getuser
 
+import numpy as np
 import redis
-from compose.cli.main import TopLevelCommand, project_from_options
 
-from analysis.config import command_docker_options
-from analysis.processor.data_processor import DataProcessor
-from analysis.processor.data_simulator import DataSimulator
-from analysis.redisdb import get_redis_client
+from analysis.config import command_docker_options, config
+from analysis.ipc import (
+    BackpressureController,
+    HandOff,
+    SharedMemoryQueue,
+    parse_policy,
+)
+from analysis.metrics import LatencyTracker, MetricsServer, PipelineMetrics, stamp
+from analysis.processor.accumulator import IntensityAccumulator
+from analysis.processor.data_processor import IntegratedData
+from analysis.processor.data_simulator import DTYPES, DataSimulator
+from analysis.processor.executors import StageExecutors
+from analysis.processor.processor_pool import ProcessorPool, ReorderBuffer
+from analysis.processor.replay_source import ReplaySource, frame_shape
+from analysis.processor.running_stats import MOMENTS, RunningStatistics
+from analysis.recorder import Recorder
+from analysis.redisdb import get_redis_client, init_redis_client
 from analysis.webgui.app import DashApp
 from analysis.zmq_streamer.data_streamer import DataClient, DataStreamer
 
+logger = logging.getLogger(__name__)
+
 
 def run_redis_container(cmd, options):
     print("Starting redis container ...", flush=True)
@@ -29,6 +45,8 @@ def run_redis_container(cmd, options):
 
 
 def build_and_run():
+    from compose.cli.main import TopLevelCommand, project_from_options
+
     options = command_docker_options
     options["--project-name"] = "analysis-pipeline"
     options["--file"] = ["compose/docker-compose-redis.yml"]
@@ -56,74 +74,595 @@ def start_redis_server():
     return is_redis_up, cmd, options
 
 
+def policy_spec(spec):
+    """HandOff policy given on the command line"""
+    try:
+        parse_policy(spec)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+    return spec
+
+
+def raw_slot_nbytes(data_shape, dtype=np.float64):
+    return int(np.prod(data_shape)) * np.dtype(dtype).itemsize
+
+
+def processed_slot_nbytes(data_shape, intg_pts):
+    pulses, px, py = data_shape
+    float_size = np.dtype(np.float64).itemsize
+    # mean_image, momentum, intensities, boolean, packed and counted edges
+    # in whichever representation DataProcessor is configured to send,
+    # histogram with its edges and moments
+    bins = config["stats_bins"]
+    return (
+        px * py * float_size
+        + (2 * bins + 1 + len(MOMENTS)) * float_size
+        + intg_pts * float_size
+        + pulses * intg_pts * float_size
+        + pulses * px * py
+        + pulses * px * (py + 7) // 8
+        + px * py * np.dtype(np.uint16).itemsize
+    )
+
+
+def _join_or_kill(process, timeout):
+    """Join process, killed if it did not exit within timeout seconds"""
+    if process.pid is None:
+        return
+    process.join(timeout)
+    if process.is_alive():
+        logger.warning("%s did not exit within %.1f s, killed", process.name, timeout)
+        process.kill()
+        process.join()
+
+
 class Application:
-    def __init__(self, hostname, port):
-        is_redis_up, self.docker_command, self.docker_options = start_redis_server()
+    def __init__(
+        self,
+        hostname,
+        port,
+        transport="shm",
+        data_shape=(2, 256, 256),
+        policy=config["handoff_policy"],
+        sock="REP",
+        hwm=10,
+        n_workers=config["n_workers"],
+        reorder_window=None,
+        late_policy="drop",
+        n_threads=config["n_threads"],
+        edge_executor=config["edge_executor"],
+        representation=None,
+        rolling_window=config["rolling_window"],
+        on_pulses=config["on_pulses"],
+        off_pulses=config["off_pulses"],
+        record_dir=None,
+        frames_per_file=config["record_frames_per_file"],
+        replay=None,
+        replay_options=None,
+        simulator_options=None,
+        metrics_port=config["metrics_port"],
+        redis_address=None,
+        latency_budget=config["latency_budget"],
+        ladder=config["backpressure_ladder"],
+    ):
+        # writes processed data to HDF5 files in a thread of its own, created
+        # first as it fails without h5py
+        self.recorder = None
+        if record_dir is not None:
+            self.recorder = Recorder(
+                record_dir,
+                frames_per_file=frames_per_file,
+                buffer_size=config["record_buffer"],
+                compression=config["record_compression"],
+            )
+
+        if redis_address is None:
+            is_redis_up, self.docker_command, self.docker_options = start_redis_server()
+
+            if not is_redis_up:
+                self.docker_command.down(self.docker_options)
+                sys.exit(1)
+        else:
+            # server already running, e.g. a local stand-in, no container
+            self.docker_command = self.docker_options = None
+            init_redis_client(*redis_address)
+
+        simulator_options = simulator_options or {}
+        dtype = simulator_options.get("dtype", config["sim_dtype"])
+        if replay is not None:
+            replay_options = replay_options or {}
+            data_shape = frame_shape(replay, replay_options.get("dataset", "image"))
+            # whatever the file holds, at most 8 bytes per pixel
+            dtype = np.float64
+
+        # raw container where data from DataSimulator is fed. Arrays travel
+        # through shared memory unless transport is "pickle". Each worker
+        # holds the slot of its frame until it has been processed
+        self.raw_queue = SharedMemoryQueue(
+            maxsize=n_workers,
+            slot_nbytes=raw_slot_nbytes(data_shape, dtype),
+            n_consumers=n_workers,
+            mode=transport,
+        )
+        # processed container where data from DataProcessor is fed. Copied on
+        # get since the ZMQ dispatcher holds on to it in another thread
+        self.proc_queue = SharedMemoryQueue(
+            maxsize=n_workers,
+            slot_nbytes=processed_slot_nbytes(data_shape, config["max_int_pts"]),
+            mode=transport,
+            copy=True,
+        )
 
-        if not is_redis_up:
-            self.docker_command.down(self.docker_options)
-            sys.exit(1)
+        self._shutdown = threading.Event()
 
-        # raw container (mp.Queue) where data from DataSimulator is fed
-        raw_queue = mp.Queue(maxsize=1)
-        # processed container (mp.Queue) where data from DataProcessor is fed
-        self.proc_queue = mp.Queue(maxsize=1)
+        # counters in shared memory, updated by every loop of the pipeline
+        self.metrics = PipelineMetrics(
+            n_workers, ladder=ladder if latency_budget is not None else None
+        )
+        # switches the policy of the source when frames take longer than
+        # latency_budget seconds from emit to processed
+        self.backpressure = None
+        if latency_budget is not None:
+            self.backpressure = BackpressureController(
+                self.metrics.backpressure(),
+                latency_budget,
+                ladder,
+                interval=config["backpressure_interval"],
+            )
+
+        if replay is not None:
+            # recorded frames in place of simulated ones
+            self.data_simulator = ReplaySource(
+                self.raw_queue,
+                replay,
+                policy=policy,
+                metrics=self.metrics.loop("source"),
+                backpressure=self.backpressure,
+                **replay_options,
+            )
+        else:
+            self.data_simulator = DataSimulator(
+                self.raw_queue,
+                data_shape=data_shape,
+                policy=policy,
+                metrics=self.metrics.loop("source"),
+                backpressure=self.backpressure,
+                **simulator_options,
+            )
+        self.processor_pool = ProcessorPool(
+            self.raw_queue,
+            self.proc_queue,
+            n_workers=n_workers,
+            n_threads=n_threads,
+            edge_executor=edge_executor,
+            metrics=self.metrics,
+        )
+        # puts results of the workers back into frame order
+        self._reorder = ReorderBuffer(
+            window=reorder_window or 2 * n_workers, late_policy=late_policy
+        )
+        # statistics of the run, merged from the frame statistics in order
+        self._statistics = RunningStatistics(
+            trend_length=config["stats_trend_length"],
+            percentiles=config["stats_percentiles"],
+        )
+        # I(q) of on and off pulses averaged over the last trains
+        self._accumulator = IntensityAccumulator(
+            window=rolling_window, on_pulses=on_pulses, off_pulses=off_pulses
+        )
 
-        self.data_simulator = DataSimulator(raw_queue)
-        self.data_processor = DataProcessor(raw_queue, self.proc_queue)
+        # per stage latency of the frames, recorded here and by the streamer
+        self.latency = LatencyTracker(percentiles=config["latency_percentiles"])
 
         # ZMQ dispatcher to send processed data over network
         self._zmq_dispatcher_buffer = queue.Queue(maxsize=1)
         if hostname == "localhost":
             hostname = "*"
         self.data_streamer = DataStreamer(
-            f"tcp://{hostname}:{port}", self._zmq_dispatcher_buffer
+            f"tcp://{hostname}:{port}",
+            self._zmq_dispatcher_buffer,
+            sock=sock,
+            hwm=hwm,
+            representation=representation,
+            latency=self.latency,
+            metrics=self.metrics.loop("streamer"),
         )
 
+        self.metrics.gauge(
+            "pipeline_queue_depth",
+            "Frames waiting in each queue",
+            ("queue",),
+            callback=self._queue_depths,
+        )
+        self.metrics.gauge(
+            "pipeline_frame_age_seconds",
+            "Percentiles of the time since emit at each stage",
+            ("stage", "quantile"),
+            callback=self._frame_ages,
+        )
+        self._metrics_server = None
+        if metrics_port is not None:
+            self._metrics_server = MetricsServer(self.metrics, port=metrics_port)
+
+    def _queue_depths(self):
+        depths = {
+            "raw": self.raw_queue.qsize(),
+            "processed": self.proc_queue.qsize(),
+            "reorder": len(self._reorder),
+            "zmq": self._zmq_dispatcher_buffer.qsize(),
+        }
+        if self.recorder is not None:
+            depths["recorder"] = self.recorder.stats()["queued"]
+        return depths
+
+    def _frame_ages(self):
+        ages = {}
+        for stage, summary in self.latency.summary().items():
+            for p, ms in (summary["age"] or {}).items():
+                ages[(stage, float(p) / 100)] = ms / 1e3
+        return ages
+
     def start_app(self):
+        if self._metrics_server is not None:
+            self._metrics_server.start()
         # Start data simulator in a process
         self.data_simulator.start()
-        # Start data processor in a process
-        self.data_processor.start()
+        # Start data processors, each in a process
+        self.processor_pool.start()
         # Start ZMQ dispatcher in Thread of parent process
         self.data_streamer.start()
+        if self.recorder is not None:
+            self.recorder.start()
 
         client = get_redis_client()
 
-        while True:
-            try:
-                # Get processed data from proc_queue mp.Queue
-                processed_data = self.proc_queue.get_nowait()
-                print("Integrated image received at :", processed_data.timestamp)
-                # Feed processed data to zmq buffer queue.Queue
-                self._zmq_dispatcher_buffer.put_nowait(processed_data)
-                client.set("TimeStamp", processed_data.timestamp)
-            except (queue.Empty, queue.Full):
+        proc_queue = HandOff(self.proc_queue, stop_event=self._shutdown)
+        # never blocks, a streamer without clients must not hold up processing
+        zmq_buffer = HandOff(
+            self._zmq_dispatcher_buffer,
+            policy=config["dispatch_policy"],
+            stop_event=self._shutdown,
+        )
+
+        metrics = self.metrics.loop("application")
+        n_stopped = 0
+        while n_stopped < len(self.processor_pool):
+            waiting = time.perf_counter()
+            # Get processed data from proc_queue, None once a processor stopped
+            payload = proc_queue.get()
+            metrics.waited(time.perf_counter() - waiting)
+            if payload is None:
+                if self._shutdown.is_set():
+                    break
+                n_stopped += 1
                 continue
 
+            for payload in self._reorder.push(payload[0]["order"], payload):
+                self._publish(payload, client, zmq_buffer, metrics)
+
+        if n_stopped == len(self.processor_pool):
+            # every processor is done, results held back waiting for frames
+            # which will not come are handed on as they are
+            for payload in self._reorder.flush():
+                self._publish(payload, client, zmq_buffer, metrics)
+
+    def _publish(self, payload, client, zmq_buffer, metrics):
+        start = time.perf_counter()
+        processed_data = IntegratedData.from_payload(payload)
+        stamp(processed_data.trace, "collected")
+        self.latency.record(
+            processed_data.trace,
+            ("dequeue", "integrated", "edges", "processed", "collected"),
+        )
+        logger.debug(
+            "Integrated frame %s received at %s",
+            processed_data.frame,
+            processed_data.timestamp,
+        )
+        self._statistics.publish(processed_data)
+        self._accumulator.publish(processed_data)
+        if self.recorder is not None:
+            self.recorder.put(processed_data)
+        # Feed processed data to zmq buffer queue.Queue
+        zmq_buffer.put(processed_data)
+        client.set("TimeStamp", processed_data.timestamp)
+        trace = processed_data.trace or {}
+        metrics.frame(
+            time.perf_counter() - start,
+            dropped=zmq_buffer.n_dropped,
+            latency=(
+                (trace["collected"] - trace["emit"]) / 1e9 if "emit" in trace else None
+            ),
+        )
+
+    def pool_stats(self):
+        """Per-worker throughput, queue depths and reorder counters"""
+        stats = self.processor_pool.stats()
+        stats.update(
+            reorder_pending=len(self._reorder),
+            reorder_late=self._reorder.n_late,
+            reorder_skipped=self._reorder.n_skipped,
+        )
+        stats.update({f"source_{k}": v for k, v in self.data_simulator.stats().items()})
+        if self.recorder is not None:
+            stats.update({f"recorder_{k}": v for k, v in self.recorder.stats().items()})
+        if self.backpressure is not None:
+            stats["backpressure_policy"] = self.metrics.backpressure().policy
+        return stats
+
+    def latency_stats(self):
+        """p50/p99 latency of each stage in ms, see LatencyTracker.summary"""
+        return self.latency.summary()
+
     def stop_app(self):
-        self.docker_command.down(self.docker_options)
+        self._shutdown.set()
+        self.data_simulator.terminate()
+        self.processor_pool.terminate()
+        if self.docker_command is not None:
+            self.docker_command.down(self.docker_options)
         self.data_streamer.stop()
         if self.data_streamer and self.data_streamer.is_alive():
             self.data_streamer.join()
-        if self.data_simulator and self.data_simulator.is_alive():
-            self.data_simulator.join()
-        if self.data_processor and self.data_processor.is_alive():
-            self.data_processor.join()
+        _join_or_kill(self.data_simulator, config["join_timeout"])
+        if self.recorder is not None and self.recorder.is_alive():
+            self.recorder.stop()
+            self.recorder.join()
+        for worker in self.processor_pool.workers:
+            _join_or_kill(worker, config["join_timeout"])
+        self.raw_queue.close()
+        self.proc_queue.close()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
 
 
 def start_pipeline():
     parser = argparse.ArgumentParser(prog="extra analysis")
     parser.add_argument("hostname", type=str, help="hostname")
     parser.add_argument("port", type=int, help="ZMQ port to stream processed data")
-    parser.add_argument("--redis_host", type=str, help="redis-hostname")
-    parser.add_argument("--redis_port", type=int, help="redis-port", required=False)
+    parser.add_argument(
+        "--redis_host",
+        type=str,
+        help="Use the Redis server on this host instead of starting a container",
+    )
+    parser.add_argument(
+        "--redis_port", type=int, default=6379, help="Port of --redis_host"
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        choices=SharedMemoryQueue.modes,
+        default="shm",
+        help="How arrays are passed between processes",
+    )
+    parser.add_argument(
+        "--policy",
+        type=policy_spec,
+        default=config["handoff_policy"],
+        help="What the source does when the processors are still busy: "
+        f"{', '.join(HandOff.policies)}, decimate:N puts every Nth frame",
+    )
+    parser.add_argument(
+        "--latency_budget",
+        type=float,
+        default=config["latency_budget"],
+        metavar="SECONDS",
+        help="Seconds, step the source through --ladder while frames take longer "
+        "than this from emit to processed, --policy is used otherwise",
+    )
+    parser.add_argument(
+        "--ladder",
+        type=policy_spec,
+        nargs="+",
+        default=config["backpressure_ladder"],
+        help="Policies of the source from least to most frames shed, "
+        "block and decimate:N only",
+    )
+    parser.add_argument(
+        "--sock",
+        type=str,
+        choices=["REP", "PUB", "PUSH"],
+        default="REP",
+        help="REP: one frame per request, PUB: fan out to every subscriber, "
+        "PUSH: load balance over workers",
+    )
+    parser.add_argument(
+        "--hwm", type=int, default=10, help="ZMQ send high-water mark (PUB/PUSH)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config["n_workers"],
+        help="Number of data processor processes",
+    )
+    parser.add_argument(
+        "--reorder_window",
+        type=int,
+        help="Results held back waiting for a missing frame, 2 x workers by default",
+    )
+    parser.add_argument(
+        "--late_policy",
+        type=str,
+        choices=ReorderBuffer.late_policies,
+        default="drop",
+        help="What to do with results of frames which were given up on",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=config["n_threads"],
+        help="Threads per processor, cores divided by workers by default",
+    )
+    parser.add_argument(
+        "--edge_executor",
+        type=str,
+        choices=StageExecutors.kinds,
+        default=config["edge_executor"],
+        help="Run edge detection in the shared thread pool or a process pool",
+    )
+    parser.add_argument(
+        "--edges",
+        type=str,
+        choices=IntegratedData.edge_formats,
+        help="Edges sent to PUB/PUSH clients and REQ clients which do not ask: "
+        "full boolean stack, packed bits or per pixel count. As processed by default",
+    )
+    parser.add_argument(
+        "--image_dtype",
+        type=str,
+        choices=IntegratedData.image_dtypes,
+        help="dtype of the mean image sent, as processed by default",
+    )
+    parser.add_argument(
+        "--rolling_window",
+        type=int,
+        default=config["rolling_window"],
+        help="Number of trains I(q) is averaged over",
+    )
+    parser.add_argument(
+        "--on_pulses",
+        type=str,
+        default=config["on_pulses"],
+        help="Pumped pulses as a slice, e.g. ::2, or an index. All by default",
+    )
+    parser.add_argument(
+        "--off_pulses",
+        type=str,
+        default=config["off_pulses"],
+        help="Unpumped pulses, e.g. 1::2, for on-off difference curves",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        metavar="DIR",
+        help="Write processed data to HDF5 files in DIR, requires h5py",
+    )
+    parser.add_argument(
+        "--frames_per_file",
+        type=int,
+        default=config["record_frames_per_file"],
+        help="Frames per HDF5 file before starting the next one",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        metavar="PATH",
+        help="Stream frames of a .npy, HDF5 or Zarr file instead of simulated ones",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default="image",
+        help="HDF5 or Zarr dataset of shape (frames, [pulses,] px, py) to replay",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Frames per second simulated, 0 for as fast as possible "
+        f"({config['sim_rate']} by default), or that replayed data were taken "
+        f"at ({config['replay_rate']} by default)",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay at this multiple of --rate, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--loop", action="store_true", help="Replay the file over and over"
+    )
+    parser.add_argument("--start", type=int, default=0, help="First frame replayed")
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=3,
+        default=(2, 256, 256),
+        metavar=("PULSES", "PX", "PY"),
+        help="Shape of the simulated frames",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default=config["sim_dtype"],
+        choices=DTYPES,
+        help="dtype of the simulated frames",
+    )
+    parser.add_argument(
+        "--bank_size",
+        type=int,
+        default=config["sim_bank_size"],
+        help="Patterns computed in advance and cycled through by the simulator",
+    )
+    parser.add_argument(
+        "--no_noise",
+        action="store_true",
+        help="Send simulated patterns without adding noise",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=config["metrics_port"],
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics, "
+        "negative to disable",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=str,
+        default="INFO",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        help="DEBUG logs every frame",
+    )
 
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(name)s %(message)s")
     host = args.hostname
     port = args.port
 
-    app = Application(host, port)
+    representation = {}
+    if args.edges is not None:
+        representation["edges"] = args.edges
+    if args.image_dtype is not None:
+        representation["image_dtype"] = args.image_dtype
+
+    app = Application(
+        host,
+        port,
+        transport=args.transport,
+        policy=args.policy,
+        sock=args.sock,
+        hwm=args.hwm,
+        n_workers=args.workers,
+        reorder_window=args.reorder_window,
+        late_policy=args.late_policy,
+        n_threads=args.threads,
+        edge_executor=args.edge_executor,
+        representation=representation,
+        rolling_window=args.rolling_window,
+        on_pulses=args.on_pulses,
+        off_pulses=args.off_pulses,
+        record_dir=args.record,
+        frames_per_file=args.frames_per_file,
+        replay=args.replay,
+        data_shape=tuple(args.shape),
+        simulator_options=dict(
+            rate=config["sim_rate"] if args.rate is None else args.rate,
+            dtype=args.dtype,
+            bank_size=args.bank_size,
+            noise=not args.no_noise,
+        ),
+        metrics_port=args.metrics_port if args.metrics_port >= 0 else None,
+        latency_budget=args.latency_budget,
+        ladder=tuple(args.ladder),
+        redis_address=(
+            (args.redis_host, args.redis_port) if args.redis_host is not None else None
+        ),
+        replay_options=dict(
+            dataset=args.dataset,
+            rate=config["replay_rate"] if args.rate is None else args.rate,
+            speed=args.speed,
+            loop=args.loop,
+            start=args.start,
+        ),
+    )
     try:
         app.start_app()
     except KeyboardInterrupt:
@@ -134,9 +673,26 @@ def start_pipeline():
 
 def start_test_client():
     import matplotlib.pyplot as plt
-    import numpy as np
 
-    client = DataClient("tcp://127.0.0.1:54055")
+    parser = argparse.ArgumentParser(prog="test client")
+    parser.add_argument(
+        "--endpoint", type=str, default="tcp://127.0.0.1:54055", help="ZMQ endpoint"
+    )
+    parser.add_argument(
+        "--sock",
+        type=str,
+        choices=["REQ", "SUB", "PULL"],
+        default="REQ",
+        help="Must pair with the --sock of start_pipeline",
+    )
+    args = parser.parse_args()
+
+    client = DataClient(
+        args.endpoint,
+        sock=args.sock,
+        conflate=args.sock == "SUB",
+        representation=dict(edges="count"),
+    )
     fig = plt.figure(figsize=(8, 8), constrained_layout=True)
     gs = fig.add_gridspec(2, 2)
     ax1 = fig.add_subplot(gs[0, 0])
@@ -147,7 +703,7 @@ def start_test_client():
         msg = client.next()
         ax1.imshow(msg.mean_image, cmap="jet")
         ax1.set_title("Raw image")
-        ax2.imshow(np.mean(msg.edges, axis=0), cmap="gray")
+        ax2.imshow(msg.edge_occupancy(), cmap="gray")
         ax2.set_title("Edge detection")
         for i in range(msg.intensities.shape[0]):
             ax3.plot(msg.momentum, msg.intensities[i], label=f"Pulse {i}")
@@ -155,7 +711,7 @@ def start_test_client():
         ax3.set_xlabel("q")
         ax3.set_ylabel("I(q)")
         ax3.legend(loc="upper left")
-        fig.suptitle(f"Processed image : {msg.timestamp}")
+        fig.suptitle(f"Processed image : {msg.timestamp} #{msg.frame}")
         plt.pause(0.01)
         plt.cla()
 
@@ -165,7 +721,7 @@ def start_dash_client():
     # app = DashApp('127.0.0.1', 54055)
     app = DashApp()
 
-    app._app.run_server(debug=False)
+    app._app.run(debug=False)
 
 
 if __name__ == "__main__":
@@ -6,11 +6,47 @@ config = dict(
     distance=0.2,
     mask_rng=[0, 20],
     int_rng=[0.0, 5],
-    int_mthds=["BBox", "numpy", "cython", "splitpixel", "csr", "lut"],
+    int_mthds=["BBox", "numpy", "cython", "splitpixel", "csr", "lut", "batch_csr"],
     int_pts=512,
+    max_int_pts=4096,
     port=54055,
     hostname="127.0.0.1",
+    sock="REQ",
     TIME_OUT=1.0,
+    handoff_policy="block",
+    dispatch_policy="latest-wins",
+    n_workers=1,
+    join_timeout=5.0,
+    n_threads=None,
+    edge_executor="thread",
+    integrator_cache_size=4,
+    config_poll_interval=1.0,
+    image_dtype="float32",
+    edge_formats=("packed", "count"),
+    heatmap_max_side=256,
+    frame_cache_size=4,
+    receive_interval=0.1,
+    push_updates=True,
+    push_heartbeat=15.0,
+    stats_bins=100,
+    stats_range=(0, 20),
+    stats_trend_length=500,
+    stats_percentiles=(1, 50, 99),
+    rolling_window=100,
+    on_pulses=":",
+    off_pulses=None,
+    record_frames_per_file=1000,
+    record_buffer=64,
+    record_compression="lzf",
+    replay_rate=10.0,
+    sim_rate=2.0,
+    sim_dtype="float64",
+    sim_bank_size=16,
+    latency_percentiles=(50, 99),
+    metrics_port=9100,
+    latency_budget=None,
+    backpressure_ladder=("block", "decimate:2", "decimate:4", "decimate:8"),
+    backpressure_interval=1.0,
 )
 
 
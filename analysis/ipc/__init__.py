@@ -0,0 +1,23 @@
+from .backpressure import LADDER, BackpressureController
+from .handoff import SHUTDOWN, HandOff, is_shutdown, parse_policy
+from .shared_ring import (
+    SharedMemoryQueue,
+    SharedRingBuffer,
+    SlotDescriptor,
+    StaleSlotError,
+    payload_nbytes,
+)
+
+__all__ = [
+    "BackpressureController",
+    "HandOff",
+    "LADDER",
+    "SHUTDOWN",
+    "is_shutdown",
+    "parse_policy",
+    "SharedMemoryQueue",
+    "SharedRingBuffer",
+    "SlotDescriptor",
+    "StaleSlotError",
+    "payload_nbytes",
+]
@@ -0,0 +1,124 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import time
+
+from analysis.ipc.handoff import parse_policy
+
+# least to most frames shed, decimating keeps an even sample of the frames
+LADDER = ("block", "decimate:2", "decimate:4", "decimate:8")
+
+# policies a controller may switch to, which never discard queued frames
+LADDER_POLICIES = ("block", "decimate")
+
+
+class BackpressureController:
+    """Switch the policy of the source's HandOff by the latency downstream
+
+    Every interval the mean emit to processed latency of the frames
+    processed in it is compared with the budget. Above it, the controller
+    steps up the ladder to a policy which sheds more frames. Below
+    recover * budget for patience intervals, it steps back down. The
+    interval after a switch is not judged, its frames were mostly queued
+    under the previous policy.
+
+    Runs in the source process, which calls update before every put.
+
+    Parameters
+    ----------
+    metrics: BackpressureMetrics
+        Latency measured by the processors, and where decisions go
+    budget: float
+        Seconds from emit to processed
+    ladder: tuple
+        HandOff policies, from the one used within budget to the most lossy.
+        Only block and decimate:N, see LADDER_POLICIES
+    interval: float
+        Seconds between decisions
+    patience: int
+        Intervals well within budget before stepping down
+    recover: float
+        Fraction of the budget latency must be below to step down
+    """
+
+    def __init__(
+        self, metrics, budget, ladder=LADDER, interval=1.0, patience=3, recover=0.5
+    ):
+        for spec in ladder:
+            if parse_policy(spec)[0] not in LADDER_POLICIES:
+                raise ValueError(
+                    f"Policy {spec} can not be on the ladder, use {LADDER_POLICIES}"
+                )
+        if budget <= 0:
+            raise ValueError(f"Latency budget must be positive, got {budget}")
+
+        self._metrics = metrics
+        self._budget = budget
+        self._ladder = tuple(ladder)
+        self._interval = interval
+        self._patience = patience
+        self._recover = recover
+
+        self.level = 0
+        self._next = None
+        self._totals = None
+        self._calm = 0
+        self._settling = False
+
+    @property
+    def policy(self):
+        return self._ladder[self.level]
+
+    def _start_interval(self, now, handoff):
+        if handoff.policy != self.policy:
+            handoff.set_policy(self.policy)
+        self._next = now + self._interval
+        self._totals = self._metrics.processed()
+
+    def update(self, handoff, now=None):
+        """Switch the policy of handoff if an interval is over
+
+        The first call puts handoff on the first policy of the ladder.
+        Returns the latency the decision was based on, None if no decision
+        was made.
+        """
+        now = time.monotonic() if now is None else now
+        if self._next is None:
+            self._start_interval(now, handoff)
+            self._metrics.decided(self.level, 0.0)
+            return None
+        if now < self._next:
+            return None
+        if self._settling:
+            self._settling = False
+            self._start_interval(now, handoff)
+            return None
+
+        frames, seconds = self._metrics.processed()
+        n = frames - self._totals[0]
+        if not n:
+            # nothing was processed, no evidence either way
+            self._next = now + self._interval
+            return None
+        latency = (seconds - self._totals[1]) / n
+
+        level = self.level
+        if latency > self._budget:
+            self._calm = 0
+            level = min(level + 1, len(self._ladder) - 1)
+        elif latency < self._recover * self._budget:
+            self._calm += 1
+            if self._calm >= self._patience and level > 0:
+                self._calm = 0
+                level -= 1
+        else:
+            self._calm = 0
+
+        self._settling = level != self.level
+        self.level = level
+        self._metrics.decided(level, latency)
+        self._start_interval(now, handoff)
+        return latency
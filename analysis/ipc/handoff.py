@@ -0,0 +1,173 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import queue
+
+# Payload that tells the consumer the producer has stopped. Shaped like a
+# (meta, arrays) payload so that it passes through SharedMemoryQueue.
+SHUTDOWN = ({"shutdown": True}, {})
+
+
+def parse_policy(spec):
+    """(policy, decimation) of a policy spec, e.g. "decimate:4\""""
+    policy, _, n = spec.partition(":")
+    if policy not in HandOff.policies:
+        raise ValueError(f"Unknown policy {policy}. Use one of {HandOff.policies}")
+    if n and policy != "decimate":
+        raise ValueError(f"Only decimate takes a number, got {spec}")
+    decimation = int(n) if n else 2
+    if decimation < 1:
+        raise ValueError(f"Decimation must be positive, got {spec}")
+    return policy, decimation
+
+
+def is_shutdown(item):
+    return (
+        isinstance(item, tuple)
+        and isinstance(item[0], dict)
+        and item[0].get("shutdown", False)
+    )
+
+
+class HandOff:
+    """Blocking hand-off of payloads from one pipeline stage to the next
+
+    Waits block on the queue with a timeout instead of spinning on
+    get_nowait/put_nowait, the timeout only bounds how long it takes to
+    notice the stop event.
+
+    Parameters
+    ----------
+    data_queue: queue like
+        mp.Queue, queue.Queue or SharedMemoryQueue
+    policy: str
+        What put does when the queue is full:
+        "block": wait until there is room.
+        "drop-newest": discard the payload being put.
+        "drop-oldest": discard the oldest queued payload to make room.
+        "latest-wins": discard every queued payload, so that the consumer
+            always gets the most recent one.
+        "decimate:N": only put every Nth payload, waiting for room as
+            "block", and discard the others. N is 2 if left out.
+        Can be switched between puts, see set_policy.
+    timeout: float
+        Seconds between checks of the stop event while waiting.
+    stop_event: threading.Event or mp.Event
+        Set to abandon waiting, optional.
+    """
+
+    policies = ("block", "drop-newest", "drop-oldest", "latest-wins", "decimate")
+
+    def __init__(self, data_queue, policy="block", timeout=0.1, stop_event=None):
+        self._queue = data_queue
+        self._timeout = timeout
+        self._stop_event = stop_event
+        self.set_policy(policy)
+
+        self.n_dropped = 0
+
+    @property
+    def policy(self):
+        return self._spec
+
+    def set_policy(self, policy):
+        """Switch to policy, a spec as taken by __init__"""
+        self._policy, self._decimation = parse_policy(policy)
+        self._spec = policy
+        # the next payload is put when decimating
+        self._since_put = 0
+
+    def _stopped(self):
+        return self._stop_event is not None and self._stop_event.is_set()
+
+    def _discard(self, n=1):
+        for _ in range(n):
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+            # a dropped payload is done with, its slot in shared memory is
+            # free again. Slots held by consumers stay taken
+            self.release()
+            self.n_dropped += 1
+
+    def put(self, item):
+        """Put item on the queue following the policy
+
+        Returns False if the stop event was set before item could be put.
+        """
+        if self._policy == "decimate":
+            if self._since_put % self._decimation:
+                self._since_put += 1
+                self.n_dropped += 1
+                return True
+            self._since_put = 1
+
+        while True:
+            try:
+                if self._policy in ("block", "decimate"):
+                    self._queue.put(item, timeout=self._timeout)
+                else:
+                    self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self._stopped():
+                    return False
+
+            if self._policy == "drop-newest":
+                self.n_dropped += 1
+                return True
+            if self._policy == "drop-oldest":
+                self._discard()
+            elif self._policy == "latest-wins":
+                self._discard(self._queue.qsize() or 1)
+
+    def get(self):
+        """Block until a payload arrives
+
+        Returns None once the producer sent SHUTDOWN or the stop event is set.
+        """
+        while not self._stopped():
+            try:
+                item = self._queue.get(timeout=self._timeout)
+            except queue.Empty:
+                continue
+
+            if is_shutdown(item):
+                return None
+            return item
+
+        return None
+
+    def release(self):
+        """Done with the payload got last, see SharedMemoryQueue.release"""
+        release = getattr(self._queue, "release", None)
+        if release is not None:
+            release()
+
+    def shutdown(self):
+        """Send SHUTDOWN to the consumer after whatever it has not read yet
+
+        Payloads queued are results of other producers as well, so none is
+        dropped to make room. Gives up once the stop event is set and the
+        queue stayed full for timeout, the consumer is stopping anyway. Once
+        stopped, nothing still buffered for the consumer keeps the process
+        from exiting.
+        """
+        while True:
+            try:
+                self._queue.put(SHUTDOWN, timeout=self._timeout)
+                break
+            except queue.Full:
+                if self._stopped():
+                    break
+
+        if self._stopped():
+            # the consumer may never read the payloads still in the pipe of
+            # an mp.Queue, the process must not wait for them on exit
+            cancel_join_thread = getattr(self._queue, "cancel_join_thread", None)
+            if cancel_join_thread is not None:
+                cancel_join_thread()
@@ -0,0 +1,274 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import multiprocessing as mp
+import queue
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_ALIGNMENT = 64
+
+# Small handle sent through the queue in place of the arrays. fields is a
+# tuple of (name, dtype string, shape, offset into the slot).
+SlotDescriptor = namedtuple("SlotDescriptor", ["slot", "seq", "fields"])
+
+
+def _align(nbytes):
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def payload_nbytes(arrays):
+    """Number of bytes a dict of arrays occupies inside a slot"""
+    return sum(_align(np.asarray(arr).nbytes) for arr in arrays.values())
+
+
+class StaleSlotError(queue.Empty):
+    """Slot was overwritten before the reader got to it.
+
+    A lapped frame is as good as no frame, hence it derives from
+    queue.Empty so consumers can treat both cases alike."""
+
+
+class SharedRingBuffer:
+    """Fixed size slots in one block of shared memory
+
+    The block starts with one int64 sequence number per slot, followed by
+    the slots. A writer takes a free slot, copies its arrays in and then
+    publishes the sequence number of the slot. The slot stays taken until
+    the reader which is done with it, or which dropped it, calls release,
+    so arrays read without a copy are never overwritten while in use.
+    Readers still compare the sequence number with the one in the
+    descriptor to detect a slot reused because it was released too early.
+    """
+
+    def __init__(self, n_slots, slot_nbytes):
+        if n_slots < 2:
+            raise ValueError("Ring buffer needs at least two slots")
+
+        self._n_slots = n_slots
+        self._slot_nbytes = _align(int(slot_nbytes))
+        self._header_nbytes = _align(n_slots * np.dtype(np.int64).itemsize)
+
+        size = self._header_nbytes + n_slots * self._slot_nbytes
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        # shared by every writer process to number the payloads
+        self._cursor = mp.Value("q", 0)
+        # 1 for slots being written, queued or read, guarded by _cursor's
+        # lock. _n_free counts the others
+        self._taken = mp.RawArray("b", n_slots)
+        self._n_free = mp.Semaphore(n_slots)
+
+        self._attach()
+        self._seqs[:] = 0
+
+    def _attach(self):
+        self._seqs = np.ndarray((self._n_slots,), dtype=np.int64, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_seqs"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    @property
+    def n_slots(self):
+        return self._n_slots
+
+    @property
+    def slot_nbytes(self):
+        return self._slot_nbytes
+
+    def fits(self, arrays):
+        return payload_nbytes(arrays) <= self._slot_nbytes
+
+    def write(self, arrays, block=True, timeout=None):
+        """Copy arrays into a free slot and return its descriptor
+
+        Raises queue.Full if no slot was released in time.
+        """
+        if not self._n_free.acquire(block, timeout):
+            raise queue.Full
+        with self._cursor.get_lock():
+            self._cursor.value += 1
+            seq = self._cursor.value
+            slot = self._taken[:].index(0)
+            self._taken[slot] = 1
+
+        base = self._header_nbytes + slot * self._slot_nbytes
+        # negative sequence number marks a slot which is being written
+        self._seqs[slot] = -seq
+
+        fields = []
+        offset = 0
+        for name, arr in arrays.items():
+            arr = np.asarray(arr)
+            dst = np.ndarray(
+                arr.shape, dtype=arr.dtype, buffer=self._shm.buf, offset=base + offset
+            )
+            dst[...] = arr
+            fields.append((name, arr.dtype.str, arr.shape, offset))
+            offset += _align(arr.nbytes)
+
+        self._seqs[slot] = seq
+        return SlotDescriptor(slot, seq, tuple(fields))
+
+    def read(self, desc, copy=False):
+        """Return dict of arrays described by desc
+
+        Without copy the arrays are views into the slot and stay valid only
+        until the slot is released.
+        """
+        if not self.is_current(desc):
+            raise StaleSlotError(f"Slot {desc.slot} overwritten (seq {desc.seq})")
+
+        base = self._header_nbytes + desc.slot * self._slot_nbytes
+        arrays = {}
+        for name, dtype, shape, offset in desc.fields:
+            arr = np.ndarray(
+                shape, dtype=dtype, buffer=self._shm.buf, offset=base + offset
+            )
+            arrays[name] = arr.copy() if copy else arr
+
+        if copy and not self.is_current(desc):
+            raise StaleSlotError(f"Slot {desc.slot} overwritten (seq {desc.seq})")
+        return arrays
+
+    def is_current(self, desc):
+        return self._seqs[desc.slot] == desc.seq
+
+    def release(self, desc):
+        """Hand the slot of desc back for writing"""
+        with self._cursor.get_lock():
+            if not self._taken[desc.slot] or self._seqs[desc.slot] != desc.seq:
+                return
+            self._taken[desc.slot] = 0
+        self._n_free.release()
+
+    def close(self):
+        self._seqs = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+class SharedMemoryQueue:
+    """Queue of (meta, arrays) payloads for the raw and processed data hops
+
+    In "shm" mode arrays are written into a SharedRingBuffer and only meta
+    and a SlotDescriptor are pickled through the underlying mp.Queue.
+    Payloads which do not fit into a slot, and all payloads in "pickle"
+    mode, are sent inline through the mp.Queue instead.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of payloads in flight in the queue.
+    slot_nbytes: int
+        Size of one slot. Required in "shm" mode.
+    n_consumers: int
+        Number of processes reading from the queue. Together with maxsize
+        it decides how many slots are needed so that writers do not wait
+        for a slot while the queue has room.
+    mode: str
+        "shm" or "pickle"
+    copy: bool
+        Copy arrays out of shared memory on get, the slot is released
+        straight away. Needed when the consumer keeps the arrays around.
+
+    Without copy, the arrays got are views into a slot which is held
+    until release is called, or the next get of the same process. Payloads
+    dropped by the consumer or by a HandOff policy must be released too.
+    """
+
+    modes = ("shm", "pickle")
+
+    def __init__(
+        self, maxsize=1, slot_nbytes=None, n_consumers=1, mode="shm", copy=False
+    ):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown transport mode {mode}. Use one of {self.modes}")
+
+        # Capacity is tracked apart from the mp.Queue so that a slot is only
+        # claimed once there is room for its descriptor; retrying a put on a
+        # full queue must not cycle through (and overwrite) queued slots.
+        self._capacity = mp.BoundedSemaphore(maxsize)
+        self._queue = mp.Queue()
+        self._mode = mode
+        self._copy = copy
+        self._ring = None
+        # slot of the payload this process got last, until released
+        self._held = None
+
+        if mode == "shm":
+            if slot_nbytes is None:
+                raise ValueError("slot_nbytes is required for shared memory mode")
+            # slots queued + one being read per consumer + one being written
+            n_slots = maxsize + n_consumers + 1
+            self._ring = SharedRingBuffer(n_slots, slot_nbytes)
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def put(self, item, block=True, timeout=None):
+        if not self._capacity.acquire(block, timeout):
+            raise queue.Full
+
+        meta, arrays = item
+        if self._ring is not None and arrays and self._ring.fits(arrays):
+            try:
+                arrays = self._ring.write(arrays, block, timeout)
+            except queue.Full:
+                self._capacity.release()
+                raise
+        self._queue.put((meta, arrays))
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        self.release()
+        meta, arrays = self._queue.get(block, timeout)
+        self._capacity.release()
+        if isinstance(arrays, SlotDescriptor):
+            desc = arrays
+            try:
+                arrays = self._ring.read(desc, copy=self._copy)
+            finally:
+                if self._copy:
+                    self._ring.release(desc)
+                else:
+                    self._held = desc
+        return meta, arrays
+
+    def release(self):
+        """Hand the slot of the payload got last back to the writers"""
+        if self._held is not None:
+            self._ring.release(self._held)
+            self._held = None
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def cancel_join_thread(self):
+        """Exit this process without flushing what it put, see mp.Queue"""
+        self._queue.cancel_join_thread()
+
+    def close(self):
+        self._queue.close()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring.unlink()
+            self._ring = None
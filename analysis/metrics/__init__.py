@@ -0,0 +1,17 @@
+from .latency import STAGES, LatencyTracker, stamp
+from .pipeline import BackpressureMetrics, LoopMetrics, PipelineMetrics
+from .registry import Counter, Gauge, Histogram, MetricsRegistry, MetricsServer
+
+__all__ = [
+    "BackpressureMetrics",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "LatencyTracker",
+    "LoopMetrics",
+    "MetricsRegistry",
+    "MetricsServer",
+    "PipelineMetrics",
+    "STAGES",
+    "stamp",
+]
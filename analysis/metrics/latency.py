@@ -0,0 +1,131 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import threading
+import time
+
+import numpy as np
+
+# hops a frame is stamped at, in the order it passes them. Frames carry a
+# trace dict of stage: time.time_ns(), wall clock rather than monotonic so
+# that stamps of clients on other hosts compare, given synchronized clocks
+STAGES = (
+    "emit",  # DataSimulator or ReplaySource put it on the raw queue
+    "dequeue",  # DataProcessor took it off the raw queue
+    "integrated",
+    "edges",
+    "processed",  # statistics and compaction done, put on the processed queue
+    "collected",  # Application got it back in frame order
+    "sent",  # DataStreamer sent it
+    "received",  # DataClient decoded it
+)
+
+
+def stamp(trace, stage):
+    """Record the time frame tracing dict trace passed stage"""
+    if trace is not None:
+        trace[stage] = time.time_ns()
+    return trace
+
+
+class LatencyHistogram:
+    """Durations in fixed log spaced bins, from 1 us to 100 s
+
+    Parameters
+    ----------
+    bins_per_decade: int
+    """
+
+    def __init__(self, bins_per_decade=20):
+        self.bin_edges = np.logspace(3, 11, 8 * bins_per_decade + 1)
+        self.counts = np.zeros(len(self.bin_edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, ns):
+        i = np.searchsorted(self.bin_edges, ns, side="right") - 1
+        if i < 0:
+            self.underflow += 1
+        elif i >= len(self.counts):
+            self.overflow += 1
+        else:
+            self.counts[i] += 1
+
+    @property
+    def count(self):
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+    def percentiles(self, percentiles):
+        """In ns, interpolated within bins, which are 12% wide at 20 per decade
+
+        Durations beyond the bins are clipped to the bin range.
+        """
+        cdf = np.concatenate(
+            ([self.underflow], self.underflow + np.cumsum(self.counts))
+        )
+        targets = np.asarray(percentiles, dtype=np.float64) / 100.0 * self.count
+        return np.interp(targets, cdf, self.bin_edges)
+
+
+class LatencyTracker:
+    """Per stage latency histograms of traced frames
+
+    Two durations are kept for each stage: the interval since the stage
+    before it, e.g. the integration time at "integrated", and the age of
+    the frame since "emit". Stages may be recorded by several threads.
+
+    Parameters
+    ----------
+    percentiles: tuple
+        Reported by summary()
+    """
+
+    def __init__(self, percentiles=(50, 99)):
+        self._percentiles = tuple(percentiles)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._intervals = {stage: LatencyHistogram() for stage in STAGES[1:]}
+            self._ages = {stage: LatencyHistogram() for stage in STAGES[1:]}
+
+    def record(self, trace, stages):
+        """Add the durations of trace ending at stages"""
+        if not trace:
+            return
+        with self._lock:
+            for stage in stages:
+                if stage not in trace:
+                    continue
+                i = STAGES.index(stage)
+                previous = next((s for s in reversed(STAGES[:i]) if s in trace), None)
+                if previous is not None:
+                    self._intervals[stage].add(trace[stage] - trace[previous])
+                if "emit" in trace:
+                    self._ages[stage].add(trace[stage] - trace["emit"])
+
+    def summary(self):
+        """{stage: {"count", "interval", "age"}} with percentiles in ms"""
+        out = {}
+        with self._lock:
+            for stage in STAGES[1:]:
+                interval, age = self._intervals[stage], self._ages[stage]
+                if not interval.count and not age.count:
+                    continue
+                out[stage] = dict(
+                    count=max(interval.count, age.count),
+                    interval=self._in_ms(interval),
+                    age=self._in_ms(age),
+                )
+        return out
+
+    def _in_ms(self, histogram):
+        if not histogram.count:
+            return None
+        values = histogram.percentiles(self._percentiles) / 1e6
+        # string keys survive JSON
+        return {str(p): float(v) for p, v in zip(self._percentiles, values)}
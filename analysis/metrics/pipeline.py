@@ -0,0 +1,187 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import itertools
+
+from analysis.metrics.registry import MetricsRegistry
+
+
+class LoopMetrics:
+    """Metrics of one pipeline loop, handed to the process running it
+
+    Only holds handles on slots in shared memory, so it can be passed to
+    mp.Process like the other shared counters of the pipeline.
+    """
+
+    def __init__(self, frames, dropped, wait, work, frame_work, latency):
+        self._frames = frames
+        self._dropped = dropped
+        self._wait = wait
+        self._work = work
+        self._frame_work = frame_work
+        self._latency = latency
+
+    def waited(self, seconds):
+        """Time blocked on a queue or a pacing schedule"""
+        self._wait.inc(seconds)
+
+    def worked(self, seconds):
+        self._work.inc(seconds)
+
+    def frame(self, seconds, dropped=None, latency=None):
+        """A frame was handed on after seconds of work
+
+        dropped: int
+            Total of frames dropped by the loop so far, e.g. HandOff.n_dropped
+        latency: float
+            Seconds since the frame was emitted, for loops which see its trace
+        """
+        self._frames.inc()
+        self._work.inc(seconds)
+        self._frame_work.observe(seconds)
+        if dropped is not None:
+            self._dropped.set(dropped)
+        if latency is not None:
+            self._latency.observe(latency)
+
+
+class BackpressureMetrics:
+    """Latency a BackpressureController goes by and its decisions
+
+    Handed to the source process like LoopMetrics.
+    """
+
+    def __init__(self, registry, ladder, n_workers):
+        self._ladder = tuple(ladder)
+        self._latency = registry["pipeline_frame_latency_seconds"]
+        self._workers = [str(i) for i in range(n_workers)]
+        self._level = registry["pipeline_backpressure_level"].labels()
+        self._policies = [
+            registry["pipeline_backpressure_policy"].labels(spec)
+            for spec in self._ladder
+        ]
+        self._measured = registry["pipeline_backpressure_latency_seconds"].labels()
+        self._switches = registry["pipeline_backpressure_switches_total"]
+
+    def processed(self):
+        """(frames, seconds) totals of emit to processed latency of the workers"""
+        totals = [self._latency.totals("processor", w) for w in self._workers]
+        return tuple(map(sum, zip(*totals)))
+
+    @property
+    def level(self):
+        return int(self._level.value)
+
+    @property
+    def policy(self):
+        return self._ladder[self.level]
+
+    def decided(self, level, latency):
+        """Policy at level of the ladder was chosen for the latency measured"""
+        previous = self.level
+        if level != previous:
+            direction = "up" if level > previous else "down"
+            self._switches.labels(direction).inc()
+            self._policies[previous].set(0)
+        self._policies[level].set(1)
+        self._level.set(level)
+        self._measured.set(latency)
+
+
+class PipelineMetrics(MetricsRegistry):
+    """Registry with the metrics of each loop of the pipeline
+
+    Parameters
+    ----------
+    n_workers: int
+        Number of DataProcessors, each gets a slot of its own
+    ladder: tuple
+        Policies of a BackpressureController, to register the metrics of
+        its decisions. None without a controller.
+    """
+
+    def __init__(self, n_workers=1, ladder=None):
+        super().__init__()
+        self._n_workers = n_workers
+        self._ladder = ladder
+        self.loops = (
+            [("source", "")]
+            + [("processor", str(i)) for i in range(n_workers)]
+            + [("application", ""), ("streamer", "")]
+        )
+        labels = ("loop", "worker")
+        self.counter(
+            "pipeline_frames_total",
+            "Frames handed on by each loop",
+            labels,
+            self.loops,
+        )
+        self.counter(
+            "pipeline_dropped_total",
+            "Frames dropped by each loop on a full queue",
+            labels,
+            self.loops,
+        )
+        self.counter(
+            "pipeline_loop_seconds_total",
+            "Seconds each loop spent waiting and working",
+            labels + ("state",),
+            [
+                loop + (state,)
+                for loop, state in itertools.product(self.loops, ("wait", "work"))
+            ],
+        )
+        self.histogram(
+            "pipeline_frame_work_seconds",
+            "Seconds of work per frame of each loop",
+            labels,
+            self.loops,
+        )
+        self.histogram(
+            "pipeline_frame_latency_seconds",
+            "Seconds from emit until each loop handed a frame on",
+            labels,
+            self.loops,
+        )
+        if ladder is not None:
+            self.gauge(
+                "pipeline_backpressure_level",
+                "Step of the backpressure ladder the source is on",
+            )
+            self.gauge(
+                "pipeline_backpressure_policy",
+                "1 for the hand-off policy of the source, 0 for the others",
+                ("policy",),
+                [(spec,) for spec in ladder],
+            )
+            self.gauge(
+                "pipeline_backpressure_latency_seconds",
+                "Mean emit to processed latency of the last decision",
+            )
+            self.counter(
+                "pipeline_backpressure_switches_total",
+                "Steps up or down the backpressure ladder",
+                ("direction",),
+                [("up",), ("down",)],
+            )
+
+    def loop(self, name, worker=""):
+        """LoopMetrics of the loop name"""
+        worker = str(worker)
+        return LoopMetrics(
+            self["pipeline_frames_total"].labels(name, worker),
+            self["pipeline_dropped_total"].labels(name, worker),
+            self["pipeline_loop_seconds_total"].labels(name, worker, "wait"),
+            self["pipeline_loop_seconds_total"].labels(name, worker, "work"),
+            self["pipeline_frame_work_seconds"].labels(name, worker),
+            self["pipeline_frame_latency_seconds"].labels(name, worker),
+        )
+
+    def backpressure(self):
+        """BackpressureMetrics of the ladder given to __init__"""
+        if self._ladder is None:
+            raise ValueError("PipelineMetrics were set up without a ladder")
+        return BackpressureMetrics(self, self._ladder, self._n_workers)
@@ -0,0 +1,244 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import multiprocessing as mp
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# default buckets of histograms, seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{value}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Values in shared memory, one slot per combination of label values
+
+    Slots are allocated up front so that processes forked after the
+    registry was set up update them in place. Each slot must have a
+    single writer, e.g. one slot per worker, updates take no lock.
+    """
+
+    kind = None
+    _width = 1
+
+    def __init__(self, name, help_text, labelnames=(), labelvalues=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        if labelvalues is None:
+            labelvalues = [()] if not labelnames else []
+        self._slots = {
+            tuple(str(v) for v in values): i for i, values in enumerate(labelvalues)
+        }
+        self._values = mp.RawArray("d", self._width * max(len(self._slots), 1))
+
+    def _slot(self, values):
+        try:
+            return self._slots[tuple(str(v) for v in values)]
+        except KeyError:
+            raise KeyError(f"{self.name} has no slot for labels {values}")
+
+    def labels(self, *values):
+        """Handle on the slot of values, to update it without a lookup"""
+        return _Child(self, self._slot(values))
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) for exposition"""
+        for values, i in self._slots.items():
+            yield "", values, (), self._values[i]
+
+
+class _Child:
+    def __init__(self, metric, slot):
+        self._metric = metric
+        self._slot = slot
+
+    def inc(self, amount=1.0):
+        self._metric._values[self._slot] += amount
+
+    def set(self, value):
+        self._metric._values[self._slot] = value
+
+    def observe(self, value):
+        self._metric._observe(self._slot, value)
+
+    @property
+    def value(self):
+        return self._metric._values[self._slot]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0):
+        self._values[self._slot(())] += amount
+
+
+class Gauge(_Metric):
+    """Set by its writer, or read from callback when scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), labelvalues=None, callback=None):
+        super().__init__(name, help_text, labelnames, labelvalues)
+        self._callback = callback
+
+    def set(self, value):
+        self._values[self._slot(())] = value
+
+    def samples(self):
+        if self._callback is None:
+            yield from super().samples()
+            return
+        # callback returns {label values: value}, or a number without labels
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield "", tuple(str(v) for v in key), (), value
+
+
+class Histogram(_Metric):
+    """Counts in fixed buckets, their sum and count, per slot"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name, help_text, labelnames=(), labelvalues=None, buckets=DURATION_BUCKETS
+    ):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per slot: one count per bucket, then sum
+        self._width = len(self.buckets) + 1
+        super().__init__(name, help_text, labelnames, labelvalues)
+        self._edges = np.asarray(self.buckets[:-1])
+
+    def _observe(self, slot, value):
+        base = slot * self._width
+        self._values[base + int(np.searchsorted(self._edges, value))] += 1
+        self._values[base + self._width - 1] += value
+
+    def observe(self, value):
+        self._observe(self._slot(()), value)
+
+    def totals(self, *values):
+        """(count, sum) of the observations of the slot of values"""
+        base = self._slot(values) * self._width
+        count = sum(self._values[base : base + len(self.buckets)])
+        return count, self._values[base + self._width - 1]
+
+    def samples(self):
+        for values, slot in self._slots.items():
+            base = slot * self._width
+            counts = self._values[base : base + len(self.buckets)]
+            cumulative = np.cumsum(counts)
+            for le, count in zip(self.buckets, cumulative):
+                yield "_bucket", values, (("le", _format_value(le)),), count
+            yield "_sum", values, (), self._values[base + self._width - 1]
+            yield "_count", values, (), cumulative[-1]
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms of the pipeline
+
+    Set up before the processes which update them are started. Exposed in
+    the Prometheus text format by exposition() and MetricsServer.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), labelvalues=None):
+        return self._add(Counter(name, help_text, labelnames, labelvalues))
+
+    def gauge(self, name, help_text, labelnames=(), labelvalues=None, callback=None):
+        return self._add(Gauge(name, help_text, labelnames, labelvalues, callback))
+
+    def histogram(
+        self, name, help_text, labelnames=(), labelvalues=None, buckets=DURATION_BUCKETS
+    ):
+        return self._add(Histogram(name, help_text, labelnames, labelvalues, buckets))
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def exposition(self):
+        """Prometheus text format, version 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, values, extra, value in metric.samples():
+                labels = _format_labels(metric.labelnames, values, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """Serve the metrics of a registry on http://host:port/metrics
+
+    Parameters
+    ----------
+    registry: MetricsRegistry
+    host: str
+        Local only by default
+    port: int
+        0 to pick a free port, see address
+    """
+
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        super().__init__(daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def run(self):
+        self._server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        if self.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
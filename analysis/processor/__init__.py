@@ -1,4 +1,5 @@
 from .data_processor import DataProcessor
 from .data_simulator import DataSimulator
+from .processor_pool import ProcessorPool, ReorderBuffer
 
-__all__ = ["DataProcessor", "DataSimulator"]
+__all__ = ["DataProcessor", "DataSimulator", "ProcessorPool", "ReorderBuffer"]
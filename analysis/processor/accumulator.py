@@ -0,0 +1,192 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# rows of the rolling array, one column per momentum transfer
+ROLLING = ("on_mean", "on_std", "off_mean", "off_std", "difference")
+
+
+def pulse_selection(spec):
+    """Index of the pulses of a pattern
+
+    Parameters
+    ----------
+    spec: str, list or None
+        Slice as in "1::2", or pulse indices. None selects no pulse.
+    """
+    if spec is None or isinstance(spec, slice):
+        return spec
+    if isinstance(spec, str):
+        try:
+            parts = [int(p) if p.strip() else None for p in spec.split(":")]
+        except ValueError:
+            raise ValueError(f"Invalid pulse pattern {spec!r}")
+        if len(parts) == 1:
+            return [parts[0]]
+        if len(parts) > 3:
+            raise ValueError(f"Invalid pulse pattern {spec!r}")
+        return slice(*parts)
+    return [int(p) for p in spec]
+
+
+class RollingWindow:
+    """Mean and variance of the last window curves, updated in O(1)
+
+    Curves are kept in a ring. Once it is full, the oldest curve is swapped
+    for the newest with Welford's update for a replaced sample. Rounding
+    errors of these updates are discarded by recomputing the moments from
+    the ring each time it wraps.
+
+    Parameters
+    ----------
+    window: int
+    n_points: int
+        Length of the curves
+    """
+
+    def __init__(self, window, n_points):
+        if window < 1:
+            raise ValueError(f"Window must be positive, got {window}")
+        self._ring = np.zeros((window, n_points))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._head = 0
+        self.mean = np.zeros(self._ring.shape[1])
+        self._m2 = np.zeros(self._ring.shape[1])
+
+    @property
+    def window(self):
+        return self._ring.shape[0]
+
+    def push(self, curve):
+        if self.count < self.window:
+            self.count += 1
+            delta = curve - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (curve - self.mean)
+        else:
+            old = self._ring[self._head]
+            mean = self.mean + (curve - old) / self.count
+            self._m2 += (curve - old) * (curve - mean + old - self.mean)
+            self.mean = mean
+
+        self._ring[self._head] = curve
+        self._head = (self._head + 1) % self.window
+        if self._head == 0 and self.count == self.window:
+            self.mean = self._ring.mean(axis=0)
+            self._m2 = np.square(self._ring - self.mean).sum(axis=0)
+
+    @property
+    def std(self):
+        if self.count == 0:
+            return np.full_like(self.mean, np.nan)
+        # negative zero-variance rounding errors are not worth a NaN
+        return np.sqrt(np.maximum(self._m2 / self.count, 0.0))
+
+
+class IntensityAccumulator:
+    """Rolling average of I(q) over trains, for on and off pulses
+
+    The curves of the on and off pulses of each train are averaged over
+    pulses and pushed to a RollingWindow each. Starts over whenever the
+    momentum transfer axis changes, i.e. with the geometry or the
+    integration points and range.
+
+    Parameters
+    ----------
+    window: int
+        Number of trains averaged
+    on_pulses: str or list
+        Pattern of the pumped pulses, see pulse_selection. All by default.
+    off_pulses: str or list
+        Pattern of the unpumped pulses, None for no difference curves
+    """
+
+    def __init__(self, window=100, on_pulses=":", off_pulses=None):
+        self._window = window
+        self._on = pulse_selection(on_pulses)
+        self._off = pulse_selection(off_pulses)
+        self.momentum = None
+        self._windows = None
+        # pulse indices of the patterns by the number of pulses of a train
+        self._selections = {}
+
+    def reset(self):
+        self.momentum = None
+        self._windows = None
+
+    def _selection(self, n_pulses):
+        """Indices of the on and off pulses, None for a pattern without any
+
+        A pattern which selects none of n_pulses, or is out of range, is
+        warned about once and its curve is skipped.
+        """
+        if n_pulses not in self._selections:
+            selection = []
+            for name, pulses in (("on", self._on), ("off", self._off)):
+                index = None
+                if pulses is not None:
+                    try:
+                        index = np.arange(n_pulses)[pulses]
+                    except IndexError:
+                        pass
+                    if index is None or len(index) == 0:
+                        logger.warning(
+                            "%s pulse pattern selects none of %d pulses, "
+                            "its curve is skipped",
+                            name,
+                            n_pulses,
+                        )
+                        index = None
+                selection.append(index)
+            self._selections[n_pulses] = tuple(selection)
+        return self._selections[n_pulses]
+
+    def update(self, momentum, intensities):
+        """Add the (pulses, points) intensities of a train"""
+        if self.momentum is None or not np.array_equal(self.momentum, momentum):
+            self.momentum = np.array(momentum, copy=True)
+            self._windows = [
+                RollingWindow(self._window, len(momentum)),
+                RollingWindow(self._window, len(momentum)),
+            ]
+
+        for rolling, index in zip(self._windows, self._selection(len(intensities))):
+            if index is not None:
+                rolling.push(intensities[index].mean(axis=0))
+
+    @property
+    def count(self):
+        return 0 if self._windows is None else max(w.count for w in self._windows)
+
+    def rolling(self):
+        """Curves of shape (len(ROLLING), points), NaN where not selected"""
+        on, off = self._windows
+        out = np.full((len(ROLLING), len(self.momentum)), np.nan)
+        if on.count:
+            out[0], out[1] = on.mean, on.std
+        if off.count:
+            out[2], out[3] = off.mean, off.std
+        if on.count and off.count:
+            out[4] = on.mean - off.mean
+        return out
+
+    def publish(self, data):
+        """Add the rolling curves to IntegratedData"""
+        if data.momentum is None or data.intensities is None:
+            return
+        self.update(data.momentum, data.intensities)
+        data.rolling = self.rolling()
+        data.stats = dict(
+            data.stats or {}, rolling=dict(trains=self.count, window=self._window)
+        )
@@ -4,6 +4,8 @@ Calibration analysis and visualization for AGIPD Detector
 Author: Ebad Kamil <ebad.kamil@xfel.eu>
 All rights reserved.
 """
+import threading
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
@@ -11,9 +13,97 @@ import numpy as np
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 from scipy import constants
 
+from analysis.processor.masking import StackMask
+from analysis.processor.sparse_integration import BatchedCSREngine
+
+# all pulses of a frame in one sparse matrix product, see BatchedCSREngine
+BATCH_CSR = "batch_csr"
+
+
+class _CacheEntry:
+    def __init__(self, integrator):
+        self.integrator = integrator
+        # (method, range, points, shape) pyFAI already set up engines for
+        self.warm = set()
+        # BatchedCSREngine per (method, range, points, shape)
+        self.engines = {}
+        self.lock = threading.Lock()
+
+
+class IntegratorCache:
+    """LRU cache of AzimuthalIntegrator instances keyed on geometry
+
+    pyFAI keeps geometry arrays and integration engines (LUT/CSR) on the
+    AzimuthalIntegrator instance. Keeping one instance per geometry instead
+    of calling set_param on a single one means that going back to a recent
+    geometry does not rebuild any of them.
+    """
+
+    def __init__(self, maxsize=4):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, val):
+        if val < 1:
+            raise ValueError("Cache needs room for at least one integrator")
+        with self._lock:
+            self._maxsize = val
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def geometry_key(distance, poni1, poni2, wavelength, pixel_size):
+        # 9 significant digits so that float noise in how values were
+        # computed does not count as a change of geometry
+        return tuple(
+            float(f"{val:.9g}")
+            for val in (distance, poni1, poni2, wavelength, pixel_size)
+        )
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+            distance, poni1, poni2, wavelength, pixel_size = key
+            entry = _CacheEntry(
+                AzimuthalIntegrator(
+                    dist=distance,
+                    pixel1=pixel_size,
+                    pixel2=pixel_size,
+                    poni1=poni1,
+                    poni2=poni2,
+                    rot1=0,
+                    rot2=0,
+                    rot3=0,
+                    wavelength=wavelength,
+                )
+            )
+            self._entries[key] = entry
+            self._evict()
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 
 class PyFaiAzimuthalIntegrator(object):
-    def __init__(self):
+    def __init__(self, cache=None):
         self._distance = None
         self._wavelength = None
         self._poni1 = None
@@ -29,6 +119,11 @@ class PyFaiAzimuthalIntegrator(object):
         self._intensities = None
 
         self._ai_integrator = None
+        self._executor = None
+        self._cache = cache if cache is not None else IntegratorCache()
+        self._mask = StackMask()
+        # ai_config the properties were last set from
+        self.config_key = None
 
     def __get__(self, instance, cls):
         if instance is None:
@@ -38,7 +133,15 @@ class PyFaiAzimuthalIntegrator(object):
 
     def __set__(self, instance, data):
         # data is of shape (pulses, px, py)
-        integrator = self._update_integrator()
+        entry = self._update_integrator()
+        integrator = entry.integrator
+
+        if self._intg_method == BATCH_CSR:
+            mask = self._mask.build(data, self._threshold_mask, self._user_mask)
+            engine = self._batched_engine(entry, data.shape[1:])
+            self._momentum, self._intensities = engine.integrate(data, mask)
+            return
+
         itgt1d = partial(
             integrator.integrate1d,
             method=self._intg_method,
@@ -50,31 +153,30 @@ class PyFaiAzimuthalIntegrator(object):
 
         integ_points = self._intg_pts
 
-        def _integrate(i):
-            mask = np.zeros_like(data[i], dtype=np.uint8)
-            # Apply mask for nan
-            mask[np.isnan(data[i])] = 1
-            # Apply threshold mask if provided
-            if self._threshold_mask is not None:
-                low, high = self._threshold_mask
-                mask[(data[i] < low) | (data[i] > high)] = 1
-            # Apply user provided mask
-            if self._user_mask is not None:
-                image_shape = data[i].shape
-                mask_shape = self._user_mask[i].shape
-                if image_shape == mask_shape:
-                    np.logical_or(mask, self._user_mask[i], out=mask)
-                else:
-                    print(
-                        f"User provided mask {mask_shape} and "
-                        f"image {image_shape} have different shapes"
-                    )
+        # masks of all pulses at once, outside of the thread pool
+        mask = self._mask.build(data, self._threshold_mask, self._user_mask)
 
-            ret = itgt1d(data[i], integ_points, mask=mask)
+        def _integrate(i):
+            ret = itgt1d(data[i], integ_points, mask=mask[i])
             return ret.radial, ret.intensity
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            rets = executor.map(_integrate, range(data.shape[0]))
+        # pyFAI builds its geometry arrays and engine on first use, which is
+        # not thread safe. Integrate the first pulse after a change up front.
+        pulses = range(data.shape[0])
+        rets = []
+        engine_key = self._engine_key(data.shape[1:])
+        if engine_key not in entry.warm:
+            with entry.lock:
+                if engine_key not in entry.warm:
+                    rets.append(_integrate(0))
+                    pulses = pulses[1:]
+                    entry.warm.add(engine_key)
+
+        if self._executor is not None:
+            rets.extend(self._executor.map(_integrate, pulses))
+        else:
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                rets.extend(executor.map(_integrate, pulses))
 
         momentums, intensities = zip(*rets)
         self._momentum = momentums[0]
@@ -84,39 +186,83 @@ class PyFaiAzimuthalIntegrator(object):
         self._ai_integrator = None
         self._momentum = None
         self._intensities = None
+        self._cache.clear()
+        self.config_key = None
+
+    def _geometry_key(self):
+        return IntegratorCache.geometry_key(
+            self._distance,
+            self._poni1,
+            self._poni2,
+            self._wavelength,
+            self._pixel_size,
+        )
+
+    def _engine_key(self, shape):
+        return (self._intg_method, tuple(self._intg_rng), self._intg_pts, shape)
 
     def _update_integrator(self):
-        if self._ai_integrator is None:
-            self._ai_integrator = AzimuthalIntegrator(
-                dist=self._distance,
-                pixel1=self._pixel_size,
-                pixel2=self._pixel_size,
-                poni1=self._poni1,
-                poni2=self._poni2,
-                rot1=0,
-                rot2=0,
-                rot3=0,
-                wavelength=self._wavelength,
-            )
-        else:
-            if (
-                self._ai_integrator.dist != self._distance
-                or self._ai_integrator.wavelength != self._wavelength
-                or self._ai_integrator.poni1 != self._poni1
-                or self._ai_integrator.poni2 != self._poni2
-            ):
-                self._ai_integrator.set_param(
-                    (
-                        self._distance,
-                        self._poni1,
-                        self._poni2,
-                        0,
-                        0,
-                        0,
-                        self._wavelength,
+        entry = self._cache.get(self._geometry_key())
+        self._ai_integrator = entry.integrator
+        return entry
+
+    def _batched_engine(self, entry, shape):
+        engine_key = self._engine_key(tuple(shape))
+        engine = entry.engines.get(engine_key)
+        if engine is None:
+            with entry.lock:
+                engine = entry.engines.get(engine_key)
+                if engine is None:
+                    engine = BatchedCSREngine(
+                        entry.integrator,
+                        shape,
+                        self._intg_pts,
+                        self._intg_rng,
+                        unit="q_A^-1",
+                        polarization_factor=1,
                     )
-                )
-        return self._ai_integrator
+                    entry.engines[engine_key] = engine
+                    entry.warm.add(engine_key)
+        return engine
+
+    def prewarm(self, shape):
+        """Set up geometry arrays and engine for the current properties
+
+        Meant to run in the background after a configuration change, so that
+        the first frame with the new configuration does not pay for it.
+        """
+        entry = self._cache.get(self._geometry_key())
+        if self._intg_method == BATCH_CSR:
+            self._batched_engine(entry, shape)
+            return
+
+        engine_key = self._engine_key(tuple(shape))
+        with entry.lock:
+            if engine_key in entry.warm:
+                return
+            entry.integrator.integrate1d(
+                np.zeros(shape),
+                self._intg_pts,
+                method=self._intg_method,
+                radial_range=self._intg_rng,
+                correctSolidAngle=True,
+                polarization_factor=1,
+                unit="q_A^-1",
+                mask=np.zeros(shape, dtype=np.uint8),
+            )
+            entry.warm.add(engine_key)
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @executor.setter
+    def executor(self, val):
+        self._executor = val
 
     @property
     def distance(self):
@@ -162,14 +308,16 @@ class PyFaiAzimuthalIntegrator(object):
             "numpy",
             "cython",
             "BBox",
+            "splitpixel",
             "lut",
             "csr",
             "nosplit_csr",
             "full_csr",
             "lut_ocl",
+            BATCH_CSR,
         ]
         if val not in _available_methods:
-            raise ValueError("Support available methods {}")
+            raise ValueError(f"Support available methods {_available_methods}")
         self._intg_method = val
 
     @property
@@ -235,10 +383,14 @@ class ImageIntegrator:
 
     _azimuthal_integrator = PyFaiAzimuthalIntegrator()
 
-    def __init__(self):
+    def __init__(self, executor=None, cache_size=None):
 
         self.momentums = None
         self.intensities = None
+        # long lived thread pool owned by the caller, see StageExecutors
+        self.executor = executor
+        if cache_size is not None:
+            self.__class__._azimuthal_integrator.cache.maxsize = cache_size
 
     def integrate(self, ai_config, image):
         """
@@ -259,32 +411,64 @@ class ImageIntegrator:
         image: ndarray
             Shape: (pulses, px, py)
         """
-        # Set properties of _azimuthal_integrator descriptor
-        self.__class__._azimuthal_integrator.distance = ai_config["distance"]
-        self.__class__._azimuthal_integrator.wavelength = (
-            ImageIntegrator.constant / ai_config["energy"]
-        )
-        self.__class__._azimuthal_integrator.poni1 = (
-            ai_config["centrey"] * ai_config["pixel_size"]
-        )
-        self.__class__._azimuthal_integrator.poni2 = (
-            ai_config["centrex"] * ai_config["pixel_size"]
-        )
-        self.__class__._azimuthal_integrator.intg_method = ai_config["intg_method"]
-        self.__class__._azimuthal_integrator.intg_rng = ai_config["intg_rng"]
-        self.__class__._azimuthal_integrator.intg_pts = ai_config["intg_pts"]
-        self.__class__._azimuthal_integrator.pixel_size = ai_config["pixel_size"]
-        self.__class__._azimuthal_integrator.threshold_mask = ai_config.get(
-            "threshold_mask", None
-        )
-        self.__class__._azimuthal_integrator.user_mask = ai_config.get(
-            "user_mask", None
-        )
+        integrator = self.__class__._azimuthal_integrator
+        config_key = self._config_key(ai_config)
+        if config_key != integrator.config_key:
+            self._configure(integrator, ai_config)
+            integrator.config_key = config_key
+        integrator.executor = self.executor
 
         self._azimuthal_integrator = image
         self.momentums, self.intensities = self._azimuthal_integrator
         return self.momentums, np.array(self.intensities)
 
+    @staticmethod
+    def _config_key(ai_config):
+        # the user mask is compared by identity rather than by content
+        return tuple(
+            (key, id(val) if isinstance(val, np.ndarray) else val)
+            for key, val in sorted(ai_config.items())
+        )
+
+    @staticmethod
+    def _configure(integrator, ai_config):
+        # Set properties of _azimuthal_integrator descriptor
+        integrator.distance = ai_config["distance"]
+        integrator.wavelength = ImageIntegrator.constant / ai_config["energy"]
+        integrator.poni1 = ai_config["centrey"] * ai_config["pixel_size"]
+        integrator.poni2 = ai_config["centrex"] * ai_config["pixel_size"]
+        integrator.intg_method = ai_config["intg_method"]
+        integrator.intg_rng = ai_config["intg_rng"]
+        integrator.intg_pts = ai_config["intg_pts"]
+        integrator.pixel_size = ai_config["pixel_size"]
+        integrator.threshold_mask = ai_config.get("threshold_mask", None)
+        integrator.user_mask = ai_config.get("user_mask", None)
+
+    def prewarm(self, ai_config, shape, executor=None):
+        """Build integrator and engine for ai_config in the background
+
+        shape: tuple
+            Shape (px, py) of a single pulse
+        Returns a Future when an executor is given, the Thread otherwise.
+        """
+
+        def _prewarm():
+            # share the cache with _azimuthal_integrator but not its properties
+            warmer = PyFaiAzimuthalIntegrator(
+                cache=self.__class__._azimuthal_integrator.cache
+            )
+            self._configure(warmer, ai_config)
+            try:
+                warmer.prewarm(shape)
+            except Exception as ex:
+                print("[PREWARM] ", ex)
+
+        if executor is not None:
+            return executor.submit(_prewarm)
+        thread = threading.Thread(target=_prewarm, daemon=True)
+        thread.start()
+        return thread
+
 
 if __name__ == "__main__":
 
@@ -4,28 +4,71 @@ Author: Ebad Kamil <ebad.kamil@xfel.eu>
 All rights reserved.
 """
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
-from scipy import ndimage as ndi
 from skimage import feature
 
+# sigma of the Gaussian filter applied before edge detection
+PREFILTER_SIGMA = 4
+
+
+def smoothing_sigma(sigma, apply_filter=True):
+    """Sigma of the single Gaussian equivalent to the pre-filter and Canny's
+
+    Gaussians compose by adding variances, so smoothing with the pre-filter
+    and then with sigma is one smoothing with sqrt(PREFILTER_SIGMA² + sigma²).
+    """
+    if not apply_filter:
+        return sigma
+    return float(np.hypot(PREFILTER_SIGMA, sigma))
+
+
+def _find_edge(image, sigma):
+    # module level so that it can run in a process pool. Borders are
+    # reflected as by the former ndi.gaussian_filter pre-filter, which also
+    # saves canny smoothing a mask for its default constant mode.
+    return feature.canny(image, sigma=sigma, mode="reflect")
+
+
+def _find_edge_into(out, image, sigma, i):
+    out[i] = _find_edge(image[i], sigma)
+
 
 class EdgeDetection(object):
-    def __init__(self, sigma=3, apply_filter=True):
-        self._sigma = sigma
-        self._apply_filter = apply_filter
+    """Canny edges of each pulse of a (pulses, px, py) stack
+
+    Each pulse is smoothed on its own, with one 2-D Gaussian which merges
+    the optional pre-filter with the smoothing of Canny, see smoothing_sigma.
+    Pulses run in parallel on the executor and write into one output array
+    allocated per frame.
+    """
+
+    def __init__(self, sigma=3, apply_filter=True, executor=None):
+        self.sigma = sigma
+        self.apply_filter = apply_filter
         self.edges = None
+        # long lived executor owned by the caller, see StageExecutors
+        self.executor = executor
 
     def find_edges(self, image):
-        if self._apply_filter:
-            image = ndi.gaussian_filter(image, 4)
-
-        def _find_edge(i):
-            edges = feature.canny(image[i], sigma=self._sigma)
-            return edges
+        sigma = smoothing_sigma(self.sigma, self.apply_filter)
+        # a new array per frame, the previous one may still be on its way
+        # to the consumer
+        edges = np.empty(image.shape, dtype=bool)
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            ret = executor.map(_find_edge, range(image.shape[0]))
+        if isinstance(self.executor, ThreadPoolExecutor):
+            fill = partial(_find_edge_into, edges, image, sigma)
+            list(self.executor.map(fill, range(image.shape[0])))
+        elif self.executor is not None:
+            # results of a process pool come back as copies
+            find_edge = partial(_find_edge, sigma=sigma)
+            for i, ret in enumerate(self.executor.map(find_edge, image)):
+                edges[i] = ret
+        else:
+            with ThreadPoolExecutor(max_workers=10) as executor:
+                fill = partial(_find_edge_into, edges, image, sigma)
+                list(executor.map(fill, range(image.shape[0])))
 
-        self.edges = np.stack(ret)
+        self.edges = edges
         return self.edges
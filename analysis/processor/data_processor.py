@@ -6,103 +6,427 @@ All rights reserved.
 """
 
 import multiprocessing as mp
-import queue
+import time
 
 import numpy as np
 
+from analysis.config import config
+from analysis.ipc import HandOff
+from analysis.metrics import stamp
 from analysis.processor.azimuthal_integration import ImageIntegrator
 from analysis.processor.canny_edge import EdgeDetection
-from analysis.redisdb import DashMeta, get_redis_client, str2tuple
+from analysis.processor.executors import StageExecutors
+from analysis.processor.running_stats import FrameStatistics
+from analysis.redisdb import ConfigSubscriber, DashMeta, get_redis_client, str2tuple
+
+# used until the Dash app has written its parameters to Redis
+AZIMUTHAL_DEFAULTS = dict(
+    energy="9.3",
+    pixel_size="0.5e-3",
+    centrex="128",
+    centrey="128",
+    distance="0.2",
+    intg_rng="[0., 2]",
+    intg_method="BBox",
+    intg_pts="512",
+    threshold_mask="(0,12)",
+)
+
+EDGE_DEFAULTS = dict(sigma="3", apply_filter="True")
+
+
+def parse_azimuthal_config(cfg):
+    """Integration parameters from the strings stored in Redis"""
+    ai_config = dict(
+        energy=float(cfg["energy"]),
+        pixel_size=float(cfg["pixel_size"]),
+        centrex=float(cfg["centrex"]),
+        centrey=float(cfg["centrey"]),
+        distance=float(cfg["distance"]),
+        intg_rng=str2tuple(cfg["intg_rng"]),
+        intg_method=cfg["intg_method"],
+        intg_pts=int(cfg["intg_pts"]),
+        threshold_mask=str2tuple(cfg["threshold_mask"]),
+        user_mask=None,
+    )
+    for name in ("energy", "pixel_size", "distance", "intg_pts"):
+        if ai_config[name] <= 0:
+            raise ValueError(f"{name} must be positive, got {ai_config[name]}")
+    if ai_config["intg_method"] not in config["int_mthds"]:
+        raise ValueError(f"Unknown integration method {ai_config['intg_method']}")
+    low, high = ai_config["intg_rng"]
+    if low >= high:
+        raise ValueError(f"Empty integration range {ai_config['intg_rng']}")
+    return ai_config
+
+
+def parse_edge_config(cfg):
+    """Edge detection parameters from the strings stored in Redis"""
+    if cfg["apply_filter"] not in ("True", "False"):
+        raise ValueError(
+            f"apply_filter must be True or False, got {cfg['apply_filter']}"
+        )
+    edge_config = dict(
+        sigma=float(cfg["sigma"]), apply_filter=cfg["apply_filter"] == "True"
+    )
+    if edge_config["sigma"] <= 0:
+        raise ValueError(f"sigma must be positive, got {edge_config['sigma']}")
+    return edge_config
 
 
 class DataProcessor(mp.Process):
-    def __init__(self, data_in, data_out):
+    """
+    Parameters
+    ----------
+    data_in, data_out: queue like
+        Raw payloads in, processed payloads out
+    policy: str
+        HandOff policy when data_out is full
+    worker_id: int
+        Index of this worker in a ProcessorPool
+    order: mp.Value
+        Counter shared by the workers of a pool. Each frame is numbered in
+        the order it is taken from data_in, so that results can be put back
+        in that order downstream.
+    stats: mp.RawArray
+        Shared per-worker (frames, busy seconds) counters, only slots of
+        this worker_id are written.
+    executors: StageExecutors
+        Long lived executors for the integration and edge detection stages,
+        started in run()
+    poll_interval: float
+        Seconds between reads of the parameters in Redis when no change
+        notification arrives. None to rely on notifications only.
+    metrics: LoopMetrics
+        Updated with every frame processed, optional
+    """
+
+    def __init__(
+        self,
+        data_in,
+        data_out,
+        policy="block",
+        worker_id=0,
+        order=None,
+        stats=None,
+        executors=None,
+        poll_interval=config["config_poll_interval"],
+        metrics=None,
+    ):
         super().__init__()
 
         self._data_in = data_in
         self._data_out = data_out
-        self._running = False
+        self._policy = policy
+        self._shutdown = mp.Event()
+        self._worker_id = worker_id
+        self._order = order if order is not None else mp.Value("q", 0)
+        self._stats = stats
+        self._metrics = metrics
+        self._executors = executors if executors is not None else StageExecutors()
 
-        self.integrator = ImageIntegrator()
+        self.integrator = ImageIntegrator(cache_size=config["integrator_cache_size"])
         self.edge_detector = EdgeDetection()
+        self.statistics = FrameStatistics(
+            bins=config["stats_bins"], value_range=config["stats_range"]
+        )
         self._db = get_redis_client()
         self._dmt = DashMeta()
+        self._poll_interval = poll_interval
+        self._azimuthal = None
+        self._edge = None
+        self._pulse_shape = None
+        # representation handed on, consumers can still convert from it
+        self._image_dtype = config["image_dtype"]
+        self._edge_formats = config["edge_formats"]
 
     def run(self):
-        self._running = True
+        self._executors.start()
+        self.integrator.executor = self._executors.threads
+        self.edge_detector.executor = self._executors.edges
+
+        self._azimuthal = ConfigSubscriber(
+            self._db,
+            self._dmt.AZIMUTHAL_META,
+            parse_azimuthal_config,
+            AZIMUTHAL_DEFAULTS,
+            poll_interval=self._poll_interval,
+            on_change=self._prewarm,
+        )
+        self._azimuthal.start()
+        self._edge = ConfigSubscriber(
+            self._db,
+            self._dmt.EDGE_META,
+            parse_edge_config,
+            EDGE_DEFAULTS,
+            poll_interval=self._poll_interval,
+        )
+        self._edge.start()
 
-        while self._running:
-            try:
-                raw = self._data_in.get_nowait()
-            except queue.Empty:
-                continue
+        data_in = HandOff(self._data_in, stop_event=self._shutdown)
+        data_out = HandOff(
+            self._data_out, policy=self._policy, stop_event=self._shutdown
+        )
+
+        while True:
+            waiting = time.perf_counter()
+            # taking a frame and numbering it must not interleave with others
+            with self._order.get_lock():
+                raw = data_in.get()
+                order = self._order.value
+                self._order.value += 1
+            if raw is None:
+                break
 
-            mean_image, momentum, intensities, edges = self.process(raw)
+            start = time.perf_counter()
+            trace = stamp(dict(raw[0].get("trace", {})), "dequeue")
+            mean_image, momentum, intensities, edges = self.process(raw, trace)
+            # nothing refers to the raw arrays any more, their slot in
+            # shared memory can be written again
+            data_in.release()
 
             proc_data = IntegratedData(raw[0]["timestamp"])
+            proc_data.frame = raw[0].get("frame")
+            proc_data.trace = trace
             proc_data.mean_image = mean_image
             proc_data.momentum = momentum
             proc_data.intensities = intensities
             proc_data.edges = edges
+            # run statistics are merged in frame order downstream
+            proc_data.histogram, proc_data.moments = self.statistics.compute(mean_image)
+            proc_data.bin_edges = self.statistics.bin_edges
+            proc_data = proc_data.compact(
+                image_dtype=self._image_dtype, edges=self._edge_formats
+            )
+            stamp(trace, "processed")
+            latency = None
+            if "emit" in trace:
+                latency = (trace["processed"] - trace["emit"]) / 1e9
+
+            meta, arrays = proc_data.to_payload()
+            meta["order"] = order
+            meta["worker"] = self._worker_id
+            work = time.perf_counter() - start
+            data_out.put((meta, arrays))
 
-            while self._running:
-                try:
-                    self._data_out.put_nowait(proc_data)
-                    break
-                except queue.Full:
-                    continue
+            if self._stats is not None:
+                self._stats[2 * self._worker_id] += 1
+                self._stats[2 * self._worker_id + 1] += time.perf_counter() - start
+            if self._metrics is not None:
+                self._metrics.frame(work, dropped=data_out.n_dropped, latency=latency)
+                self._metrics.waited(time.perf_counter() - waiting - work)
 
-    def process(self, raw):
+        if not self._shutdown.is_set():
+            # pass SHUTDOWN on to the other workers of the pool
+            data_in.shutdown()
+        data_out.shutdown()
+        self._azimuthal.stop()
+        self._edge.stop()
+        self._executors.shutdown()
+
+    def _prewarm(self, snapshot):
+        # set up the new geometry while frames are still integrated with
+        # the old one, the shape is only known once a frame was seen
+        if self._pulse_shape is None:
+            return
         try:
-            cfg = self._db.hgetall(self._dmt.AZIMUTHAL_META)
-        except Exception as ex:
-            print("[REDIS] ", ex)
-
-        if not cfg:
-            cfg = dict(
-                energy="9.3",
-                pixel_size="0.5e-3",
-                centrex="128",
-                centrey="128",
-                distance="0.2",
-                intg_rng="[0., 2]",
-                intg_method="BBox",
-                intg_pts="512",
-                threshold_mask="(0,12)",
-                user_mask=None,
+            self.integrator.prewarm(
+                snapshot.config, self._pulse_shape, executor=self._executors.threads
             )
+        except RuntimeError:
+            # executor already shut down
+            pass
 
+    def process(self, raw, trace=None):
         meta, data = raw
-        config = dict(
-            energy=float(cfg["energy"]),
-            pixel_size=float(cfg["pixel_size"]),
-            centrex=float(cfg["centrex"]),
-            centrey=float(cfg["centrey"]),
-            distance=float(cfg["distance"]),
-            intg_rng=str2tuple(cfg["intg_rng"]),
-            intg_method="BBox",
-            intg_pts=int(cfg["intg_pts"]),
-            threshold_mask=str2tuple(cfg["threshold_mask"]),
-            user_mask=None,
-        )
+        # parsed by the subscriber thread, nothing to ask Redis here
+        config = self._azimuthal.config
 
         image = data["image"]
+        self._pulse_shape = image.shape[1:]
         mom, intensities = self.integrator.integrate(config, image)
+        stamp(trace, "integrated")
+        edge_config = self._edge.config
+        self.edge_detector.sigma = edge_config["sigma"]
+        self.edge_detector.apply_filter = edge_config["apply_filter"]
         edges = self.edge_detector.find_edges(image)
+        stamp(trace, "edges")
         return np.mean(image, axis=0), mom, intensities, edges
 
     def terminate(self):
-        self._running = False
+        self._shutdown.set()
 
 
 class IntegratedData:
+    """Results of one frame
+
+    Edges can be carried as the full (pulses, px, py) boolean stack, packed
+    to one bit per pixel along the last axis (packed_edges) and/or as the
+    number of pulses with an edge at each pixel (edge_count), which is all
+    the viewers show. compact() converts between these representations.
+    """
+
+    __slots__ = (
+        "_timestamp",
+        "frame",
+        "trace",
+        "mean_image",
+        "momentum",
+        "intensities",
+        "edges",
+        "packed_edges",
+        "edge_count",
+        "edge_shape",
+        "histogram",
+        "moments",
+        "bin_edges",
+        "run_histogram",
+        "trend",
+        "rolling",
+        "stats",
+    )
+
+    fields = (
+        "mean_image",
+        "momentum",
+        "intensities",
+        "edges",
+        "packed_edges",
+        "edge_count",
+        "histogram",
+        "moments",
+        "bin_edges",
+        "run_histogram",
+        "trend",
+        "rolling",
+    )
+    edge_formats = ("full", "packed", "count", "none")
+    image_dtypes = ("float64", "float32", "float16")
+
     def __init__(self, timestamp):
         self._timestamp = timestamp
+        # sequence number given by the source and {stage: ns} stamps, see
+        # analysis.metrics.latency
+        self.frame = None
+        self.trace = None
         self.mean_image = None
         self.momentum = None
         self.intensities = None
         self.edges = None
+        self.packed_edges = None
+        self.edge_count = None
+        # (pulses, px, py) of the edge stack, needed to unpack
+        self.edge_shape = None
+        # mean_image statistics of this frame, see running_stats
+        self.histogram = None
+        self.moments = None
+        self.bin_edges = None
+        # of the run up to this frame and summaries of recent frames
+        self.run_histogram = None
+        self.trend = None
+        # I(q) averaged over recent trains, see accumulator
+        self.rolling = None
+        self.stats = None
 
     @property
     def timestamp(self):
         return self._timestamp
+
+    def unpacked_edges(self):
+        """Boolean (pulses, px, py) edges, None if only counts are kept"""
+        if self.edges is not None:
+            return self.edges
+        if self.packed_edges is not None:
+            return np.unpackbits(
+                self.packed_edges, axis=-1, count=self.edge_shape[-1]
+            ).view(bool)
+        return None
+
+    def edge_occupancy(self):
+        """Fraction of pulses with an edge at each pixel, shape (px, py)"""
+        if self.edge_count is not None:
+            return self.edge_count / np.float32(self.edge_shape[0])
+        edges = self.unpacked_edges()
+        if edges is None:
+            return None
+        return np.mean(edges, axis=0, dtype=np.float32)
+
+    def compact(self, image_dtype=None, edges=("packed", "count")):
+        """Copy in another representation
+
+        Parameters
+        ----------
+        image_dtype: str
+            One of image_dtypes for mean_image, None to keep it as is
+        edges: str or tuple
+            Edge representations to keep, of edge_formats
+        """
+        if isinstance(edges, str):
+            edges = (edges,)
+        for fmt in edges:
+            if fmt not in self.edge_formats:
+                raise ValueError(
+                    f"Unknown edge format {fmt}. Use one of {self.edge_formats}"
+                )
+        if image_dtype is not None and image_dtype not in self.image_dtypes:
+            raise ValueError(
+                f"Unknown image dtype {image_dtype}. Use one of {self.image_dtypes}"
+            )
+
+        data = IntegratedData(self._timestamp)
+        for name in self.__slots__:
+            if name not in ("edges", "packed_edges", "edge_count"):
+                setattr(data, name, getattr(self, name))
+        if image_dtype is not None and self.mean_image is not None:
+            data.mean_image = self.mean_image.astype(image_dtype, copy=False)
+
+        data.edge_shape = self.edge_shape
+        if "full" in edges:
+            data.edges = self.unpacked_edges()
+        if "packed" in edges:
+            data.packed_edges = self.packed_edges
+            if data.packed_edges is None and self.edges is not None:
+                data.packed_edges = np.packbits(self.edges, axis=-1)
+        if "count" in edges:
+            data.edge_count = self.edge_count
+            if data.edge_count is None:
+                full = self.unpacked_edges()
+                if full is not None:
+                    dtype = np.uint8 if full.shape[0] < 256 else np.uint16
+                    data.edge_count = np.add.reduce(
+                        full.view(np.uint8), axis=0, dtype=dtype
+                    )
+        if data.edge_shape is None and self.edges is not None:
+            data.edge_shape = self.edges.shape
+        return data
+
+    def to_payload(self):
+        """Split into (meta, arrays) as expected by SharedMemoryQueue"""
+        meta = {"timestamp": self._timestamp}
+        if self.frame is not None:
+            meta["frame"] = self.frame
+        if self.trace is not None:
+            meta["trace"] = self.trace
+        if self.edge_shape is not None:
+            meta["edge_shape"] = list(self.edge_shape)
+        if self.stats is not None:
+            meta["stats"] = self.stats
+        arrays = {
+            name: getattr(self, name)
+            for name in self.fields
+            if getattr(self, name) is not None
+        }
+        return meta, arrays
+
+    @classmethod
+    def from_payload(cls, payload):
+        meta, arrays = payload
+        data = cls(meta["timestamp"])
+        if meta.get("edge_shape") is not None:
+            data.edge_shape = tuple(meta["edge_shape"])
+        data.stats = meta.get("stats")
+        data.frame = meta.get("frame")
+        data.trace = meta.get("trace")
+        for name, arr in arrays.items():
+            setattr(data, name, arr)
+        return data
@@ -5,61 +5,207 @@ Author: Ebad Kamil <ebad.kamil@xfel.eu>
 All rights reserved.
 """
 
+import logging
 import multiprocessing as mp
-import queue
 import time
 from datetime import datetime
 
 import numpy as np
 from scipy import ndimage as ndi
 
+from analysis.ipc import HandOff
+from analysis.metrics import stamp
+
+logger = logging.getLogger(__name__)
+
+
+def make_pattern(shape, rng):
+    """Rings or a rotated square on a (px, py) detector"""
+    if rng.random() < 0.5:
+        # Random image data emulating rings
+        x = np.linspace(-1, 1, shape[-2])
+        y = np.linspace(-1, 1, shape[-1])
+        xx, yy = np.meshgrid(x, y, indexing="ij")
+        return 10.0 * np.sin(rng.integers(1, 20) * np.pi * (xx ** 2 + yy ** 2))
+
+    z = np.zeros(shape)
+    x = rng.integers(min(10, shape[0] // 4), max(shape[0] // 2 - 1, 1))
+    y = rng.integers(min(10, shape[1] // 4), max(shape[1] // 2 - 1, 1))
+    z[x:-x, y:-y] = 10.0
+    return ndi.rotate(z, rng.integers(10, 45), mode="constant", reshape=False)
+
+
+# dtypes frames can be simulated in
+DTYPES = ("float64", "float32", "float16", "uint16")
+# range of the noise added to the patterns
+NOISE_RANGE = (0.0, 2.0)
+
+
+def to_dtype(values, dtype):
+    """Float pattern or noise values as dtype
+
+    Integer dtypes keep the units of the patterns, rounded and clipped to
+    the range of the dtype, so that the default threshold mask and
+    statistics range apply to them as they do to float frames.
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return values.astype(dtype)
+    info = np.iinfo(dtype)
+    return np.rint(np.clip(values, info.min, info.max)).astype(dtype)
+
+
+def _cycle_into(out, bank, start, add=False):
+    """out[i] = bank[(start + i) % len(bank)], copied in contiguous runs"""
+    i = 0
+    while i < len(out):
+        j = (start + i) % len(bank)
+        n = min(len(bank) - j, len(out) - i)
+        if add:
+            out[i : i + n] += bank[j : j + n]
+        else:
+            out[i : i + n] = bank[j : j + n]
+        i += n
+    return out
+
 
 class DataSimulator(mp.Process):
-    def __init__(self, sim_queue, data_shape=None):
+    """Frames of rings and squares at a target rate
+
+    A bank of patterns and of background noise images is computed once
+    when the process starts. Each frame then only copies patterns from it,
+    cycling through the bank, and adds noise images from a random start.
+
+    Parameters
+    ----------
+    sim_queue: queue like
+    data_shape: tuple
+        (pulses, px, py)
+    policy: str
+        HandOff policy when the processors fall behind
+    rate: float
+        Target frames per second, 0 for as fast as the queue takes them.
+        Can be changed while running, see set_rate
+    dtype: str
+        One of DTYPES, integer ones get rounded patterns, see to_dtype
+    bank_size: int
+        Number of patterns, and of noise images, computed in advance
+    noise: bool
+        Add a noise image to every pulse
+    report_interval: float
+        Seconds between logs of the achieved rate, 0 for none
+    metrics: LoopMetrics
+        Updated with every frame sent, optional
+    backpressure: BackpressureController
+        Switches the policy by the latency of the processors, optional
+    """
+
+    def __init__(
+        self,
+        sim_queue,
+        data_shape=None,
+        policy="block",
+        rate=2.0,
+        dtype="float64",
+        bank_size=16,
+        noise=True,
+        report_interval=10.0,
+        metrics=None,
+        backpressure=None,
+    ):
         super().__init__()
 
         self._sim_queue = sim_queue
-        self._data_shape = data_shape
-        self._running = False
+        self._data_shape = data_shape if data_shape is not None else (2, 256, 256)
+        self._policy = policy
+        self._rate = mp.Value("d", rate, lock=False)
+        self._dtype = np.dtype(dtype)
+        self._bank_size = bank_size
+        self._noise = noise
+        self._report_interval = report_interval
+        self._metrics = metrics
+        self._backpressure = backpressure
+        self._shutdown = mp.Event()
+
+        self._n_frames = mp.Value("q", 0, lock=False)
+        self._t_start = mp.Value("d", 0.0, lock=False)
+
+    def _make_bank(self):
+        pulses, px, py = self._data_shape
+        rng = np.random.default_rng()
+        patterns = np.empty((self._bank_size, px, py), dtype=self._dtype)
+        for i in range(self._bank_size):
+            patterns[i] = to_dtype(make_pattern((px, py), rng), self._dtype)
+        noise = None
+        if self._noise:
+            # drawn in float, integer noise would only be 0 or 1
+            noise = to_dtype(
+                NOISE_RANGE[1] * rng.random((self._bank_size, px, py)), self._dtype
+            )
+        return patterns, noise
+
+    def set_rate(self, rate):
+        """Change the target rate, 0 for as fast as the queue takes them"""
+        self._rate.value = rate
+
+    def stats(self):
+        """Frames sent and the rate achieved since the bank was ready"""
+        n_frames = self._n_frames.value
+        elapsed = time.monotonic() - self._t_start.value
+        rate = n_frames / elapsed if n_frames and elapsed > 0 else 0.0
+        return dict(frames=n_frames, rate=rate)
 
     def run(self):
-        self._running = True
-
-        while self._running:
-            shape = self._data_shape if self._data_shape is not None else (2, 256, 256)
-
-            choices = ["circles", "squares"]
-            choice = np.random.choice(choices)
-            background = 2.0 * np.random.rand(*shape)
-            if choice == "circles":
-                # Random image data emulating rings
-                x = np.linspace(-1, 1, shape[-2])
-                y = np.linspace(-1, 1, shape[-1])
-                xx, yy = np.meshgrid(x, y)
-                z = 10.0 * np.sin(
-                    np.random.randint(1, 20) * np.pi * (xx ** 2 + yy ** 2)
-                )
-            else:
-                z = np.zeros(shape[1:])
-                x = np.random.randint(10, 128)
-                z[x:-x, x:-x] = 10.0
-
-                z = ndi.rotate(
-                    z, np.random.randint(10, 45), mode="constant", reshape=False
-                )
-
-            data = {"image": background + z}
-            meta = {"timestamp": datetime.now().strftime("%H:%M:%S")}
-
-            payload = (meta, data)
-            try:
-                self._sim_queue.put_nowait(payload)
-                time.sleep(0.5)
-            except queue.Full:
-                continue
+        sim_queue = HandOff(
+            self._sim_queue, policy=self._policy, stop_event=self._shutdown
+        )
+        patterns, noise = self._make_bank()
+        rng = np.random.default_rng()
+
+        self._t_start.value = time.monotonic()
+        deadline = reported = self._t_start.value
+        i = 0
+        while not self._shutdown.is_set():
+            start = time.perf_counter()
+            image = np.empty(self._data_shape, dtype=self._dtype)
+            _cycle_into(image, patterns, i)
+            if noise is not None:
+                _cycle_into(image, noise, rng.integers(self._bank_size), add=True)
+            i += 1
+
+            data = {"image": image}
+            work = time.perf_counter() - start
+
+            rate = self._rate.value
+            if rate > 0:
+                # paced against a schedule so that the time spent on a frame
+                # does not slow the rate down
+                deadline = max(deadline + 1.0 / rate, time.monotonic())
+                self._shutdown.wait(deadline - time.monotonic())
+
+            meta = {
+                "timestamp": datetime.now().strftime("%H:%M:%S"),
+                "frame": self._n_frames.value,
+                "trace": stamp({}, "emit"),
+            }
+            if self._backpressure is not None:
+                self._backpressure.update(sim_queue)
+            if not sim_queue.put((meta, data)):
+                break
+            self._n_frames.value += 1
+            if self._metrics is not None:
+                self._metrics.frame(work, dropped=sim_queue.n_dropped)
+                self._metrics.waited(time.perf_counter() - start - work)
+
+            now = time.monotonic()
+            if self._report_interval and now - reported > self._report_interval:
+                reported = now
+                logger.info("Simulator: %.1f frames/s", self.stats()["rate"])
+
+        sim_queue.shutdown()
 
     def terminate(self):
-        self._running = False
+        self._shutdown.set()
 
 
 if __name__ == "__main__":
@@ -67,10 +213,11 @@ if __name__ == "__main__":
     simulator = DataSimulator(sim_queue)
     simulator.daemon = True
     simulator.start()
+    data_in = HandOff(sim_queue)
     while True:
-        try:
-            meta, data = sim_queue.get_nowait()
-            print(meta)
-        except queue.Empty:
-            continue
+        payload = data_in.get()
+        if payload is None:
+            break
+        meta, data = payload
+        print(meta)
     simulator.terminate()
@@ -0,0 +1,69 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def pool_size(n_threads=None, n_processes=1):
+    """Workers per executor, cores are split evenly between processes"""
+    if n_threads:
+        return n_threads
+    return max(1, (os.cpu_count() or 1) // n_processes)
+
+
+class StageExecutors:
+    """Long lived executors shared by the stages of one DataProcessor
+
+    Executors are created by start(), i.e. in the process that uses them
+    since threads do not survive fork.
+
+    Parameters
+    ----------
+    n_threads: int
+        Size of the pools. None for the cores of the machine divided by
+        n_processes.
+    edge_executor: str
+        "thread" to run edge detection in the shared thread pool or
+        "process" to give it a pool of processes, which side-steps the GIL
+        at the cost of copying every pulse to the worker.
+    n_processes: int
+        Number of DataProcessors sharing the machine.
+    """
+
+    kinds = ("thread", "process")
+
+    def __init__(self, n_threads=None, edge_executor="thread", n_processes=1):
+        if edge_executor not in self.kinds:
+            raise ValueError(
+                f"Unknown executor {edge_executor}. Use one of {self.kinds}"
+            )
+
+        self._size = pool_size(n_threads, n_processes)
+        self._edge_executor = edge_executor
+
+        self.threads = None
+        self.edges = None
+
+    @property
+    def size(self):
+        return self._size
+
+    def start(self):
+        self.threads = ThreadPoolExecutor(max_workers=self._size)
+        if self._edge_executor == "process":
+            self.edges = ProcessPoolExecutor(max_workers=self._size)
+        else:
+            self.edges = self.threads
+        return self
+
+    def shutdown(self):
+        if self.edges is not None and self.edges is not self.threads:
+            self.edges.shutdown()
+        if self.threads is not None:
+            self.threads.shutdown()
+        self.threads = None
+        self.edges = None
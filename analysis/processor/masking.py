@@ -0,0 +1,79 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import numpy as np
+
+
+class StackMask:
+    """Pixel mask of a whole (pulses, px, py) stack
+
+    NaN, threshold and user masks are evaluated for all pulses at once into
+    buffers which are kept and reused for as long as the stack shape stays
+    the same. The returned mask is only valid until the next call to build.
+    """
+
+    def __init__(self):
+        self._mask = None
+        self._scratch = None
+
+        self._user_mask = None
+        self._static = None
+
+    def _buffers(self, shape):
+        if self._mask is None or self._mask.shape != shape:
+            self._mask = np.empty(shape, dtype=bool)
+            self._scratch = np.empty(shape, dtype=bool)
+        return self._mask, self._scratch
+
+    def _static_mask(self, user_mask, shape):
+        """User mask as a boolean array broadcastable to shape, or None"""
+        if user_mask is not self._user_mask:
+            self._user_mask = user_mask
+            self._static = None
+            if user_mask is not None:
+                if user_mask.shape in (shape, shape[1:]):
+                    self._static = user_mask.astype(bool)
+                else:
+                    print(
+                        f"User provided mask {user_mask.shape} and "
+                        f"image {shape} have different shapes"
+                    )
+
+        if self._static is not None and self._static.shape not in (shape, shape[1:]):
+            return None
+        return self._static
+
+    def build(self, data, threshold_mask=None, user_mask=None):
+        """
+        Parameters
+        ----------
+        data: ndarray
+            Shape (pulses, px, py)
+        threshold_mask: tuple
+            (low, high), pixels outside are masked
+        user_mask: ndarray
+            Shape (pulses, px, py) or (px, py) for all pulses. Converted once
+            and reused for as long as the same array is passed.
+
+        Returns
+        -------
+        ndarray of dtype uint8 and shape of data, 1 for masked pixels
+        """
+        mask, scratch = self._buffers(data.shape)
+
+        np.isnan(data, out=mask)
+        if threshold_mask is not None:
+            low, high = threshold_mask
+            np.less(data, low, out=scratch)
+            mask |= scratch
+            np.greater(data, high, out=scratch)
+            mask |= scratch
+
+        static = self._static_mask(user_mask, data.shape)
+        if static is not None:
+            mask |= static
+
+        return mask.view(np.uint8)
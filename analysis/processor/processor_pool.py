@@ -0,0 +1,174 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import multiprocessing as mp
+import time
+
+from analysis.processor.data_processor import DataProcessor
+from analysis.processor.executors import StageExecutors
+
+
+class ReorderBuffer:
+    """Put results of parallel workers back into frame order
+
+    Parameters
+    ----------
+    window: int
+        Maximum number of results held back waiting for a missing one.
+        Once exceeded the missing frame is given up on.
+    max_delay: float
+        Seconds a result is held back at most, checked on every push.
+    late_policy: str
+        What to do with a result which arrives after it was given up on:
+        "drop" it or "emit" it out of order.
+    start: int
+        Number of the first result. None to start from whichever comes first.
+    """
+
+    late_policies = ("drop", "emit")
+
+    def __init__(self, window=8, max_delay=1.0, late_policy="drop", start=0):
+        if late_policy not in self.late_policies:
+            raise ValueError(
+                f"Unknown late policy {late_policy}. Use one of {self.late_policies}"
+            )
+
+        self._window = window
+        self._max_delay = max_delay
+        self._late_policy = late_policy
+
+        self._next = start
+        self._pending = {}
+        self._arrival = {}
+
+        self.n_late = 0
+        self.n_skipped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, order, item):
+        """Add item numbered order and return the items now ready, in order"""
+        if self._next is None:
+            self._next = order
+
+        if order < self._next:
+            self.n_late += 1
+            return [item] if self._late_policy == "emit" else []
+
+        self._pending[order] = item
+        self._arrival[order] = time.monotonic()
+
+        ready = self._release()
+        while self._pending and (
+            len(self._pending) > self._window
+            or time.monotonic() - self._arrival[min(self._pending)] > self._max_delay
+        ):
+            # give up on the missing frame(s) before the oldest pending one
+            oldest = min(self._pending)
+            self.n_skipped += oldest - self._next
+            self._next = oldest
+            ready.extend(self._release())
+        return ready
+
+    def _release(self):
+        ready = []
+        while self._next in self._pending:
+            ready.append(self._pending.pop(self._next))
+            del self._arrival[self._next]
+            self._next += 1
+        return ready
+
+    def flush(self):
+        """Return every pending item in order and start over"""
+        ready = [self._pending[order] for order in sorted(self._pending)]
+        self._pending.clear()
+        self._arrival.clear()
+        self._next = None
+        return ready
+
+
+class ProcessorPool:
+    """DataProcessor workers sharing one raw and one processed queue
+
+    Results carry an "order" number in their meta which ReorderBuffer
+    uses to restore the order frames were taken from the raw queue. Each
+    worker updates the "processor" loop of PipelineMetrics metrics, if
+    given, with its own worker label.
+    """
+
+    def __init__(
+        self,
+        data_in,
+        data_out,
+        n_workers=1,
+        n_threads=None,
+        edge_executor="thread",
+        metrics=None,
+    ):
+        self._data_in = data_in
+        self._data_out = data_out
+        self._n_workers = n_workers
+
+        self._order = mp.Value("q", 0)
+        # frames and busy seconds per worker, each worker writes its own pair
+        self._stats = mp.RawArray("d", 2 * n_workers)
+        self._started = None
+
+        # the output is drained straight away by the reorder stage, so no
+        # result is dropped there and frame numbers stay without gaps
+        self.workers = [
+            DataProcessor(
+                data_in,
+                data_out,
+                policy="block",
+                worker_id=i,
+                order=self._order,
+                stats=self._stats,
+                executors=StageExecutors(
+                    n_threads, edge_executor=edge_executor, n_processes=n_workers
+                ),
+                metrics=metrics.loop("processor", i) if metrics is not None else None,
+            )
+            for i in range(n_workers)
+        ]
+
+    def __len__(self):
+        return self._n_workers
+
+    def start(self):
+        self._started = time.monotonic()
+        for worker in self.workers:
+            worker.start()
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+
+    def join(self, timeout=None):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(timeout)
+
+    def stats(self):
+        """Throughput of each worker and depth of the queues around the pool"""
+        elapsed = time.monotonic() - self._started if self._started else 0
+        workers = []
+        for i in range(self._n_workers):
+            frames, busy = self._stats[2 * i], self._stats[2 * i + 1]
+            workers.append(
+                dict(
+                    worker=i,
+                    frames=int(frames),
+                    rate=frames / elapsed if elapsed else 0.0,
+                    busy=busy / elapsed if elapsed else 0.0,
+                )
+            )
+        return dict(
+            workers=workers,
+            raw_queue_depth=self._data_in.qsize(),
+            proc_queue_depth=self._data_out.qsize(),
+        )
@@ -0,0 +1,201 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import multiprocessing as mp
+import os.path as osp
+import time
+from datetime import datetime
+
+import numpy as np
+
+from analysis.ipc import HandOff
+from analysis.metrics import stamp
+
+
+def open_frames(path, dataset="image"):
+    """Frames of a recording as an array like, and the file to close
+
+    Parameters
+    ----------
+    path: str
+        .npy file, memory-mapped, HDF5 (.h5, .hdf5) or Zarr (.zarr) store
+    dataset: str
+        Dataset of the HDF5 file or Zarr group, of shape (frames, pulses,
+        px, py) or (frames, px, py) for single pulse frames
+    """
+    ext = osp.splitext(path)[1].lower()
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r"), None
+    if ext in (".h5", ".hdf5"):
+        import h5py
+
+        h5file = h5py.File(path, "r")
+        return h5file[dataset], h5file
+    if ext == ".zarr":
+        import zarr
+
+        return zarr.open(path, mode="r")[dataset], None
+    raise ValueError(f"Unknown file type {ext}. Use .npy, .h5, .hdf5 or .zarr")
+
+
+def frame_shape(path, dataset="image"):
+    """(pulses, px, py) of the frames of a recording"""
+    frames, handle = open_frames(path, dataset)
+    try:
+        if frames.ndim not in (3, 4):
+            raise ValueError(
+                f"Expected frames of shape (frames, [pulses,] px, py), "
+                f"got {frames.shape}"
+            )
+        return tuple(frames.shape[1:]) if frames.ndim == 4 else (1,) + frames.shape[1:]
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+class ReplaySource(mp.Process):
+    """Stream recorded frames into the pipeline, in place of DataSimulator
+
+    Parameters
+    ----------
+    sim_queue: queue like
+        Raw data queue the processors read from
+    path: str
+    dataset: str
+        See open_frames
+    rate: float
+        Frames per second the data were taken at, 0 for as fast as the
+        queue takes them
+    speed: float
+        Multiple of rate to replay at, 0 for as fast as the queue takes them
+    loop: bool
+        Start over at the end of the file instead of stopping
+    start: int
+        Frame to start at
+    policy: str
+        HandOff policy when the processors fall behind
+    metrics: LoopMetrics
+        Updated with every frame sent, optional
+    backpressure: BackpressureController
+        Switches the policy by the latency of the processors, optional
+    """
+
+    def __init__(
+        self,
+        sim_queue,
+        path,
+        dataset="image",
+        rate=10.0,
+        speed=1.0,
+        loop=False,
+        start=0,
+        policy="block",
+        metrics=None,
+        backpressure=None,
+    ):
+        super().__init__()
+
+        self._sim_queue = sim_queue
+        self._path = path
+        self._dataset = dataset
+        self._period = 1.0 / (rate * speed) if rate > 0 and speed > 0 else 0.0
+        self._loop = loop
+        self._policy = policy
+        self._metrics = metrics
+        self._backpressure = backpressure
+        self._shutdown = mp.Event()
+
+        self._position = mp.Value("q", start, lock=False)
+        # frame to continue at, only read while seek_pending is set
+        self._seek = mp.Value("q", 0)
+        self._seek_pending = mp.RawValue("b", 0)
+        self._n_frames = mp.Value("q", 0, lock=False)
+        self._t_start = mp.Value("d", 0.0, lock=False)
+
+    @property
+    def position(self):
+        """Index of the next frame sent"""
+        return self._position.value
+
+    def stats(self):
+        """Frames sent and the rate achieved, as DataSimulator.stats"""
+        n_frames = self._n_frames.value
+        elapsed = time.monotonic() - self._t_start.value
+        rate = n_frames / elapsed if n_frames and elapsed > 0 else 0.0
+        return dict(frames=n_frames, rate=rate, position=self.position)
+
+    def seek(self, frame):
+        """Continue at frame, negative counts from the end"""
+        with self._seek.get_lock():
+            self._seek.value = frame
+            self._seek_pending.value = 1
+
+    def _take_seek(self, n_frames):
+        with self._seek.get_lock():
+            if not self._seek_pending.value:
+                return None
+            frame = self._seek.value
+            self._seek_pending.value = 0
+        if frame < 0:
+            frame += n_frames
+        return min(max(frame, 0), n_frames)
+
+    def run(self):
+        sim_queue = HandOff(
+            self._sim_queue, policy=self._policy, stop_event=self._shutdown
+        )
+        frames, handle = open_frames(self._path, self._dataset)
+        n_frames = len(frames)
+        single_pulse = frames.ndim == 3
+
+        self._t_start.value = deadline = time.monotonic()
+        try:
+            while not self._shutdown.is_set():
+                start = time.perf_counter()
+                position = self._take_seek(n_frames)
+                if position is not None:
+                    self._position.value = position
+                if self._position.value >= n_frames:
+                    if not self._loop:
+                        break
+                    self._position.value = 0
+
+                # np.array reads from the memory map or the file here,
+                # ahead of the wait
+                image = np.array(frames[self._position.value])
+                if single_pulse:
+                    image = image[np.newaxis]
+                data = {"image": image}
+                work = time.perf_counter() - start
+
+                if self._period:
+                    # paced against a schedule rather than by sleeping a
+                    # period, without catching up on time lost while blocked
+                    deadline = max(deadline + self._period, time.monotonic())
+                    self._shutdown.wait(deadline - time.monotonic())
+
+                meta = {
+                    "timestamp": datetime.now().strftime("%H:%M:%S"),
+                    "frame": self._n_frames.value,
+                    "trace": stamp({}, "emit"),
+                }
+                if self._backpressure is not None:
+                    self._backpressure.update(sim_queue)
+                if not sim_queue.put((meta, data)):
+                    break
+                self._position.value += 1
+                self._n_frames.value += 1
+                if self._metrics is not None:
+                    self._metrics.frame(work, dropped=sim_queue.n_dropped)
+                    self._metrics.waited(time.perf_counter() - start - work)
+        finally:
+            if handle is not None:
+                handle.close()
+
+        sim_queue.shutdown()
+
+    def terminate(self):
+        self._shutdown.set()
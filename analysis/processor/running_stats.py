@@ -0,0 +1,204 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import numpy as np
+
+# layout of the moments array of a frame or a run
+MOMENTS = ("count", "mean", "m2", "min", "max", "underflow", "overflow")
+_COUNT, _MEAN, _M2, _MIN, _MAX, _UNDER, _OVER = range(len(MOMENTS))
+
+# rows of the trend array, one column per frame
+TREND = ("mean", "std", "min", "max")
+
+
+class FrameStatistics:
+    """Histogram and moments of one image with fixed bin edges
+
+    Stateless, so that each DataProcessor of a pool can compute the
+    statistics of its frames. Values outside the range are counted as
+    underflow and overflow rather than binned, NaNs are ignored.
+
+    Parameters
+    ----------
+    bins: int
+    value_range: tuple
+        (low, high) of the bins
+    """
+
+    def __init__(self, bins=100, value_range=(0, 20)):
+        low, high = value_range
+        if not high > low:
+            raise ValueError(f"Empty range {value_range}")
+
+        self._bins = bins
+        self._low = float(low)
+        self._scale = bins / (high - low)
+        self.bin_edges = np.linspace(low, high, bins + 1)
+
+    def compute(self, image):
+        """
+        Returns
+        -------
+        histogram: ndarray
+            int64 counts of shape (bins,)
+        moments: ndarray
+            float64 of shape (len(MOMENTS),)
+        """
+        values = image.ravel()
+        values = values[np.isfinite(values)]
+
+        moments = np.zeros(len(MOMENTS))
+        if values.size == 0:
+            moments[_MIN], moments[_MAX] = np.inf, -np.inf
+            return np.zeros(self._bins, dtype=np.int64), moments
+
+        # bin -1 and bins collect under- and overflow, values equal to high
+        # belong to the last bin as with np.histogram
+        index = np.floor((values - self._low) * self._scale)
+        index[values == self.bin_edges[-1]] = self._bins - 1
+        np.clip(index, -1, self._bins, out=index)
+        counts = np.bincount(index.astype(np.intp) + 1, minlength=self._bins + 2)
+
+        mean = values.mean(dtype=np.float64)
+        moments[_COUNT] = values.size
+        moments[_MEAN] = mean
+        moments[_M2] = np.square(values - mean, dtype=np.float64).sum()
+        moments[_MIN] = values.min()
+        moments[_MAX] = values.max()
+        moments[_UNDER] = counts[0]
+        moments[_OVER] = counts[-1]
+        return counts[1:-1].astype(np.int64), moments
+
+
+def merge_moments(a, b):
+    """Moments of the union of two sets, Chan's form of Welford's update"""
+    out = np.empty_like(a)
+    n = a[_COUNT] + b[_COUNT]
+    out[_COUNT] = n
+    if n == 0:
+        out[:] = a
+        return out
+
+    delta = b[_MEAN] - a[_MEAN]
+    out[_MEAN] = a[_MEAN] + delta * b[_COUNT] / n
+    out[_M2] = a[_M2] + b[_M2] + delta ** 2 * a[_COUNT] * b[_COUNT] / n
+    out[_MIN] = min(a[_MIN], b[_MIN])
+    out[_MAX] = max(a[_MAX], b[_MAX])
+    out[_UNDER] = a[_UNDER] + b[_UNDER]
+    out[_OVER] = a[_OVER] + b[_OVER]
+    return out
+
+
+def summary(moments):
+    """Scalars of a moments array as a dict"""
+    count = moments[_COUNT]
+    return dict(
+        count=int(count),
+        mean=float(moments[_MEAN]) if count else None,
+        std=float(np.sqrt(moments[_M2] / count)) if count else None,
+        min=float(moments[_MIN]) if count else None,
+        max=float(moments[_MAX]) if count else None,
+        underflow=int(moments[_UNDER]),
+        overflow=int(moments[_OVER]),
+    )
+
+
+def histogram_percentiles(histogram, bin_edges, percentiles, underflow=0, overflow=0):
+    """Percentiles estimated from a histogram by linear interpolation
+
+    Values beyond the bins are only counted, percentiles falling among
+    them are clipped to the bin range.
+    """
+    cdf = np.concatenate(([underflow], underflow + np.cumsum(histogram)))
+    total = cdf[-1] + overflow
+    if total == 0:
+        return np.full(len(percentiles), np.nan)
+    targets = np.asarray(percentiles, dtype=np.float64) / 100.0 * total
+    # cdf is not strictly increasing where bins are empty, np.interp then
+    # takes the upper edge of the empty run which is fine for a sketch
+    return np.interp(targets, cdf, bin_edges)
+
+
+class RunningStatistics:
+    """Statistics of every frame since the start, in constant memory
+
+    Merges the FrameStatistics of frames in the order they are passed,
+    keeps the cumulative histogram and moments and a ring of the last
+    trend_length frame summaries for trend plots. Starts over when the bin
+    edges of the frames change.
+
+    Parameters
+    ----------
+    trend_length: int
+    percentiles: tuple
+        Percentiles of the run, estimated from its histogram
+    """
+
+    def __init__(self, trend_length=500, percentiles=(1, 50, 99)):
+        self.bin_edges = None
+        self._percentiles = tuple(percentiles)
+        self._trend = np.full((len(TREND), trend_length), np.nan)
+        self.reset()
+
+    def reset(self, bin_edges=None):
+        if bin_edges is not None:
+            self.bin_edges = bin_edges
+        self.n_frames = 0
+        self.histogram = (
+            None
+            if self.bin_edges is None
+            else np.zeros(len(self.bin_edges) - 1, dtype=np.int64)
+        )
+        self.moments = np.zeros(len(MOMENTS))
+        self.moments[_MIN], self.moments[_MAX] = np.inf, -np.inf
+        self._trend[:] = np.nan
+        self._head = 0
+
+    def update(self, histogram, moments):
+        self.n_frames += 1
+        self.histogram += histogram
+        self.moments = merge_moments(self.moments, moments)
+
+        frame = summary(moments)
+        self._trend[:, self._head] = [
+            np.nan if frame[name] is None else frame[name] for name in TREND
+        ]
+        self._head = (self._head + 1) % self._trend.shape[1]
+
+    @property
+    def trend(self):
+        """Frame summaries of shape (len(TREND), trend_length), oldest first"""
+        return np.roll(self._trend, -self._head, axis=1)
+
+    def percentiles(self):
+        values = histogram_percentiles(
+            self.histogram,
+            self.bin_edges,
+            self._percentiles,
+            underflow=self.moments[_UNDER],
+            overflow=self.moments[_OVER],
+        )
+        # string keys survive the JSON header of the wire format
+        return {str(p): float(v) for p, v in zip(self._percentiles, values)}
+
+    def publish(self, data):
+        """Add the run statistics to the frame statistics of IntegratedData"""
+        if data.histogram is None or data.moments is None:
+            return
+        if self.bin_edges is None or not np.array_equal(self.bin_edges, data.bin_edges):
+            self.reset(bin_edges=data.bin_edges)
+        self.update(data.histogram, data.moments)
+
+        data.run_histogram = self.histogram.copy()
+        data.trend = self.trend
+        data.stats = dict(
+            frame=summary(data.moments),
+            run=dict(
+                summary(self.moments),
+                frames=self.n_frames,
+                percentiles=self.percentiles(),
+            ),
+        )
@@ -0,0 +1,112 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import numpy as np
+from scipy import sparse
+
+
+class BatchedCSREngine:
+    """Azimuthal integration of every pulse of a frame in one sparse product
+
+    The CSR matrix maps pixels to radial bins and is built once per
+    geometry, radial range and number of points. Masks are applied as
+    weights on the pixels, so that masks changing from frame to frame do
+    not require a new matrix. Pixels are not split, results match pyFAI
+    "numpy" (no split, histogram). pyFAI "cython" differs in the first bin
+    only, to which it also adds pixels just below the radial range.
+
+    Parameters
+    ----------
+    integrator: pyFAI.azimuthalIntegrator.AzimuthalIntegrator
+    shape: tuple
+        (px, py) of a single pulse
+    npt: int
+        Number of radial bins
+    radial_range: tuple
+        (low, high) in unit
+    unit: str
+    polarization_factor: float
+    correct_solid_angle: bool
+    """
+
+    def __init__(
+        self,
+        integrator,
+        shape,
+        npt,
+        radial_range,
+        unit="q_A^-1",
+        polarization_factor=1,
+        correct_solid_angle=True,
+    ):
+        self._shape = tuple(shape)
+        self._npix = int(np.prod(shape))
+
+        position = integrator.array_from_unit(shape, "center", unit, scale=True)
+        position = position.ravel()
+        low, high = radial_range
+
+        delta = (high - low) / npt
+        bins = np.floor((position - low) / delta).astype(np.int64)
+        # the upper edge belongs to the last bin
+        bins[position == high] = npt - 1
+        inside = (bins >= 0) & (bins < npt)
+        pixels = np.arange(self._npix)[inside]
+
+        self.radial = low + (np.arange(npt) + 0.5) * delta
+        self.matrix = sparse.csr_matrix(
+            (np.ones(pixels.size), (bins[inside], pixels)),
+            shape=(npt, self._npix),
+        )
+
+        normalization = np.ones(self._npix)
+        if correct_solid_angle:
+            normalization *= integrator.solidAngleArray(shape).ravel()
+        if polarization_factor is not None:
+            normalization *= integrator.polarization(
+                shape, factor=polarization_factor
+            ).ravel()
+        self._normalization = normalization
+
+    def integrate(self, data, mask=None):
+        """
+        Parameters
+        ----------
+        data: ndarray
+            Shape (pulses, px, py)
+        mask: ndarray
+            Same shape as data, non-zero for masked pixels
+
+        Returns
+        -------
+        radial: ndarray of shape (npt,)
+        intensities: ndarray of shape (pulses, npt)
+        """
+        pulses = data.shape[0]
+        if data.shape[1:] != self._shape:
+            raise ValueError(
+                f"Engine set up for pulses of shape {self._shape}, got {data.shape[1:]}"
+            )
+
+        # signal and normalization of all pulses side by side, so that one
+        # product with the matrix integrates both
+        stacked = np.empty((2 * pulses, self._npix))
+        signal, norm = stacked[:pulses], stacked[pulses:]
+        signal[...] = data.reshape(pulses, self._npix)
+
+        invalid = np.isnan(signal)
+        if mask is not None:
+            np.logical_or(invalid, mask.reshape(pulses, self._npix), out=invalid)
+        np.copyto(signal, 0, where=invalid)
+        valid = np.logical_not(invalid, out=invalid)
+        np.multiply(valid, self._normalization, out=norm)
+
+        summed = self.matrix @ stacked.T
+        sum_signal, sum_norm = summed[:, :pulses], summed[:, pulses:]
+
+        intensities = np.zeros_like(sum_signal)
+        np.divide(sum_signal, sum_norm, out=intensities, where=sum_norm > 0)
+        return self.radial, intensities.T
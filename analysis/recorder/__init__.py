@@ -0,0 +1,3 @@
+from .hdf5_recorder import RECORDED, Recorder
+
+__all__ = ["RECORDED", "Recorder"]
@@ -0,0 +1,235 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import logging
+import os
+import os.path as osp
+import queue
+import threading
+
+import numpy as np
+
+from analysis.ipc import HandOff
+
+logger = logging.getLogger(__name__)
+
+# IntegratedData fields written, whichever the frames carry
+RECORDED = (
+    "mean_image",
+    "momentum",
+    "intensities",
+    "edges",
+    "packed_edges",
+    "edge_count",
+)
+
+
+def _signature(data, fields):
+    """What has to stay the same for frames to go into the same datasets"""
+    signature = []
+    for name in fields:
+        arr = getattr(data, name)
+        if arr is not None:
+            signature.append((name, arr.shape, arr.dtype.str))
+    return tuple(signature), data.edge_shape
+
+
+class _HDF5File:
+    """One file of a recording, datasets of shape (frames, ...) per field"""
+
+    def __init__(self, path, signature, compression="lzf", chunk_nbytes=2 ** 20):
+        import h5py
+
+        self.path = path
+        self._file = h5py.File(path, "w")
+        self.n_frames = 0
+
+        layout, edge_shape = signature
+        if edge_shape is not None:
+            self._file.attrs["edge_shape"] = edge_shape
+        self._datasets = {}
+        for name, shape, dtype in layout:
+            frame_nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            chunk = max(1, chunk_nbytes // frame_nbytes)
+            self._datasets[name] = self._file.create_dataset(
+                name,
+                shape=(0,) + shape,
+                maxshape=(None,) + shape,
+                dtype=dtype,
+                chunks=(chunk,) + shape,
+                compression=compression,
+            )
+        self._timestamps = self._file.create_dataset(
+            "timestamp",
+            shape=(0,),
+            maxshape=(None,),
+            dtype=h5py.string_dtype(),
+            chunks=(1024,),
+        )
+
+    def append(self, frames):
+        start, stop = self.n_frames, self.n_frames + len(frames)
+        for name, dset in self._datasets.items():
+            dset.resize(stop, axis=0)
+            dset[start:stop] = np.stack([getattr(data, name) for data in frames])
+        self._timestamps.resize(stop, axis=0)
+        self._timestamps[start:stop] = [str(data.timestamp) for data in frames]
+        self.n_frames = stop
+
+    def close(self):
+        self._file.close()
+
+
+class Recorder(threading.Thread):
+    """Write processed frames to chunked, compressed HDF5 files
+
+    put() never waits on the disk: frames are handed to this thread through
+    a bounded queue and the oldest are dropped when the disk cannot keep
+    up. Frames are written in batches, so that a whole chunk is compressed
+    and written at once. A new file is started every frames_per_file
+    frames and whenever the fields or their shapes change, e.g. with the
+    number of integration points.
+
+    Requires h5py, raises ImportError when created without it.
+
+    Parameters
+    ----------
+    directory: str
+    prefix: str
+        Files are named <prefix>_<index>.h5, numbered on after existing ones
+    frames_per_file: int
+        None for a single file
+    buffer_size: int
+        Frames queued for writing before the oldest are dropped
+    batch_size: int
+        Frames written at once
+    compression: str
+        h5py filter, "lzf" or "gzip", None to write uncompressed
+    fields: tuple
+        Fields of IntegratedData written if the frames carry them
+    flush_interval: float
+        Seconds without a new frame after which a partial batch is written
+    """
+
+    def __init__(
+        self,
+        directory,
+        prefix="run",
+        frames_per_file=1000,
+        buffer_size=64,
+        batch_size=16,
+        compression="lzf",
+        fields=RECORDED,
+        flush_interval=1.0,
+    ):
+        try:
+            import h5py  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "Recording requires h5py, install it with pip install -e .[hdf5]"
+            )
+
+        super().__init__(daemon=True)
+        self._directory = directory
+        self._prefix = prefix
+        self._frames_per_file = frames_per_file
+        self._batch_size = batch_size
+        self._compression = compression
+        self._fields = fields
+        self._flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._handoff = HandOff(self._queue, policy="drop-oldest")
+        self._stop_event = threading.Event()
+
+        self._file = None
+        self._signature = None
+        self._batch = []
+        self._index = 0
+        self.files = []
+        self.n_written = 0
+
+    @property
+    def n_dropped(self):
+        return self._handoff.n_dropped
+
+    def put(self, data):
+        """Queue IntegratedData for writing"""
+        self._handoff.put(data)
+
+    def _open(self, signature):
+        self._close()
+        # never overwrite the files of an earlier run
+        while True:
+            path = osp.join(self._directory, f"{self._prefix}_{self._index:04d}.h5")
+            self._index += 1
+            if not osp.exists(path):
+                break
+        self._file = _HDF5File(path, signature, compression=self._compression)
+        self._signature = signature
+        self.files.append(path)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        if not self._batch:
+            return
+        self._file.append(self._batch)
+        self.n_written += len(self._batch)
+        self._batch = []
+
+    def _add(self, data):
+        signature = _signature(data, self._fields)
+        full = (
+            self._frames_per_file is not None
+            and self._file is not None
+            and self._file.n_frames + len(self._batch) >= self._frames_per_file
+        )
+        if signature != self._signature or full:
+            self._flush()
+            self._open(signature)
+
+        self._batch.append(data)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def run(self):
+        os.makedirs(self._directory, exist_ok=True)
+        try:
+            while True:
+                try:
+                    data = self._queue.get(timeout=self._flush_interval)
+                except queue.Empty:
+                    self._flush()
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                try:
+                    self._add(data)
+                except Exception as ex:
+                    # a frame which cannot be written is not worth the run
+                    logger.error(
+                        "Recorder: frames up to %s not written: %s", data.timestamp, ex
+                    )
+                    self._batch = []
+        finally:
+            self._flush()
+            self._close()
+
+    def stop(self):
+        """Write whatever is queued, then close the file"""
+        self._stop_event.set()
+
+    def stats(self):
+        return dict(
+            written=self.n_written,
+            dropped=self.n_dropped,
+            queued=self._queue.qsize(),
+            files=len(self.files),
+        )
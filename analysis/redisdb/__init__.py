@@ -1,2 +1,3 @@
-from .redis_ipc import get_redis_client, DashMeta
+from .config_subscriber import ConfigSnapshot, ConfigSubscriber, keyspace_channel
+from .redis_ipc import DashMeta, get_redis_client, init_redis_client
 from .redis_utils import str2tuple
@@ -0,0 +1,147 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import threading
+from collections import namedtuple
+
+ConfigSnapshot = namedtuple("ConfigSnapshot", ["version", "config"])
+
+
+def keyspace_channel(key, db="*"):
+    """Channel of Redis keyspace notifications for key"""
+    return f"__keyspace@{db}__:{key}"
+
+
+class ConfigSubscriber(threading.Thread):
+    """Keep a parsed copy of a Redis hash up to date in the background
+
+    The hash is read again whenever a message arrives on the channel named
+    after the key, which writers publish to after changing the hash, or a
+    keyspace notification for the key (only sent by servers configured with
+    notify-keyspace-events). With a poll_interval the hash is also read at
+    that interval, which covers writers that do not publish and servers
+    that are not reachable yet.
+
+    Readers only look at snapshot, which is replaced as a whole and never
+    modified, so no lock is needed on the hot path.
+
+    Parameters
+    ----------
+    client: redis.Redis
+    key: str
+        Name of the hash
+    parser: callable
+        Turns the hash (dict of str) into the config. Raising ValueError,
+        KeyError or TypeError rejects the hash and keeps the previous config.
+    defaults: dict
+        Hash used until a valid one is read from Redis
+    poll_interval: float
+        Seconds between reads without notification. None to rely on
+        notifications only.
+    on_change: callable
+        Called with every new snapshot, from the subscriber thread
+    """
+
+    def __init__(
+        self, client, key, parser, defaults, poll_interval=1.0, on_change=None
+    ):
+        super().__init__(daemon=True)
+
+        self._client = client
+        self._key = key
+        self._parser = parser
+        self._poll_interval = poll_interval
+        self._on_change = on_change
+        self._stop_event = threading.Event()
+
+        self._raw = None
+        self.snapshot = ConfigSnapshot(0, parser(defaults))
+
+    @property
+    def config(self):
+        return self.snapshot.config
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def refresh(self):
+        """Read the hash and publish a new snapshot if it has changed
+
+        Returns True if the snapshot was replaced.
+        """
+        try:
+            raw = self._client.hgetall(self._key)
+        except Exception as ex:
+            print("[REDIS] ", ex)
+            return False
+
+        if not raw or raw == self._raw:
+            return False
+        self._raw = raw
+
+        try:
+            config = self._parser(raw)
+        except (ValueError, KeyError, TypeError) as ex:
+            print(f"[REDIS] Ignoring invalid {self._key}: {ex}")
+            return False
+
+        self.snapshot = ConfigSnapshot(self.snapshot.version + 1, config)
+        if self._on_change is not None:
+            self._on_change(self.snapshot)
+        return True
+
+    def _subscribe(self):
+        try:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self._key)
+            pubsub.psubscribe(keyspace_channel(self._key))
+            return pubsub
+        except Exception as ex:
+            print("[REDIS] ", ex)
+            return None
+
+    def run(self):
+        # retry subscribing at the poll interval, or every second without
+        retry = self._poll_interval or 1.0
+        pubsub = None
+        self.refresh()
+        while not self._stop_event.is_set():
+            if pubsub is None:
+                pubsub = self._subscribe()
+                if pubsub is None:
+                    if self._poll_interval:
+                        self.refresh()
+                    self._stop_event.wait(retry)
+                    continue
+                # changes made before the subscription are not notified
+                self.refresh()
+
+            try:
+                message = pubsub.get_message(timeout=self._poll_interval or 1.0)
+            except Exception as ex:
+                print("[REDIS] ", ex)
+                pubsub = None
+                continue
+
+            if message is None:
+                if self._poll_interval:
+                    self.refresh()
+                continue
+
+            # fold notifications of a burst of changes into one read
+            try:
+                while pubsub.get_message(timeout=0) is not None:
+                    pass
+            except Exception:
+                pubsub = None
+            self.refresh()
+
+        if pubsub is not None:
+            pubsub.close()
+
+    def stop(self):
+        self._stop_event.set()
@@ -7,9 +7,9 @@ All rights reserved.
 
 import redis
 
-
 GLOBAL_REDIS_CLIENT = None
 
+
 def get_redis_client():
     global GLOBAL_REDIS_CLIENT
 
@@ -19,6 +19,18 @@ def get_redis_client():
     return GLOBAL_REDIS_CLIENT
 
 
+def init_redis_client(host="127.0.0.1", port=6379):
+    """Point get_redis_client at the server on host:port
+
+    Processes forked afterwards inherit the client.
+    """
+    global GLOBAL_REDIS_CLIENT
+
+    GLOBAL_REDIS_CLIENT = redis.Redis(host=host, port=port, decode_responses=True)
+
+    return GLOBAL_REDIS_CLIENT
+
+
 class DashMeta:
     AZIMUTHAL_META = "meta:azimuthal_meta"
     EDGE_META = "meta:edge_meta"
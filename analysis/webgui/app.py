@@ -10,12 +10,14 @@ import dash
 import numpy as np
 import plotly.graph_objs as go
 import psutil as ps
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 
 from analysis.config import config
 from analysis.redisdb import DashMeta, get_redis_client
+from analysis.webgui.frame_cache import FrameCache, FrameReceiver
 from analysis.webgui.layout import get_layout
-from analysis.zmq_streamer.data_streamer import DataClient
+from analysis.webgui.live import frame_message, register_stream
+from analysis.webgui.tiling import ImagePyramid, axis_range
 
 
 def get_virtual_memory():
@@ -29,12 +31,16 @@ class DashApp:
         app.config["suppress_callback_exceptions"] = True
         self._app = app
         self._config = config
-        self._data_client = None
+        # frames are received in the background and shared by all sessions
+        self._cache = FrameCache(maxlen=config["frame_cache_size"])
+        self._receiver = None
         self._db = get_redis_client()
         self._dmt = DashMeta()
 
         self.setLayout()
         self.register_callbacks()
+        if config["push_updates"]:
+            register_stream(app.server, self._cache, heartbeat=config["push_heartbeat"])
 
     def setLayout(self):
         self._app.layout = get_layout(config["TIME_OUT"], self._config)
@@ -45,31 +51,69 @@ class DashApp:
         @self._app.callback(
             Output("stream-info", "children"),
             [Input("start", "on")],
-            [State("hostname", "value"), State("port", "value")],
+            [
+                State("hostname", "value"),
+                State("port", "value"),
+                State("sock", "value"),
+            ],
         )
-        def stream(state, hostname, port):
+        def stream(state, hostname, port, sock):
             info = ""
+            if self._receiver is not None:
+                self._receiver.stop()
+                self._receiver = None
             if state:
                 if not (hostname and port):
                     info = "Either hostname or port number missing"
                     return [info]
                 print("Address ", f"tcp://{hostname}:{port}")
-                self._data_client = DataClient(f"tcp://{hostname}:{port}")
+                # viewers only want the latest frame of a PUB stream
+                # only the edge occupancy is shown, ask for counts
+                self._receiver = FrameReceiver(
+                    f"tcp://{hostname}:{port}",
+                    self._cache,
+                    sock=sock,
+                    interval=config["receive_interval"],
+                    conflate=sock == "SUB",
+                    representation=dict(edges="count"),
+                )
+                self._receiver.start()
                 info = f"Listening to tcp://{hostname}:{port}"
 
-            elif not state:
-                self._data_client = None
-
             return [info]
 
         @self._app.callback(
-            Output("timestamp", "value"), [Input("interval_component", "n_intervals")]
+            Output("live-frame", "data"),
+            [Input("interval_component", "n_intervals")],
+            [State("frame-version", "data")],
         )
-        def update_train_id(n):
-            self._update()
-            if self._data is None:
+        def update_train_id(n, shown):
+            # polling fallback of the pushed updates, only reads the cache
+            frame = self._cache.latest()
+            if frame is None or frame.version == shown:
                 raise dash.exceptions.PreventUpdate
-            return str(self._data.timestamp)
+            return frame_message(frame)
+
+        # the timestamp, the version the server side figures show and the
+        # I(q) curves are updated in the browser from live-frame
+        self._app.clientside_callback(
+            ClientsideFunction(namespace="live", function_name="render"),
+            [
+                Output("timestamp", "value"),
+                Output("frame-version", "data"),
+                Output("ai-integral", "figure"),
+            ],
+            [Input("live-frame", "data")],
+            [State("n-pulses", "value")],
+        )
+
+        if config["push_updates"]:
+            # frames are pushed while streaming, which stops the polling
+            self._app.clientside_callback(
+                ClientsideFunction(namespace="live", function_name="connect"),
+                Output("interval_component", "disabled"),
+                [Input("start", "on")],
+            )
 
         @self._app.callback(
             [
@@ -94,90 +138,109 @@ class DashApp:
 
         @self._app.callback(
             Output("mean-image", "figure"),
-            [Input("color-scale", "value"), Input("timestamp", "value")],
+            [
+                Input("color-scale", "value"),
+                Input("frame-version", "data"),
+                Input("mean-image", "relayoutData"),
+            ],
         )
-        def update_image_figure(color_scale, timestamp):
-            if self._data.timestamp != timestamp or self._data.mean_image is None:
-                raise dash.exceptions.PreventUpdate
-
-            traces = [go.Heatmap(z=self._data.mean_image, colorscale=color_scale)]
-            figure = {
-                "data": traces,
-                "layout": go.Layout(
-                    margin={"l": 40, "b": 40, "t": 40, "r": 10},
-                    title="Raw Image",
-                ),
-            }
-
-            return figure
+        def update_image_figure(color_scale, version, relayout):
+            frame = self._frame(version)
+            return self._heatmap(
+                frame, "mean_image", color_scale, relayout, "Raw Image"
+            )
 
         @self._app.callback(
             Output("mean-edges", "figure"),
-            [Input("color-scale", "value"), Input("timestamp", "value")],
+            [
+                Input("color-scale", "value"),
+                Input("frame-version", "data"),
+                Input("mean-edges", "relayoutData"),
+            ],
         )
-        def update_edge_figure(color_scale, timestamp):
-            if self._data.timestamp != timestamp or self._data.edges is None:
-                raise dash.exceptions.PreventUpdate
-
-            traces = [
-                go.Heatmap(z=np.mean(self._data.edges, axis=0), colorscale=color_scale)
-            ]
-            figure = {
-                "data": traces,
-                "layout": go.Layout(
-                    margin={"l": 40, "b": 40, "t": 40, "r": 10},
-                    title="Edge detection",
-                ),
-            }
-
-            return figure
+        def update_edge_figure(color_scale, version, relayout):
+            frame = self._frame(version)
+            return self._heatmap(
+                frame, "edges", color_scale, relayout, "Edge detection"
+            )
 
         @self._app.callback(
-            Output("histogram", "figure"), [Input("timestamp", "value")]
+            Output("histogram", "figure"), [Input("frame-version", "data")]
         )
-        def update_histogram_figure(timestamp):
-            if self._data.timestamp != timestamp or self._data.mean_image is None:
+        def update_histogram_figure(version):
+            data = self._frame(version).data
+            if data.histogram is not None:
+                bins, hist = data.bin_edges, data.histogram
+            elif data.mean_image is not None:
+                hist, bins = np.histogram(data.mean_image.ravel(), bins=100)
+            else:
                 raise dash.exceptions.PreventUpdate
-            hist, bins = np.histogram(self._data.mean_image.ravel(), bins=100)
             bin_center = (bins[1:] + bins[:-1]) / 2.0
-            traces = [{"x": bin_center, "y": hist, "type": "bar"}]
+            traces = [{"x": bin_center, "y": hist, "type": "bar", "name": "Frame"}]
+            if data.run_histogram is not None and data.run_histogram.any():
+                # run histogram scaled to the counts of one frame
+                scale = hist.sum() / data.run_histogram.sum()
+                traces.append(
+                    {
+                        "x": bin_center,
+                        "y": data.run_histogram * scale,
+                        "type": "scatter",
+                        "mode": "lines",
+                        "name": "Run",
+                    }
+                )
+            title = None
+            if data.stats is not None:
+                run = data.stats["run"]
+                title = ", ".join(
+                    f"p{p}: {v:.3g}" for p, v in run["percentiles"].items()
+                )
             figure = {
                 "data": traces,
                 "layout": go.Layout(
                     margin={"l": 40, "b": 40, "t": 40, "r": 10},
+                    showlegend=False,
+                    title=title,
+                    uirevision="histogram",
                 ),
             }
 
             return figure
 
-        @self._app.callback(
-            Output("ai-integral", "figure"),
-            [Input("timestamp", "value")],
-            [State("n-pulses", "value")],
-        )
-        def update_correlation_figure(timestamp, pulses):
-            if self._data.timestamp != timestamp or self._data is None:
+        @self._app.callback(Output("trend", "figure"), [Input("frame-version", "data")])
+        def update_trend_figure(version):
+            data = self._frame(version).data
+            if data.trend is None:
                 raise dash.exceptions.PreventUpdate
-
-            try:
-                y = getattr(self._data, "intensities")
-                x = getattr(self._data, "momentum")
-                traces = [
-                    go.Scatter(x=x, y=y[i], name=f"Pulse {i}")
-                    for i in range(y[:pulses, ...].shape[0])
-                ]
-            except Exception:
-                raise dash.exceptions.PreventUpdate
-
+            mean, std, low, high = data.trend
+            frames = np.arange(-len(mean) + 1, 1)
+            traces = [
+                go.Scatter(x=frames, y=high, name="Max", line=dict(dash="dot")),
+                go.Scatter(
+                    x=frames,
+                    y=mean + std,
+                    showlegend=False,
+                    mode="lines",
+                    line=dict(width=0),
+                ),
+                go.Scatter(
+                    x=frames,
+                    y=mean - std,
+                    name="Mean \u00b1 std",
+                    mode="lines",
+                    line=dict(width=0),
+                    fill="tonexty",
+                ),
+                go.Scatter(x=frames, y=mean, name="Mean"),
+                go.Scatter(x=frames, y=low, name="Min", line=dict(dash="dot")),
+            ]
             figure = {
                 "data": traces,
                 "layout": go.Layout(
-                    xaxis={"title": "q"},
-                    yaxis={"title": "I(q)"},
+                    xaxis={"title": "Frames ago"},
                     margin={"l": 40, "b": 40, "t": 40, "r": 10},
-                    hovermode="closest",
-                    showlegend=True,
-                    title="Integrated Image",
+                    title="Trend",
+                    uirevision="trend",
                 ),
             }
 
@@ -223,15 +286,71 @@ class DashApp:
 
             try:
                 self._db.hmset(self._dmt.AZIMUTHAL_META, ai_config)
+                # tell the processors to read the new parameters
+                self._db.publish(self._dmt.AZIMUTHAL_META, "changed")
             except Exception as ex:
                 print("[REDIS] ", ex)
             return f"Redis Hash set: {ai_config}"
 
-    def _update(self):
-        self._data = None
-        if self._data_client is not None:
+        @self._app.callback(
+            Output("edge-logger", "children"),
+            [Input("sigma", "value"), Input("apply-filter", "value")],
+        )
+        def update_edge_params(sigma, apply_filter):
+            edge_config = dict(
+                sigma=sigma, apply_filter=str("apply_filter" in (apply_filter or []))
+            )
+
             try:
-                self._data = self._data_client.next()
+                self._db.hmset(self._dmt.EDGE_META, edge_config)
+                self._db.publish(self._dmt.EDGE_META, "changed")
             except Exception as ex:
-                print(ex)
-                pass
+                print("[REDIS] ", ex)
+            return f"Redis Hash set: {edge_config}"
+
+    def _frame(self, version):
+        """Frame a session was told about, consistent across its callbacks"""
+        frame = self._cache.get(version) if version is not None else None
+        if frame is None:
+            raise dash.exceptions.PreventUpdate
+        return frame
+
+    @staticmethod
+    def _pyramid(frame, name):
+        """Pyramid of mean_image or edge occupancy, built once per frame"""
+        if name not in frame.views:
+            if name == "edges":
+                # max keeps thin edges visible at coarse levels
+                image, reduce = frame.data.edge_occupancy(), "max"
+            else:
+                image, reduce = getattr(frame.data, name), "mean"
+            # sessions racing here build the same pyramid, either one is fine
+            frame.views[name] = (
+                None
+                if image is None
+                else ImagePyramid(
+                    image, reduce=reduce, max_side=config["heatmap_max_side"]
+                )
+            )
+        return frame.views[name]
+
+    def _heatmap(self, frame, name, color_scale, relayout, title):
+        """Heatmap of the zoomed region at a resolution bounded by max_side"""
+        pyramid = self._pyramid(frame, name)
+        if pyramid is None:
+            raise dash.exceptions.PreventUpdate
+
+        rows, cols = pyramid.shape
+        z, x, y = pyramid.view(
+            axis_range(relayout, "xaxis", cols), axis_range(relayout, "yaxis", rows)
+        )
+        traces = [go.Heatmap(z=z, x=x, y=y, colorscale=color_scale)]
+        return {
+            "data": traces,
+            "layout": go.Layout(
+                margin={"l": 40, "b": 40, "t": 40, "r": 10},
+                title=title,
+                # keep the zoom of the user across updates
+                uirevision=name,
+            ),
+        }
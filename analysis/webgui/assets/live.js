@@ -0,0 +1,85 @@
+/*
+ * Live updates pushed by the server as server-sent events, see
+ * analysis/webgui/live.py
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        source: null,
+
+        // Open the event stream while streaming is on. Returns whether the
+        // interval polling is to be disabled.
+        connect: function (on) {
+            var live = window.dash_clientside.live;
+            if (live.source !== null) {
+                live.source.close();
+                live.source = null;
+            }
+            if (!on || !window.EventSource) {
+                return false;
+            }
+
+            live.source = new window.EventSource("live/frames");
+            live.source.addEventListener("frame", function (event) {
+                window.dash_clientside.set_props("live-frame", {
+                    data: JSON.parse(event.data),
+                });
+            });
+            // EventSource reconnects on its own after errors
+            return true;
+        },
+
+        // Timestamp, version for the server side figures and the I(q)
+        // figure, built here from the typed arrays of the message
+        render: function (frame, pulses) {
+            var no_update = window.dash_clientside.no_update;
+            if (!frame) {
+                return [no_update, no_update, no_update];
+            }
+            if (!frame.intensities) {
+                return [frame.timestamp, frame.version, no_update];
+            }
+
+            var n = Math.min(frame.intensities.length, pulses || 1);
+            var traces = [];
+            for (var i = 0; i < n; i++) {
+                traces.push({
+                    type: "scatter",
+                    x: frame.momentum,
+                    y: frame.intensities[i],
+                    name: "Pulse " + i,
+                });
+            }
+            // averages over trains, see analysis/processor/accumulator.py
+            var rolling = frame.rolling || {};
+            var averages = [
+                ["on_mean", "On"],
+                ["off_mean", "Off"],
+                ["difference", "On - off"],
+            ];
+            for (var j = 0; j < averages.length; j++) {
+                if (rolling[averages[j][0]]) {
+                    traces.push({
+                        type: "scatter",
+                        x: frame.momentum,
+                        y: rolling[averages[j][0]],
+                        name: averages[j][1] + " (" + frame.trains + " trains)",
+                        line: {dash: "dash"},
+                    });
+                }
+            }
+            var figure = {
+                data: traces,
+                layout: {
+                    xaxis: {title: {text: "q"}},
+                    yaxis: {title: {text: "I(q)"}},
+                    margin: {l: 40, b: 40, t: 40, r: 10},
+                    hovermode: "closest",
+                    showlegend: true,
+                    title: {text: "Integrated Image"},
+                    uirevision: "ai-integral",
+                },
+            };
+            return [frame.timestamp, frame.version, figure];
+        },
+    },
+});
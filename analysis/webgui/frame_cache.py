@@ -0,0 +1,126 @@
+"""
+Image analysis and web visualization
+
+Author: Ebad Kamil <kamilebad@gmail.com>
+All rights reserved.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from analysis.zmq_streamer.data_streamer import DataClient
+
+# views holds whatever callbacks derive from data, e.g. heatmap pyramids,
+# so that each frame is prepared once for every session
+Frame = namedtuple("Frame", ["version", "data", "views"])
+
+
+class FrameCache:
+    """The last few frames received, numbered in order of arrival
+
+    Shared by every browser session. The data of a Frame is never modified
+    once put, so callbacks can use it without holding the lock.
+
+    Parameters
+    ----------
+    maxlen: int
+        Number of frames kept, sessions a few ticks behind still find
+        the frame they were told about.
+    """
+
+    def __init__(self, maxlen=4):
+        self._maxlen = maxlen
+        self._frames = OrderedDict()
+        self._version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def put(self, data):
+        with self._cond:
+            self._version += 1
+            self._frames[self._version] = Frame(self._version, data, {})
+            while len(self._frames) > self._maxlen:
+                self._frames.popitem(last=False)
+            self._cond.notify_all()
+            return self._version
+
+    def latest(self):
+        """Most recent Frame, None before the first one"""
+        with self._cond:
+            return self._frames.get(self._version)
+
+    def get(self, version):
+        """Frame of version, None once it was pushed out"""
+        with self._cond:
+            return self._frames.get(version)
+
+    def wait(self, version, timeout=None):
+        """Wait for a frame newer than version and return the latest one
+
+        Returns None on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > version, timeout):
+                return None
+            return self._frames.get(self._version)
+
+    def clear(self):
+        with self._cond:
+            self._frames.clear()
+
+
+class FrameReceiver(threading.Thread):
+    """Receive frames from a DataStreamer into a FrameCache
+
+    The DataClient lives in this thread only, ZMQ sockets are not thread
+    safe, and Dash callbacks never wait on the network.
+
+    Parameters
+    ----------
+    endpoint: str
+    cache: FrameCache
+    sock: str
+        "REQ", "SUB" or "PULL"
+    interval: float
+        REQ only, seconds between requests. Frames are not asked for faster
+        than they can be shown.
+    timeout: int
+        Milliseconds to wait for a frame before checking for stop()
+    client_kwargs: dict
+        Further arguments of DataClient
+    """
+
+    def __init__(
+        self, endpoint, cache, sock="REQ", interval=0.1, timeout=500, **client_kwargs
+    ):
+        super().__init__(daemon=True)
+        self._endpoint = endpoint
+        self._cache = cache
+        self._sock = sock
+        self._interval = interval
+        self._timeout = timeout
+        self._client_kwargs = client_kwargs
+        self._stop_event = threading.Event()
+
+    def run(self):
+        client = DataClient(self._endpoint, sock=self._sock, **self._client_kwargs)
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    data = client.next(timeout=self._timeout)
+                except Exception as ex:
+                    print(ex)
+                    self._stop_event.wait(self._interval)
+                    continue
+
+                if data is not None:
+                    self._cache.put(data)
+                    if self._sock == "REQ":
+                        self._stop_event.wait(self._interval)
+        finally:
+            client.close()
+
+    def stop(self):
+        self._stop_event.set()
@@ -33,6 +33,15 @@ def get_stream_tab(config):
                                 type="text",
                                 value=config["port"],
                             ),
+                            html.Label("Socket"),
+                            dcc.Dropdown(
+                                id="sock",
+                                options=[
+                                    {"label": i, "value": i}
+                                    for i in ["REQ", "SUB", "PULL"]
+                                ],
+                                value=config["sock"],
+                            ),
                             html.Hr(),
                             daq.BooleanSwitch(id="start", on=False),
                         ],
@@ -126,12 +135,14 @@ def get_plot_tab(config):
                             html.Hr(),
                             html.Label("Apply Gaussian filter:", className="leftbox"),
                             dcc.Checklist(
+                                id="apply-filter",
                                 options=[
                                     {"value": "apply_filter"},
                                 ],
                                 value=["apply_filter"],
                                 className="rightbox",
                             ),
+                            html.Div(id="edge-logger"),
                             html.Label("Integration range:", className="leftbox"),
                             dcc.RangeSlider(
                                 id="int-rng",
@@ -212,6 +223,15 @@ def get_plot_tab(config):
                 ],
                 className="row",
             ),
+            html.Div(
+                [
+                    html.Div(
+                        [dcc.Graph(id="trend")],
+                        className="pretty_container twelve columns",
+                    ),
+                ],
+                className="row",
+            ),
         ]
     )
     return div
@@ -260,6 +280,10 @@ def get_layout(UPDATE_INT, config=None):
                 color="#FF5E5E",
                 style=dict(textAlign="center"),
             ),
+            # version of the frame in the FrameCache the figures show
+            dcc.Store(id="frame-version"),
+            # message of the latest frame, pushed or polled
+            dcc.Store(id="live-frame"),
             html.Br(),
             html.Div(
                 children=[
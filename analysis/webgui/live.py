@@ -0,0 +1,84 @@
+"""
+Image analysis and web visualization
+
+Author: Ebad Kamil <kamilebad@gmail.com>
+All rights reserved.
+"""
+import base64
+import json
+
+import numpy as np
+from flask import Response
+
+from analysis.processor.accumulator import ROLLING
+
+
+def _typed_array(arr):
+    """Plotly.js typed array spec, base64 float32 rather than a JSON list"""
+    arr = np.ascontiguousarray(arr, dtype="<f4")
+    return {
+        "dtype": "f4",
+        "shape": list(arr.shape),
+        "bdata": base64.b64encode(arr).decode(),
+    }
+
+
+def frame_message(frame, max_pulses=None):
+    """What the browser needs to show a Frame without asking the server
+
+    Curves are sent in full, heatmaps are requested by version from the
+    figure callbacks since they depend on the zoom of each session.
+    """
+    data = frame.data
+    timestamp = str(data.timestamp)
+    if data.frame is not None:
+        # timestamps are only to the second
+        timestamp = f"{timestamp} #{data.frame}"
+    message = {"version": frame.version, "timestamp": timestamp}
+    if data.momentum is not None and data.intensities is not None:
+        message["momentum"] = _typed_array(data.momentum)
+        message["intensities"] = [
+            _typed_array(row) for row in data.intensities[:max_pulses]
+        ]
+    if data.rolling is not None:
+        message["rolling"] = {
+            name: _typed_array(row)
+            for name, row in zip(ROLLING, data.rolling)
+            if not np.isnan(row).all()
+        }
+        if data.stats is not None and "rolling" in data.stats:
+            message["trains"] = data.stats["rolling"]["trains"]
+    return message
+
+
+def register_stream(server, cache, route="/live/frames", heartbeat=15.0, **kwargs):
+    """Serve new frames of cache as server-sent events on route
+
+    A message is only sent when a new frame arrives. A comment is sent
+    every heartbeat seconds otherwise, so that proxies keep the connection
+    open and closed connections are noticed.
+
+    kwargs are passed to frame_message.
+    """
+
+    def stream():
+        version = 0
+        while True:
+            frame = cache.wait(version, timeout=heartbeat)
+            if frame is None:
+                # timed out, or the frame is already gone from the cache
+                version = max(version, cache.version)
+                yield ": heartbeat\n\n"
+                continue
+            version = frame.version
+            message = json.dumps(frame_message(frame, **kwargs))
+            yield f"event: frame\nid: {version}\ndata: {message}\n\n"
+
+    def frames():
+        return Response(
+            stream(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    server.add_url_rule(route, "live_frames", frames)
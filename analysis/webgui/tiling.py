@@ -0,0 +1,115 @@
+"""
+Image analysis and web visualization
+
+Author: Ebad Kamil <kamilebad@gmail.com>
+All rights reserved.
+"""
+import numpy as np
+
+_reducers = {"mean": np.add, "max": np.maximum}
+
+
+def _downsample(image, reduce):
+    """Halve both axes by reducing 2x2 blocks, odd edges are repeated"""
+    px, py = image.shape
+    if reduce == "mean" and not np.issubdtype(image.dtype, np.floating):
+        image = image.astype(np.float64)
+    if px % 2 or py % 2:
+        image = np.pad(image, ((0, px % 2), (0, py % 2)), mode="edge")
+    # four strided views rather than a reduction over a reshaped array,
+    # which numpy is much slower at
+    op = _reducers[reduce]
+    out = op(image[0::2, 0::2], image[1::2, 0::2])
+    op(out, image[0::2, 1::2], out=out)
+    op(out, image[1::2, 1::2], out=out)
+    if reduce == "mean":
+        out *= 0.25
+    return out
+
+
+def axis_range(relayout, axis, size):
+    """(low, high) pixel range of axis ("xaxis" or "yaxis") from relayoutData
+
+    None when the view is reset to the full image or relayout does not
+    mention the axis.
+    """
+    if not relayout or relayout.get(f"{axis}.autorange"):
+        return None
+    if f"{axis}.range[0]" in relayout:
+        low, high = relayout[f"{axis}.range[0]"], relayout[f"{axis}.range[1]"]
+    elif f"{axis}.range" in relayout:
+        low, high = relayout[f"{axis}.range"]
+    else:
+        return None
+    low, high = sorted((low, high))
+    return max(0.0, low), min(float(size), high)
+
+
+class ImagePyramid:
+    """Downsampled copies of an image for bounded heatmap payloads
+
+    Level n reduces blocks of 2^n x 2^n pixels with reduce, "mean" for
+    images or "max" for sparse maps such as edges which would fade away
+    when averaged. Levels are built once per image, views then only crop.
+
+    Parameters
+    ----------
+    image: ndarray
+        Shape (px, py)
+    reduce: str
+        "mean" or "max"
+    max_side: int
+        Largest number of pixels per axis a view returns
+    """
+
+    def __init__(self, image, reduce="mean", max_side=256):
+        if reduce not in _reducers:
+            raise ValueError(
+                f"Unknown reduction {reduce}. Use one of {list(_reducers)}"
+            )
+
+        self._shape = image.shape
+        self._max_side = max_side
+        self.levels = [image]
+        while max(self.levels[-1].shape) > max_side:
+            self.levels.append(_downsample(self.levels[-1], reduce))
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def view(self, x_range=None, y_range=None):
+        """Finest level at which the region of interest fits in max_side
+
+        Parameters
+        ----------
+        x_range, y_range: tuple
+            (low, high) in pixels of the full image along columns and rows,
+            None for the whole axis
+
+        Returns
+        -------
+        z: ndarray
+            Crop of the chosen level, at most max_side per axis
+        x, y: ndarray
+            Centres of the returned pixels in full image pixels, so that
+            axes stay the same whichever level is shown
+        """
+        rows, cols = self._shape
+        y_low, y_high = y_range if y_range is not None else (0, rows)
+        x_low, x_high = x_range if x_range is not None else (0, cols)
+
+        for level, image in enumerate(self.levels):
+            scale = 2 ** level
+            r0, r1 = int(y_low // scale), int(np.ceil(y_high / scale))
+            c0, c1 = int(x_low // scale), int(np.ceil(x_high / scale))
+            if max(r1 - r0, c1 - c0) <= self._max_side:
+                break
+        r1, c1 = min(r1, image.shape[0]), min(c1, image.shape[1])
+        r0, c0 = min(r0, max(r1 - 1, 0)), min(c0, max(c1 - 1, 0))
+
+        z = image[r0:r1, c0:c1]
+        # centre of block i of level n is at (i + 0.5) * 2^n - 0.5
+        x = (np.arange(c0, c1) + 0.5) * scale - 0.5
+        y = (np.arange(r0, r1) + 0.5) * scale - 0.5
+        return z, x, y
@@ -4,22 +4,89 @@ Analysis and visualization software
 Author: Ebad Kamil <ebad.kamil@xfel.eu>
 All rights reserved.
 """
-import pickle
+import json
+import logging
 import queue
+import time
 from threading import Thread
 
 import zmq
 
+from analysis.metrics import LatencyTracker, stamp
+from analysis.zmq_streamer.serializer import (
+    FORMATS,
+    MULTIPART,
+    PICKLE,
+    SerializationError,
+    decode,
+    encode,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _error_reply(text):
+    return json.dumps({"error": text}).encode()
+
 
 class DataStreamer(Thread):
-    def __init__(self, endpoint, buffer, sock="REP"):
+    """
+    Parameters
+    ----------
+    endpoint: str
+        Address to bind to
+    buffer: queue.Queue
+        Processed data to send
+    sock: str
+        "REP": one message per client request.
+        "PUB": every message to every subscriber.
+        "PUSH": each message to one of the connected workers.
+    fmt: str
+        Wire format for PUB and PUSH. REP clients ask for their own format.
+    hwm: int
+        Send high-water mark. PUB drops messages for subscribers which are
+        this many messages behind, PUSH waits.
+    representation: dict
+        Keyword arguments of IntegratedData.compact applied before sending,
+        e.g. dict(image_dtype="float16", edges="count"). None to send data
+        as processed. REP clients may ask for their own.
+    latency: LatencyTracker
+        Records the time frames wait to be sent. REP clients can ask for
+        its summary with b"latency".
+    metrics: LoopMetrics
+        Updated with every frame sent, optional
+    """
+
+    _socket_types = {"REP": zmq.REP, "PUB": zmq.PUB, "PUSH": zmq.PUSH}
+
+    def __init__(
+        self,
+        endpoint,
+        buffer,
+        sock="REP",
+        fmt=MULTIPART,
+        hwm=10,
+        representation=None,
+        latency=None,
+        metrics=None,
+    ):
         super().__init__()
         self._context = zmq.Context()
 
-        if sock != "REP":
+        if sock not in self._socket_types:
             raise NotImplementedError(f"Socket type {sock} not implemented")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}. Use one of {FORMATS}")
 
-        self._socket = self._context.socket(zmq.REP)
+        self._sock = sock
+        self._fmt = fmt
+        self._representation = representation
+        self._latency = latency if latency is not None else LatencyTracker()
+        self._metrics = metrics
+        self._socket = self._context.socket(self._socket_types[sock])
+        self._socket.setsockopt(zmq.SNDHWM, hwm)
+        # bounds how long a blocked send or poll keeps stop() waiting
+        self._socket.setsockopt(zmq.SNDTIMEO, 100)
         self._socket.bind(endpoint)
 
         self._buffer = buffer
@@ -27,15 +94,10 @@ class DataStreamer(Thread):
 
     def run(self):
         try:
-            while self._running:
-                req = self._socket.recv()
-                if req == b"next":
-                    try:
-                        msg = self._buffer.get()
-                        self._socket.send(pickle.dumps(msg))
-                        print("Dispatched data to zmq client ...")
-                    except queue.Empty:
-                        continue
+            if self._sock == "REP":
+                self._reply()
+            else:
+                self._stream()
         except Exception as ex:
             print("Exception ", ex)
 
@@ -43,21 +105,255 @@ class DataStreamer(Thread):
             self._socket.setsockopt(zmq.LINGER, 0)
             self._socket.close()
 
+    def _reply(self):
+        waiting = time.perf_counter()
+        while self._running:
+            if not self._socket.poll(100):
+                continue
+
+            req = self._socket.recv()
+            if req == b"formats":
+                self._socket.send(json.dumps(FORMATS).encode())
+                continue
+            if req == b"latency":
+                self._socket.send(json.dumps(self._latency.summary()).encode())
+                continue
+
+            # b"next" alone is answered with pickle for older clients,
+            # b"next <fmt> <json>" asks for a representation as well
+            cmd, _, args = req.partition(b" ")
+            fmt, _, representation = args.partition(b" ")
+            fmt = fmt.decode() or PICKLE
+            if cmd != b"next" or fmt not in FORMATS:
+                self._socket.send(_error_reply(f"Bad request {req[:64]}"))
+                continue
+            try:
+                representation = (
+                    json.loads(representation)
+                    if representation
+                    else self._representation
+                )
+            except ValueError:
+                self._socket.send(_error_reply(f"Bad representation {req[:64]}"))
+                continue
+
+            msg = self._next()
+            if msg is None:
+                # stopped while waiting for a frame, the client gets an
+                # answer instead of waiting for one which never comes
+                self._socket.send(_error_reply("Streamer stopped"))
+                break
+            try:
+                start = time.perf_counter()
+                if representation:
+                    msg = msg.compact(**representation)
+                self._send(msg, fmt)
+                self._sent(start, waiting)
+                waiting = time.perf_counter()
+                logger.debug("Dispatched frame %s to zmq client", msg.frame)
+            except (TypeError, ValueError) as ex:
+                self._socket.send(_error_reply(str(ex)))
+
+    def _stream(self):
+        waiting = time.perf_counter()
+        while self._running:
+            msg = self._next()
+            if msg is None:
+                break
+            start = time.perf_counter()
+
+            if self._representation:
+                msg = msg.compact(**self._representation)
+            while self._running:
+                try:
+                    self._send(msg, self._fmt)
+                    break
+                except zmq.Again:
+                    # PUSH without any worker with room left
+                    continue
+            self._sent(start, waiting)
+            waiting = time.perf_counter()
+
+    def _next(self):
+        """Next frame of the buffer, None once stopped"""
+        while self._running:
+            try:
+                return self._buffer.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _send(self, msg, fmt):
+        if msg.trace is not None:
+            # a new dict, the recorder may hold on to the same frame
+            msg.trace = stamp(dict(msg.trace), "sent")
+        self._socket.send_multipart(encode(msg, fmt), copy=False)
+        self._latency.record(msg.trace, ("sent",))
+
+    def _sent(self, start, waiting):
+        if self._metrics is not None:
+            work = time.perf_counter() - start
+            self._metrics.frame(work)
+            self._metrics.waited(start - waiting)
+
     def stop(self):
         self._running = False
 
 
 class DataClient:
-    def __init__(self, endpoint, sock="REQ"):
+    """
+    Parameters
+    ----------
+    endpoint: str
+        Address of the DataStreamer
+    sock: str
+        "REQ", "SUB" or "PULL", must pair with REP, PUB and PUSH of the
+        DataStreamer respectively.
+    fmt: str
+        Wire format, one of FORMATS. "auto" asks the server which formats
+        it supports and picks the first of FORMATS it offers. SUB and PULL
+        take whatever the server sends.
+    allow_pickle: bool
+        Refuse pickled messages if False
+    timeout: int
+        Milliseconds to wait for the server to answer the format query.
+        Servers which do not answer are assumed to only speak pickle.
+    hwm: int
+        Receive high-water mark for SUB and PULL
+    conflate: bool
+        SUB only. Skip to the most recent message queued on the socket, for
+        viewers which only care about the latest data. ZMQ_CONFLATE does not
+        support multipart messages, so older messages are drained instead.
+    representation: dict
+        REQ only. Keyword arguments of IntegratedData.compact the server
+        applies before sending, e.g. dict(image_dtype="float16",
+        edges="count") for viewers which only show the edge occupancy.
+        SUB and PULL get the representation the server is configured with.
+
+    The delivery latency and the age of received frames are kept in the
+    LatencyTracker latency.
+    """
+
+    _socket_types = {"REQ": zmq.REQ, "SUB": zmq.SUB, "PULL": zmq.PULL}
+
+    def __init__(
+        self,
+        endpoint,
+        sock="REQ",
+        fmt="auto",
+        allow_pickle=True,
+        timeout=1000,
+        hwm=10,
+        conflate=False,
+        representation=None,
+    ):
         self._context = zmq.Context()
-        if sock != "REQ":
+        if sock not in self._socket_types:
             raise NotImplementedError(f"Socket type {sock} not implemented")
+        if fmt != "auto" and fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}. Use one of {FORMATS}")
 
-        self._socket = self._context.socket(zmq.REQ)
+        self._sock = sock
+        self._socket = self._context.socket(self._socket_types[sock])
         self._socket.setsockopt(zmq.LINGER, 0)
+        if sock == "REQ":
+            # allow a new request when the format query was left unanswered
+            self._socket.setsockopt(zmq.REQ_RELAXED, 1)
+            self._socket.setsockopt(zmq.REQ_CORRELATE, 1)
+        else:
+            self._socket.setsockopt(zmq.RCVHWM, hwm)
+        if sock == "SUB":
+            self._socket.setsockopt(zmq.SUBSCRIBE, b"")
         self._socket.connect(endpoint)
 
-    def next(self):
-        _ = self._socket.send(b"next")
-        message = self._socket.recv()
-        return pickle.loads(message)
+        self._fmt = None if fmt == "auto" and sock == "REQ" else fmt
+        self._allow_pickle = allow_pickle
+        self._timeout = timeout
+        self._conflate = conflate and sock == "SUB"
+        self._representation = representation
+        self.latency = LatencyTracker()
+
+    @property
+    def fmt(self):
+        return self._fmt
+
+    def _negotiate(self):
+        self._socket.send(b"formats")
+        if self._socket.poll(self._timeout):
+            offered = json.loads(self._socket.recv())
+            for fmt in FORMATS:
+                if fmt in offered:
+                    return fmt
+        return PICKLE
+
+    def server_latency(self, timeout=None):
+        """Latency summary of the pipeline, see LatencyTracker.summary
+
+        REQ only. Returns None when the server does not answer in timeout ms.
+        """
+        if self._sock != "REQ":
+            raise NotImplementedError("Only REQ clients can query the server")
+        self._socket.send(b"latency")
+        if timeout is not None and not self._socket.poll(timeout):
+            return None
+        reply = json.loads(self._socket.recv())
+        if isinstance(reply, dict) and "error" in reply:
+            raise SerializationError(reply["error"])
+        return reply
+
+    def _decode(self, frames):
+        data = decode(frames, allow_pickle=self._allow_pickle)
+        if data.trace is not None:
+            stamp(data.trace, "received")
+            self.latency.record(data.trace, ("received",))
+        return data
+
+    def close(self):
+        self._socket.close()
+        self._context.term()
+
+    def poll(self, timeout=None):
+        """Wait up to timeout ms for a message, SUB and PULL only"""
+        return bool(self._socket.poll(timeout))
+
+    def _receive(self):
+        frames = self._socket.recv_multipart(copy=False)
+        while self._conflate:
+            try:
+                frames = self._socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+        return frames
+
+    def next(self, timeout=None):
+        """Next IntegratedData
+
+        timeout: int
+            Milliseconds to wait for it, None to wait for ever. None is
+            returned when nothing arrived in time. An unanswered REQ request
+            is dropped and a new one sent by the next call.
+        """
+        if self._sock != "REQ":
+            if timeout is not None and not self._socket.poll(timeout):
+                return None
+            return self._decode(self._receive())
+
+        if self._fmt is None:
+            self._fmt = self._negotiate()
+        if self._fmt == PICKLE and not self._allow_pickle:
+            raise SerializationError("Server only supports pickle")
+
+        if self._representation:
+            representation = json.dumps(self._representation, separators=(",", ":"))
+            request = f"next {self._fmt} {representation}".encode()
+        elif self._fmt == PICKLE:
+            request = b"next"
+        else:
+            request = f"next {self._fmt}".encode()
+        _ = self._socket.send(request)
+        if timeout is not None and not self._socket.poll(timeout):
+            return None
+        frames = self._socket.recv_multipart(copy=False)
+        if len(frames) == 1 and bytes(frames[0].buffer[:9]) == b'{"error":':
+            raise SerializationError(json.loads(frames[0].bytes)["error"])
+        return self._decode(frames)
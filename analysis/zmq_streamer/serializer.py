@@ -0,0 +1,82 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import json
+import pickle
+
+import numpy as np
+
+from analysis.processor.data_processor import IntegratedData
+
+PROTOCOL_VERSION = 1
+
+# Formats in order of preference
+MULTIPART = "multipart/1"
+PICKLE = "pickle"
+FORMATS = (MULTIPART, PICKLE)
+
+
+class SerializationError(Exception):
+    pass
+
+
+def _frame_buffer(frame):
+    # zmq.Frame when received with copy=False, bytes otherwise
+    return getattr(frame, "buffer", frame)
+
+
+def encode(data, fmt=MULTIPART):
+    """Encode IntegratedData into a list of ZMQ frames
+
+    The multipart format is a JSON header with the meta data and the
+    dtype and shape of each array, followed by one frame holding the raw
+    buffer of each array in the order they are listed in the header.
+    """
+    if fmt == PICKLE:
+        return [pickle.dumps(data)]
+    if fmt != MULTIPART:
+        raise SerializationError(f"Unknown format {fmt}")
+
+    meta, arrays = data.to_payload()
+    header = {"version": PROTOCOL_VERSION, "meta": meta, "arrays": []}
+    frames = [None]
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        header["arrays"].append(
+            {"name": name, "dtype": arr.dtype.str, "shape": arr.shape}
+        )
+        frames.append(arr)
+    frames[0] = json.dumps(header).encode()
+    return frames
+
+
+def decode(frames, allow_pickle=True):
+    """Rebuild IntegratedData from frames created by encode
+
+    Arrays of the multipart format are read-only views on the received
+    frames, no copy is made.
+    """
+    first = _frame_buffer(frames[0])
+    if bytes(first[:1]) != b"{":
+        if not allow_pickle:
+            raise SerializationError("Refusing to unpickle message")
+        return pickle.loads(first)
+
+    header = json.loads(bytes(first))
+    if header["version"] != PROTOCOL_VERSION:
+        raise SerializationError(
+            f"Unsupported protocol version {header['version']}, "
+            f"expected {PROTOCOL_VERSION}"
+        )
+    if len(frames) != len(header["arrays"]) + 1:
+        raise SerializationError("Number of frames does not match the header")
+
+    arrays = {}
+    for spec, frame in zip(header["arrays"], frames[1:]):
+        arrays[spec["name"]] = np.frombuffer(
+            _frame_buffer(frame), dtype=spec["dtype"]
+        ).reshape(spec["shape"])
+    return IntegratedData.from_payload((header["meta"], arrays))
@@ -0,0 +1,78 @@
+"""
+Numerical parity and speed of the batch_csr integration engine against
+per-pulse pyFAI integration
+
+batch_csr does not split pixels, its parity reference is pyFAI "numpy"
+(no split, histogram). Other methods are timed for comparison only.
+
+Usage: python benchmarks/bench_batched_integration.py --shape 32 512 512
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analysis.processor.azimuthal_integration import ImageIntegrator
+
+REFERENCE = "numpy"
+
+
+def ai_config(shape, method, pts):
+    return dict(
+        energy=9.3,
+        pixel_size=0.5e-3,
+        centrex=shape[-1] / 2,
+        centrey=shape[-2] / 2,
+        distance=0.2,
+        intg_rng=(0.1, 2.0),
+        intg_method=method,
+        intg_pts=pts,
+        threshold_mask=(0, 100),
+        user_mask=None,
+    )
+
+
+def timed(integrator, config, image, repeat):
+    # first call builds geometry arrays and engines
+    result = integrator.integrate(config, image)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        integrator.integrate(config, image)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def run(shape, pts, methods, repeat):
+    image = np.random.uniform(-10, 110, shape)
+    image[:, ::31, ::29] = np.nan
+    integrator = ImageIntegrator()
+
+    results = {}
+    for method in methods:
+        results[method], elapsed = timed(
+            integrator, ai_config(shape, method, pts), image, repeat
+        )
+        print(f"{method:>10}: {1e3 * elapsed:9.2f} ms per frame")
+
+    ref_momentum, ref_intensities = results[REFERENCE]
+    momentum, intensities = results["batch_csr"]
+    scale = np.abs(ref_intensities).max()
+    print(
+        f"batch_csr vs {REFERENCE}: max |dq| {np.abs(momentum - ref_momentum).max():.2e}"
+        f", max |dI|/max|I| {np.abs(intensities - ref_intensities).max() / scale:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[32, 512, 512])
+    parser.add_argument("--pts", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        default=[REFERENCE, "cython", "BBox", "csr", "batch_csr"],
+    )
+    args = parser.parse_args()
+
+    methods = list(dict.fromkeys([REFERENCE, "batch_csr"] + args.methods))
+    run(tuple(args.shape), args.pts, methods, args.repeat)
@@ -0,0 +1,104 @@
+"""
+Edge detection: the former 3-D pre-filter followed by Canny per pulse,
+a 2-D pre-filter per pulse followed by Canny, and EdgeDetection which
+merges both smoothings into one per pulse
+
+Edges are compared pixel by pixel and within one pixel, since a merged
+smoothing shifts some edges by a pixel at most.
+
+Usage: python benchmarks/bench_edges.py --shape 16 256 256 --threads 4
+"""
+import argparse
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage as ndi
+from skimage import feature
+
+from analysis.processor.canny_edge import PREFILTER_SIGMA, EdgeDetection
+
+
+def make_stack(shape):
+    """Rings and rotated squares, different on every pulse"""
+    x = np.linspace(-1, 1, shape[-2])
+    y = np.linspace(-1, 1, shape[-1])
+    xx, yy = np.meshgrid(x, y, indexing="ij")
+    stack = 2.0 * np.random.rand(*shape)
+    for i in range(shape[0]):
+        if i % 2:
+            stack[i] += 10.0 * np.sin(
+                np.random.randint(1, 20) * np.pi * (xx ** 2 + yy ** 2)
+            )
+        else:
+            z = np.zeros(shape[1:])
+            w = np.random.randint(10, min(shape[1:]) // 2 - 1)
+            z[w:-w, w:-w] = 10.0
+            stack[i] += ndi.rotate(z, np.random.randint(10, 45), reshape=False)
+    return stack
+
+
+def stack_3d(image, sigma, executor):
+    # what find_edges used to do, smoothing across pulses as well
+    image = ndi.gaussian_filter(image, PREFILTER_SIGMA)
+    return np.stack(
+        list(executor.map(lambda img: feature.canny(img, sigma=sigma), image))
+    )
+
+
+def per_pulse_2d(image, sigma, executor):
+    def _edge(img):
+        return feature.canny(ndi.gaussian_filter(img, PREFILTER_SIGMA), sigma=sigma)
+
+    return np.stack(list(executor.map(_edge, image)))
+
+
+def compare(name, edges, reference):
+    differ = np.count_nonzero(edges != reference)
+    # edges of one without an edge of the other within a pixel
+    grown = ndi.binary_dilation(reference, np.ones((1, 3, 3), bool))
+    grown_edges = ndi.binary_dilation(edges, np.ones((1, 3, 3), bool))
+    missed = np.count_nonzero(edges & ~grown) + np.count_nonzero(
+        reference & ~grown_edges
+    )
+    n = max(1, np.count_nonzero(reference) + np.count_nonzero(edges))
+    print(
+        f"{name:>28}: {differ:7d} pixels differ, "
+        f"{100.0 * missed / n:6.2f} % of edge pixels further than one pixel"
+    )
+
+
+def run(shape, sigma, n_threads, repeat):
+    stack = make_stack(shape)
+    executor = ThreadPoolExecutor(max_workers=n_threads)
+    detector = EdgeDetection(sigma=sigma, executor=executor)
+
+    results = {}
+    for name, func in [
+        ("3-D filter + canny", lambda: stack_3d(stack, sigma, executor)),
+        ("2-D filter + canny", lambda: per_pulse_2d(stack, sigma, executor)),
+        ("EdgeDetection", lambda: detector.find_edges(stack)),
+    ]:
+        results[name] = func()
+        elapsed = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(
+            f"{name:>20}: {1e3 * elapsed:8.2f} ms per stack "
+            f"{1e3 * elapsed / shape[0]:8.2f} ms per pulse"
+        )
+
+    reference = results["2-D filter + canny"]
+    print(f"against 2-D filter + canny, {np.count_nonzero(reference)} edge pixels")
+    compare("EdgeDetection", results["EdgeDetection"], reference)
+    compare("3-D filter + canny", results["3-D filter + canny"], reference)
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[16, 256, 256])
+    parser.add_argument("--sigma", type=float, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run(tuple(args.shape), args.sigma, args.threads, args.repeat)
@@ -0,0 +1,71 @@
+"""
+Per-frame latency of integration plus edge detection with executors
+created per call against long lived StageExecutors
+
+Usage: python benchmarks/bench_executors.py --shape 8 512 512 --frames 30
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analysis.processor.azimuthal_integration import ImageIntegrator
+from analysis.processor.canny_edge import EdgeDetection
+from analysis.processor.executors import StageExecutors
+
+
+def ai_config(shape):
+    return dict(
+        energy=9.3,
+        pixel_size=0.5e-3,
+        centrex=shape[-1] / 2,
+        centrey=shape[-2] / 2,
+        distance=0.2,
+        intg_rng=(0.0, 2.0),
+        intg_method="BBox",
+        intg_pts=512,
+        threshold_mask=(0, 12),
+        user_mask=None,
+    )
+
+
+def run(name, integrator, edge_detector, image, frames):
+    config = ai_config(image.shape)
+    # first frame builds the integration engine
+    integrator.integrate(config, image)
+
+    latencies = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        integrator.integrate(config, image)
+        edge_detector.find_edges(image)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = 1e3 * np.array(latencies)
+    print(
+        f"{name:>18}: p50 {np.percentile(latencies, 50):8.2f} ms "
+        f"p99 {np.percentile(latencies, 99):8.2f} ms "
+        f"spread {latencies.max() - latencies.min():8.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[8, 512, 512])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    image = 10 * np.random.rand(*args.shape)
+    run("per call", ImageIntegrator(), EdgeDetection(), image, args.frames)
+
+    for kind in StageExecutors.kinds:
+        executors = StageExecutors(args.threads, edge_executor=kind).start()
+        run(
+            f"persistent {kind}",
+            ImageIntegrator(executors.threads),
+            EdgeDetection(executor=executors.edges),
+            image,
+            args.frames,
+        )
+        executors.shutdown()
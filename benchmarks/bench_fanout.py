@@ -0,0 +1,114 @@
+"""
+Throughput of N clients receiving from one DataStreamer in parallel
+
+PUB sends every frame to every SUB client, PUSH spreads frames over the
+PULL clients.
+
+Usage: python benchmarks/bench_fanout.py --sock PUB --clients 4 --duration 5
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+import numpy as np
+
+from analysis.processor.data_processor import IntegratedData
+from analysis.zmq_streamer import DataClient, DataStreamer
+
+_CLIENT_SOCK = {"PUB": "SUB", "PUSH": "PULL"}
+
+
+def _client(endpoint, sock, ready, done, results):
+    client = DataClient(endpoint, sock=sock)
+    ready.set()
+
+    count = 0
+    nbytes = 0
+    start = None
+    while not done.is_set():
+        # poll so that clients stop once the server does
+        if not client.poll(100):
+            continue
+        data = client.next()
+        start = start or time.perf_counter()
+        count += 1
+        nbytes += data.mean_image.nbytes + data.edges.nbytes
+    elapsed = time.perf_counter() - start if start else 0
+    results.put((count, nbytes, elapsed))
+
+
+def _feed(buffer, data, stop):
+    while not stop.is_set():
+        try:
+            buffer.put(data, timeout=0.1)
+        except queue.Full:
+            continue
+
+
+def run(sock, n_clients, duration, shape, hwm, port):
+    endpoint = f"tcp://127.0.0.1:{port}"
+    pulses, px, py = shape
+    data = IntegratedData("00:00:00")
+    data.mean_image = np.random.rand(px, py)
+    data.momentum = np.linspace(0, 5, 512)
+    data.intensities = np.random.rand(pulses, 512)
+    data.edges = np.random.rand(*shape) > 0.9
+
+    buffer = queue.Queue(maxsize=1)
+    streamer = DataStreamer(endpoint, buffer, sock=sock, hwm=hwm)
+    streamer.start()
+
+    done = mp.Event()
+    results = mp.Queue()
+    readies = [mp.Event() for _ in range(n_clients)]
+    clients = [
+        mp.Process(
+            target=_client, args=(endpoint, _CLIENT_SOCK[sock], ready, done, results)
+        )
+        for ready in readies
+    ]
+    for client in clients:
+        client.start()
+    for ready in readies:
+        ready.wait()
+    # let subscriptions propagate before publishing
+    time.sleep(0.5)
+
+    stop = threading.Event()
+    feeder = threading.Thread(target=_feed, args=(buffer, data, stop))
+    feeder.start()
+    time.sleep(duration)
+    stop.set()
+    feeder.join()
+    done.set()
+
+    counts = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+    streamer.stop()
+    streamer.join()
+
+    total = 0
+    for i, (count, nbytes, elapsed) in enumerate(counts):
+        rate = count / elapsed if elapsed else 0
+        total += rate
+        print(
+            f"client {i}: {rate:8.1f} frames/s "
+            f"{nbytes / elapsed / 1024 ** 2 if elapsed else 0:8.1f} MiB/s"
+        )
+    print(f"{sock} with {n_clients} clients: {total:8.1f} frames/s in total")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sock", choices=list(_CLIENT_SOCK), default="PUB")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--shape", type=int, nargs=3, default=[2, 256, 256])
+    parser.add_argument("--hwm", type=int, default=10)
+    parser.add_argument("--port", type=int, default=54155)
+    args = parser.parse_args()
+
+    run(args.sock, args.clients, args.duration, tuple(args.shape), args.hwm, args.port)
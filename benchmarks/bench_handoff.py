@@ -0,0 +1,78 @@
+"""
+Idle CPU and hand-off latency of the old spin loops against HandOff
+
+The consumer runs in its own process. During the idle phase nothing is
+sent; during the latency phase small payloads are sent at --rate Hz and
+the consumer records the time from put to get.
+
+Usage: python benchmarks/bench_handoff.py --idle 3 --rate 10 --frames 50
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from analysis.ipc import HandOff
+
+
+def _spin_consumer(data_queue, results, n_frames):
+    start = time.process_time()
+    latencies = []
+    while len(latencies) < n_frames:
+        try:
+            meta, _ = data_queue.get_nowait()
+        except queue.Empty:
+            continue
+        if meta.get("shutdown"):
+            break
+        latencies.append(time.perf_counter() - meta["sent"])
+    results.put((time.process_time() - start, latencies))
+
+
+def _handoff_consumer(data_queue, results, n_frames):
+    start = time.process_time()
+    latencies = []
+    data_in = HandOff(data_queue)
+    while len(latencies) < n_frames:
+        payload = data_in.get()
+        if payload is None:
+            break
+        latencies.append(time.perf_counter() - payload[0]["sent"])
+    results.put((time.process_time() - start, latencies))
+
+
+def run(name, consumer, idle, rate, n_frames):
+    data_queue = mp.Queue(maxsize=1)
+    results = mp.Queue()
+    proc = mp.Process(target=consumer, args=(data_queue, results, n_frames))
+    proc.start()
+
+    time.sleep(idle)
+    data_out = HandOff(data_queue)
+    for _ in range(n_frames):
+        data_out.put(({"sent": time.perf_counter()}, {}))
+        time.sleep(1.0 / rate)
+
+    cpu, latencies = results.get()
+    proc.join()
+
+    wall = idle + n_frames / rate
+    latencies = np.array(latencies) * 1e6
+    print(
+        f"{name:>8}: cpu {100 * cpu / wall:6.1f} % of a core, latency "
+        f"p50 {np.percentile(latencies, 50):8.1f} us "
+        f"p99 {np.percentile(latencies, 99):8.1f} us"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--idle", type=float, default=3.0, help="idle seconds")
+    parser.add_argument("--rate", type=float, default=10.0, help="frames per second")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    run("spin", _spin_consumer, args.idle, args.rate, args.frames)
+    run("handoff", _handoff_consumer, args.idle, args.rate, args.frames)
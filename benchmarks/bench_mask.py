@@ -0,0 +1,54 @@
+"""
+Mask construction on its own: per pulse as integration used to do it
+against StackMask for the whole stack
+
+Usage: python benchmarks/bench_mask.py --shape 350 256 256
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from analysis.processor.masking import StackMask
+
+
+def per_pulse(data, threshold_mask, user_mask):
+    masks = []
+    for i in range(data.shape[0]):
+        mask = np.zeros_like(data[i], dtype=np.uint8)
+        mask[np.isnan(data[i])] = 1
+        low, high = threshold_mask
+        mask[(data[i] < low) | (data[i] > high)] = 1
+        np.logical_or(mask, user_mask[i], out=mask)
+        masks.append(mask)
+    return masks
+
+
+def run(shape, repeat):
+    data = np.random.uniform(-10, 110, shape)
+    data[:, ::17, ::13] = np.nan
+    threshold_mask = (0, 100)
+    user_mask = (np.random.rand(*shape) > 0.99).astype(np.uint8)
+
+    stack_mask = StackMask()
+    expected = np.stack(per_pulse(data, threshold_mask, user_mask))
+    assert np.array_equal(expected, stack_mask.build(data, threshold_mask, user_mask))
+
+    for name, func in [
+        ("per pulse", lambda: per_pulse(data, threshold_mask, user_mask)),
+        ("StackMask", lambda: stack_mask.build(data, threshold_mask, user_mask)),
+    ]:
+        elapsed = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(
+            f"{name:>10}: {1e3 * elapsed:8.2f} ms per stack "
+            f"{1e6 * elapsed / shape[0]:8.2f} us per pulse"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[350, 256, 256])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    run(tuple(args.shape), args.repeat)
@@ -0,0 +1,89 @@
+"""
+Sustained write throughput of the HDF5 Recorder per compression filter:
+frames are put as fast as possible for a while, dropped frames show where
+the disk falls behind the producer
+
+Usage: python benchmarks/bench_recorder.py --shape 16 1024 1024 --pts 512 --seconds 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from analysis.processor.data_processor import IntegratedData
+from analysis.recorder import Recorder
+
+
+def make_frames(shape, pts, n=8):
+    """A few distinct frames in the representation processors send"""
+    pulses, px, py = shape
+    frames = []
+    for i in range(n):
+        data = IntegratedData(f"00:00:{i:02d}")
+        # smooth, detector like images rather than noise, which would not
+        # compress at all
+        y, x = np.mgrid[:px, :py]
+        r = np.hypot(x - py / 2, y - px / 2)
+        data.mean_image = (np.cos(r / (8 + i)) ** 2 * 10).astype(np.float32)
+        data.momentum = np.linspace(0, 5, pts)
+        data.intensities = np.random.rand(pulses, pts)
+        data.edges = np.random.rand(*shape) > 0.99
+        frames.append(data.compact(edges=("packed", "count")))
+    return frames
+
+
+def frame_nbytes(data):
+    return sum(arr.nbytes for arr in data.to_payload()[1].values())
+
+
+def run(shape, pts, seconds, compressions, buffer_size):
+    frames = make_frames(shape, pts)
+    nbytes = frame_nbytes(frames[0])
+    print(f"{nbytes / 1024 ** 2:.2f} MiB per frame")
+
+    for compression in compressions:
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = Recorder(
+                directory,
+                frames_per_file=None,
+                buffer_size=buffer_size,
+                compression=None if compression == "none" else compression,
+            )
+            recorder.start()
+
+            n_put = 0
+            t0 = time.perf_counter()
+            while time.perf_counter() - t0 < seconds:
+                recorder.put(frames[n_put % len(frames)])
+                n_put += 1
+            t_put = time.perf_counter() - t0
+            recorder.stop()
+            recorder.join()
+            t_total = time.perf_counter() - t0
+
+            on_disk = sum(
+                os.path.getsize(os.path.join(directory, f))
+                for f in os.listdir(directory)
+            )
+            written = recorder.n_written
+            print(
+                f"{compression:>5}: {written / t_total:8.1f} frames/s "
+                f"{written * nbytes / t_total / 1024 ** 2:8.1f} MiB/s "
+                f"ratio {written * nbytes / max(on_disk, 1):5.2f} "
+                f"dropped {recorder.n_dropped}/{n_put} "
+                f"put {1e6 * t_put / n_put:6.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[16, 1024, 1024])
+    parser.add_argument("--pts", type=int, default=512)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--compression", nargs="+", default=["none", "lzf", "gzip"])
+    parser.add_argument("--buffer_size", type=int, default=64)
+    args = parser.parse_args()
+
+    run(args.shape, args.pts, args.seconds, args.compression, args.buffer_size)
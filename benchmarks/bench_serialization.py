@@ -0,0 +1,76 @@
+"""
+Bytes on the wire and encode/decode time of the ZMQ wire formats, and
+bytes per frame of the IntegratedData representations
+
+Usage: python benchmarks/bench_serialization.py --shape 16 1024 1024 --pts 512
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from analysis.processor.data_processor import IntegratedData
+from analysis.zmq_streamer.serializer import FORMATS, MULTIPART, decode, encode
+
+
+def make_data(shape, pts):
+    pulses, px, py = shape
+    data = IntegratedData("00:00:00")
+    data.mean_image = np.random.rand(px, py)
+    data.momentum = np.linspace(0, 5, pts)
+    data.intensities = np.random.rand(pulses, pts)
+    data.edges = np.random.rand(*shape) > 0.9
+    return data
+
+
+def frame_nbytes(frames):
+    return sum(memoryview(frame).nbytes for frame in frames)
+
+
+REPRESENTATIONS = [
+    ("full, float64", dict(edges="full")),
+    ("packed, float32", dict(edges="packed", image_dtype="float32")),
+    ("count, float32", dict(edges="count", image_dtype="float32")),
+    ("count, float16", dict(edges="count", image_dtype="float16")),
+]
+
+
+def run(shape, pts, repeat):
+    data = make_data(shape, pts)
+    for fmt in FORMATS:
+        frames = encode(data, fmt)
+        # what the client gets from the socket, independent of the sender
+        received = [bytes(memoryview(frame).cast("B")) for frame in frames]
+
+        t_encode = min(
+            timeit.repeat(lambda: encode(data, fmt), number=1, repeat=repeat)
+        )
+        t_decode = min(timeit.repeat(lambda: decode(received), number=1, repeat=repeat))
+        print(
+            f"{fmt:>12}: {frame_nbytes(frames) / 1024 ** 2:8.2f} MiB "
+            f"encode {1e3 * t_encode:8.3f} ms decode {1e3 * t_decode:8.3f} ms"
+        )
+
+    full = frame_nbytes(encode(data, MULTIPART))
+    for name, representation in REPRESENTATIONS:
+        compact = data.compact(**representation)
+        nbytes = frame_nbytes(encode(compact, MULTIPART))
+        t_compact = min(
+            timeit.repeat(
+                lambda: data.compact(**representation), number=1, repeat=repeat
+            )
+        )
+        print(
+            f"{name:>16}: {nbytes / 1024 ** 2:8.2f} MiB {full / nbytes:6.1f}x smaller "
+            f"compact {1e3 * t_compact:8.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[16, 1024, 1024])
+    parser.add_argument("--pts", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    run(tuple(args.shape), args.pts, args.repeat)
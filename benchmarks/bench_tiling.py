@@ -0,0 +1,46 @@
+"""
+Heatmap figure payload of the Dash app: the full image against views of an
+ImagePyramid, for the whole image and a zoomed region
+
+Usage: python benchmarks/bench_tiling.py --sides 256 1024 4096 --max_side 256
+"""
+import argparse
+import timeit
+
+import numpy as np
+import plotly.graph_objs as go
+import plotly.io as pio
+
+from analysis.webgui.tiling import ImagePyramid
+
+
+def figure_nbytes(z, x=None, y=None):
+    return len(pio.to_json(go.Figure(go.Heatmap(z=z, x=x, y=y))))
+
+
+def run(sides, max_side, repeat):
+    for side in sides:
+        image = np.random.rand(side, side).astype(np.float32)
+        t_build = min(
+            timeit.repeat(
+                lambda: ImagePyramid(image, max_side=max_side), number=1, repeat=repeat
+            )
+        )
+        pyramid = ImagePyramid(image, max_side=max_side)
+        roi = (side / 3, side / 3 + side / 10)
+        print(
+            f"{side:>5} px: full {figure_nbytes(image) / 1024 ** 2:8.2f} MiB "
+            f"whole {figure_nbytes(*pyramid.view()) / 1024 ** 2:6.2f} MiB "
+            f"zoomed {figure_nbytes(*pyramid.view(roi, roi)) / 1024 ** 2:6.2f} MiB "
+            f"{len(pyramid.levels)} levels built in {1e3 * t_build:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sides", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--max_side", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    run(args.sides, args.max_side, args.repeat)
@@ -0,0 +1,48 @@
+"""
+Throughput of SharedMemoryQueue in "shm" and "pickle" mode
+
+Usage: python benchmarks/bench_transport.py --shape 16 1024 1024 --frames 50
+"""
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from analysis.ipc import SharedMemoryQueue
+
+
+def _produce(data_queue, shape, frames):
+    image = np.random.rand(*shape)
+    for i in range(frames):
+        data_queue.put(({"index": i}, {"image": image}))
+
+
+def run(mode, shape, frames):
+    nbytes = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+    data_queue = SharedMemoryQueue(maxsize=1, slot_nbytes=nbytes, mode=mode)
+    producer = mp.Process(target=_produce, args=(data_queue, shape, frames))
+
+    producer.start()
+    start = time.perf_counter()
+    for _ in range(frames):
+        _, arrays = data_queue.get()
+        arrays["image"].sum()
+    elapsed = time.perf_counter() - start
+    producer.join()
+    data_queue.close()
+
+    print(
+        f"{mode:>6}: {frames / elapsed:8.1f} frames/s "
+        f"{frames * nbytes / elapsed / 1024 ** 3:6.2f} GiB/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[16, 1024, 1024])
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    for mode in SharedMemoryQueue.modes:
+        run(mode, tuple(args.shape), args.frames)
@@ -0,0 +1,363 @@
+"""
+Capacity of the whole pipeline: the Application topology of simulator,
+processors and streamer runs locally with N DataClients and is driven at
+stepped input rates. Each step reports the throughput of every stage, the
+end to end latency from emit to receipt by the clients (p50/p99/p99.9),
+frames dropped and CPU and RSS of every process. The first rate at which
+the pipeline falls behind is the saturation point.
+
+Redis is a local stand-in: redis-server if it is on the PATH, fakeredis
+otherwise (pip install fakeredis), no container is started.
+
+Usage:
+    python benchmarks/soak.py --rates 5 10 20 40 0 --step_time 30 --clients 2 --save soak.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import psutil
+import redis
+
+from analysis.application import Application, policy_spec
+from analysis.config import config
+from analysis.ipc import SharedMemoryQueue
+from analysis.zmq_streamer.data_streamer import DataClient
+
+# socket of the clients for each socket of the streamer
+CLIENT_SOCKETS = {"REP": "REQ", "PUB": "SUB", "PUSH": "PULL"}
+PERCENTILES = (50, 99, 99.9)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_fakeredis(port):
+    from fakeredis import TcpFakeServer
+
+    TcpFakeServer(("127.0.0.1", port), server_type="redis").serve_forever()
+
+
+def start_redis(port, timeout=10.0):
+    """Redis stand-in listening on port, as a process with a pid"""
+    if shutil.which("redis-server"):
+        server = subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+        )
+    else:
+        server = mp.Process(target=_serve_fakeredis, args=(port,), daemon=True)
+        server.start()
+
+    client = redis.Redis(port=port)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client.ping()
+            return server
+        except redis.ConnectionError:
+            if time.monotonic() > deadline:
+                server.terminate()
+                raise RuntimeError(f"Redis stand-in not up on port {port}")
+            time.sleep(0.1)
+
+
+def _receive(endpoint, sock, samples, stop, batch_interval=0.2):
+    """Client process: (received ns, emit to receipt ns) of every frame"""
+    client = DataClient(endpoint, sock=sock)
+    # a REQ client drops the reply to a request it gave up on, so the
+    # timeout must be long compared to the frame period
+    batch = []
+    sent = time.monotonic()
+    while not stop.is_set():
+        data = client.next(timeout=1000)
+        if data is not None and data.trace and "emit" in data.trace:
+            received = data.trace["received"]
+            batch.append((received, received - data.trace["emit"]))
+        if batch and time.monotonic() - sent > batch_interval:
+            samples.put(batch)
+            batch = []
+            sent = time.monotonic()
+    client.close()
+
+
+class ProcessMonitor:
+    """CPU and RSS of the named processes of the pipeline"""
+
+    def __init__(self, pids):
+        self._processes = {name: psutil.Process(pid) for name, pid in pids.items()}
+        self.rss = {name: [] for name in pids}
+        self._cpu = None
+
+    def _cpu_seconds(self):
+        seconds = {}
+        for name, process in self._processes.items():
+            try:
+                times = process.cpu_times()
+                seconds[name] = times.user + times.system
+            except psutil.NoSuchProcess:
+                seconds[name] = float("nan")
+        return time.monotonic(), seconds
+
+    def start(self):
+        self._cpu = self._cpu_seconds()
+
+    def cpu_percent(self):
+        """Per process CPU since start, 100 is one core busy"""
+        t0, before = self._cpu
+        t1, after = self._cpu_seconds()
+        return {name: 100 * (after[name] - before[name]) / (t1 - t0) for name in after}
+
+    def sample(self):
+        now = time.monotonic()
+        for name, process in self._processes.items():
+            try:
+                self.rss[name].append((now, process.memory_info().rss / 1024 ** 2))
+            except psutil.NoSuchProcess:
+                pass
+
+    def rss_summary(self):
+        """RSS at the start and end in MiB, and the fitted growth per minute"""
+        summary = {}
+        for name, samples in self.rss.items():
+            if len(samples) < 2:
+                continue
+            t, rss = np.array(samples).T
+            slope = np.polyfit(t - t[0], rss, 1)[0]
+            summary[name] = dict(
+                start=rss[0],
+                end=rss[-1],
+                peak=rss.max(),
+                growth=rss[-1] - rss[0],
+                slope_per_min=60 * slope,
+            )
+        return summary
+
+
+def counters(app):
+    """Frames handed on and dropped so far by each loop"""
+    frames = app.metrics["pipeline_frames_total"]
+    dropped = app.metrics["pipeline_dropped_total"]
+    return {
+        f"{loop}{worker}": (
+            frames.labels(loop, worker).value,
+            dropped.labels(loop, worker).value,
+        )
+        for loop, worker in app.metrics.loops
+    }
+
+
+def drain(samples, latencies):
+    while True:
+        try:
+            latencies.extend(samples.get_nowait())
+        except queue.Empty:
+            return
+
+
+def wait(seconds, samples, latencies, monitor, interval=1.0):
+    """Collect latency samples and RSS for seconds"""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(min(interval, max(end - time.monotonic(), 0)))
+        drain(samples, latencies)
+        monitor.sample()
+
+
+def measure_step(app, rate, args, samples, monitor):
+    """Throughput, latency, drops and CPU at one input rate"""
+    app.data_simulator.set_rate(rate)
+    latencies = []
+    wait(args.warmup, samples, latencies, monitor)
+
+    app.latency.reset()
+    latencies.clear()
+    before = counters(app)
+    monitor.start()
+    t0 = time.time_ns()
+    wait(args.step_time, samples, latencies, monitor)
+    t1 = time.time_ns()
+    after = counters(app)
+    cpu = monitor.cpu_percent()
+    # receipts of the step, clients batch them
+    wait(0.5, samples, latencies, monitor)
+    e2e = np.array([ns for received, ns in latencies if t0 <= received < t1]) / 1e6
+
+    elapsed = (t1 - t0) / 1e9
+    rates = {k: (after[k][0] - before[k][0]) / elapsed for k in after}
+    dropped = {k: int(after[k][1] - before[k][1]) for k in after}
+    processed = rates["application"]
+    latency = None
+    if len(e2e):
+        latency = {
+            str(p): float(v)
+            for p, v in zip(PERCENTILES, np.percentile(e2e, PERCENTILES))
+        }
+
+    saturated = rate == 0 or processed < (1 - args.tolerance) * rate
+    if args.p99_budget_ms is not None and latency is not None:
+        saturated = saturated or latency["99"] > args.p99_budget_ms
+    return dict(
+        rate=rate,
+        seconds=elapsed,
+        loop_rates=rates,
+        processed_rate=processed,
+        delivered_rate=len(e2e) / elapsed,
+        dropped=dropped,
+        latency_ms=latency,
+        stages_ms=app.latency_stats(),
+        cpu_percent=cpu,
+        saturated=saturated,
+    )
+
+
+def environment():
+    return dict(
+        python=sys.version.split()[0],
+        numpy=np.__version__,
+        machine=platform.machine(),
+        node=platform.node(),
+        cpus=os.cpu_count(),
+    )
+
+
+def run(args):
+    redis_port = free_port()
+    redis_server = start_redis(redis_port)
+    zmq_port = free_port()
+    endpoint = f"tcp://127.0.0.1:{zmq_port}"
+
+    # clients are forked before the application has threads and sockets
+    samples = mp.Queue()
+    stop_clients = mp.Event()
+    clients = [
+        mp.Process(
+            target=_receive,
+            args=(endpoint, CLIENT_SOCKETS[args.sock], samples, stop_clients),
+            daemon=True,
+        )
+        for _ in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+
+    app = Application(
+        "localhost",
+        zmq_port,
+        transport=args.transport,
+        data_shape=tuple(args.shape),
+        policy=args.policy,
+        sock=args.sock,
+        n_workers=args.workers,
+        simulator_options=dict(rate=args.rates[0], report_interval=0),
+        metrics_port=None,
+        redis_address=("127.0.0.1", redis_port),
+    )
+    app_thread = threading.Thread(target=app.start_app, daemon=True)
+    app_thread.start()
+    # processes are started by start_app
+    processes = [app.data_simulator] + app.processor_pool.workers
+    while any(p.pid is None for p in processes):
+        time.sleep(0.01)
+
+    pids = {"application": os.getpid(), "source": app.data_simulator.pid}
+    pids.update(
+        {f"processor{i}": w.pid for i, w in enumerate(app.processor_pool.workers)}
+    )
+    pids.update({f"client{i}": c.pid for i, c in enumerate(clients)})
+    pids["redis"] = redis_server.pid
+    monitor = ProcessMonitor(pids)
+
+    steps = []
+    try:
+        for rate in args.rates:
+            step = measure_step(app, rate, args, samples, monitor)
+            steps.append(step)
+            latency = step["latency_ms"] or {}
+            print(
+                f"rate {rate:6.1f}: processed {step['processed_rate']:7.1f} "
+                f"delivered {step['delivered_rate']:7.1f} frames/s, "
+                f"p50 {latency.get('50', float('nan')):8.1f} "
+                f"p99 {latency.get('99', float('nan')):8.1f} "
+                f"p99.9 {latency.get('99.9', float('nan')):8.1f} ms, "
+                f"dropped {sum(step['dropped'].values())}"
+                + (" saturated" if step["saturated"] else ""),
+                flush=True,
+            )
+    finally:
+        stop_clients.set()
+        for client in clients:
+            client.join(timeout=2)
+        app.stop_app()
+        app_thread.join(timeout=5)
+        redis_server.terminate()
+
+    saturation = [s["rate"] for s in steps if s["saturated"] and s["rate"] > 0]
+    report = dict(
+        environment=environment(),
+        options=vars(args),
+        steps=steps,
+        summary=dict(
+            sustained_rate=max(s["processed_rate"] for s in steps),
+            saturation_rate=min(saturation) if saturation else None,
+            rss_mib=monitor.rss_summary(),
+        ),
+    )
+    print(json.dumps(report["summary"], indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rates",
+        type=float,
+        nargs="+",
+        default=[2, 5, 10, 20, 0],
+        help="Input frames per second of each step, 0 for as fast as possible",
+    )
+    parser.add_argument("--step_time", type=float, default=30.0)
+    parser.add_argument(
+        "--warmup", type=float, default=5.0, help="Seconds before each step is measured"
+    )
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--sock", type=str, choices=CLIENT_SOCKETS, default="REP")
+    parser.add_argument("--shape", type=int, nargs=3, default=[2, 256, 256])
+    parser.add_argument("--workers", type=int, default=config["n_workers"])
+    parser.add_argument(
+        "--transport", type=str, choices=SharedMemoryQueue.modes, default="shm"
+    )
+    parser.add_argument("--policy", type=policy_spec, default=config["handoff_policy"])
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="A step is saturated when less than 1 - tolerance of its rate is processed",
+    )
+    parser.add_argument(
+        "--p99_budget_ms",
+        type=float,
+        metavar="MS",
+        help="Milliseconds, a step is saturated as well when p99 end to end "
+        "latency exceeds it",
+    )
+    parser.add_argument("--save", type=str, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    run(args)
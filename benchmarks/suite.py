@@ -0,0 +1,268 @@
+"""
+Microbenchmarks of the hot paths: integration, edge detection, a whole
+DataProcessor.process, serialization and the shared memory transport,
+over image side, pulse count, dtype and integration method
+
+Runs offline: frames come from the DataSimulator pattern bank and the
+processor uses the default parameters instead of reading Redis. Stages
+run on long lived StageExecutors, as in DataProcessor.run. Reports
+ops/s and the peak memory allocated per call, saves them as a JSON
+baseline and compares two baselines, e.g. before and after upgrading
+pyFAI or scikit-image.
+
+Usage:
+    python benchmarks/suite.py run --sides 256 512 1024 --pulses 4 16 --save base.json
+    python benchmarks/suite.py compare base.json new.json --threshold 0.1
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+from analysis.ipc import SharedMemoryQueue
+from analysis.processor.azimuthal_integration import ImageIntegrator
+from analysis.processor.canny_edge import EdgeDetection
+from analysis.processor.data_processor import (
+    AZIMUTHAL_DEFAULTS,
+    EDGE_DEFAULTS,
+    DataProcessor,
+    IntegratedData,
+    parse_azimuthal_config,
+    parse_edge_config,
+)
+from analysis.processor.data_simulator import make_pattern, to_dtype
+from analysis.processor.executors import StageExecutors
+from analysis.redisdb import ConfigSubscriber
+from analysis.zmq_streamer.serializer import FORMATS, decode, encode
+
+
+def make_frame(pulses, side, dtype, seed=0):
+    """(pulses, side, side) frame of simulator patterns and noise"""
+    rng = np.random.default_rng(seed)
+    patterns = np.stack(
+        [make_pattern((side, side), rng) for _ in range(min(pulses, 4))]
+    )
+    frame = patterns[np.arange(pulses) % len(patterns)]
+    frame += 2.0 * rng.random(frame.shape)
+    return to_dtype(frame, dtype)
+
+
+def azimuthal_cfg(side, method):
+    return dict(
+        AZIMUTHAL_DEFAULTS,
+        centrex=str(side / 2),
+        centrey=str(side / 2),
+        intg_method=method,
+    )
+
+
+def closing(func, executors):
+    """func, with its executors shut down by close"""
+    func.close = executors.shutdown
+    return func
+
+
+def case_integrate(pulses, side, dtype, method):
+    # long lived executors, as DataProcessor.run assigns them
+    executors = StageExecutors().start()
+    integrator = ImageIntegrator()
+    integrator.executor = executors.threads
+    ai_config = parse_azimuthal_config(azimuthal_cfg(side, method))
+    image = make_frame(pulses, side, dtype)
+    return closing(lambda: integrator.integrate(ai_config, image), executors)
+
+
+def case_edges(pulses, side, dtype):
+    executors = StageExecutors().start()
+    detector = EdgeDetection(**parse_edge_config(EDGE_DEFAULTS))
+    detector.executor = executors.edges
+    image = make_frame(pulses, side, dtype)
+    return closing(lambda: detector.find_edges(image), executors)
+
+
+def case_process(pulses, side, dtype, method):
+    executors = StageExecutors().start()
+    processor = DataProcessor(None, None, executors=executors)
+    processor.integrator.executor = executors.threads
+    processor.edge_detector.executor = executors.edges
+    # subscribers which are never started keep the parameters they were
+    # given, what run() would read from Redis
+    processor._azimuthal = ConfigSubscriber(
+        None, "azimuthal", parse_azimuthal_config, azimuthal_cfg(side, method)
+    )
+    processor._edge = ConfigSubscriber(None, "edge", parse_edge_config, EDGE_DEFAULTS)
+    raw = ({"timestamp": "00:00:00"}, {"image": make_frame(pulses, side, dtype)})
+    return closing(lambda: processor.process(raw), executors)
+
+
+def case_serialize(pulses, side, dtype, fmt):
+    data = IntegratedData("00:00:00")
+    image = make_frame(pulses, side, dtype)
+    data.mean_image = image.mean(axis=0)
+    data.momentum = np.linspace(0, 5, 512)
+    data.intensities = np.random.rand(pulses, 512)
+    data.edges = image > np.percentile(image, 99)
+    data = data.compact()
+
+    def roundtrip():
+        frames = encode(data, fmt)
+        return decode([bytes(memoryview(frame).cast("B")) for frame in frames])
+
+    return roundtrip
+
+
+def case_transport(pulses, side, dtype):
+    frame = make_frame(pulses, side, dtype)
+    data_queue = SharedMemoryQueue(maxsize=1, slot_nbytes=frame.nbytes)
+    payload = ({"timestamp": "00:00:00"}, {"image": frame})
+
+    def roundtrip():
+        data_queue.put(payload)
+        return data_queue.get()
+
+    roundtrip.close = data_queue.close
+    return roundtrip
+
+
+def measure(func, min_time, min_calls=3):
+    """Median ops/s over calls for at least min_time, and peak MiB of a call"""
+    func()
+    durations = []
+    t0 = time.perf_counter()
+    while len(durations) < min_calls or time.perf_counter() - t0 < min_time:
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(
+        ops_per_s=1.0 / float(np.median(durations)),
+        calls=len(durations),
+        peak_mib=peak / 1024 ** 2,
+    )
+
+
+def cases(sides, pulses, dtypes, methods):
+    """(name, factory) of every case of the grid"""
+    for side, n, dtype in itertools.product(sides, pulses, dtypes):
+        grid = f"side={side},pulses={n},dtype={dtype}"
+        for method in methods:
+            yield f"integrate[{grid},method={method}]", partial(
+                case_integrate, n, side, dtype, method
+            )
+            yield f"process[{grid},method={method}]", partial(
+                case_process, n, side, dtype, method
+            )
+        yield f"edges[{grid}]", partial(case_edges, n, side, dtype)
+        for fmt in FORMATS:
+            yield f"serialize[{grid},fmt={fmt}]", partial(
+                case_serialize, n, side, dtype, fmt
+            )
+        yield f"transport[{grid}]", partial(case_transport, n, side, dtype)
+
+
+def environment():
+    import pyFAI
+    import skimage
+
+    return dict(
+        python=sys.version.split()[0],
+        numpy=np.__version__,
+        pyFAI=pyFAI.version,
+        skimage=skimage.__version__,
+        machine=platform.machine(),
+        node=platform.node(),
+    )
+
+
+def run(args):
+    results = {}
+    for name, factory in cases(args.sides, args.pulses, args.dtypes, args.methods):
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        func = factory()
+        try:
+            results[name] = measure(func, args.min_time)
+        finally:
+            if hasattr(func, "close"):
+                func.close()
+        result = results[name]
+        print(
+            f"{name:<70} {result['ops_per_s']:10.2f} ops/s "
+            f"{result['peak_mib']:9.2f} MiB",
+            flush=True,
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict(environment=environment(), results=results), f, indent=2)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for key in sorted(set(baseline["environment"]) | set(current["environment"])):
+        old = baseline["environment"].get(key)
+        new = current["environment"].get(key)
+        if old != new:
+            print(f"{key}: {old} -> {new}")
+
+    regressions = 0
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        old, new = baseline["results"][name], current["results"][name]
+        speed = new["ops_per_s"] / old["ops_per_s"] - 1
+        memory = new["peak_mib"] / max(old["peak_mib"], 1e-6) - 1
+        slower = speed < -args.threshold
+        regressions += slower
+        print(
+            f"{'SLOWER' if slower else '':>6} {name:<70} "
+            f"{100 * speed:+7.1f}% ops/s {100 * memory:+7.1f}% memory"
+        )
+    for name in sorted(set(baseline["results"]) ^ set(current["results"])):
+        print(f"{'':>6} {name:<70} only in one of the files")
+
+    print(f"{regressions} cases more than {100 * args.threshold:.0f}% slower")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite")
+    run_parser.add_argument("--sides", type=int, nargs="+", default=[256, 512, 1024])
+    run_parser.add_argument("--pulses", type=int, nargs="+", default=[4, 16])
+    run_parser.add_argument("--dtypes", nargs="+", default=["float32", "float64"])
+    run_parser.add_argument("--methods", nargs="+", default=["csr", "batch_csr"])
+    run_parser.add_argument(
+        "--filter", nargs="+", help="Only run cases whose name contains one of these"
+    )
+    run_parser.add_argument(
+        "--min_time", type=float, default=1.0, help="Seconds spent on each case"
+    )
+    run_parser.add_argument("--save", type=str, help="Write the results as JSON")
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Slowdown reported, 0.1 is 10%%"
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
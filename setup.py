@@ -27,7 +27,7 @@ setup(
         ],
     },
     install_requires=[
-        "dash>=1.6.1",
+        "dash>=2.16",
         "dash-daq>=0.3.1",
         "pyFAI>0.16.0",
         "redis",
@@ -41,7 +41,13 @@ setup(
     extras_require={
         "test": [
             "pytest",
-        ]
+        ],
+        "hdf5": [
+            "h5py",
+        ],
+        "soak": [
+            "fakeredis",
+        ],
     },
-    python_requires=">=3.6",
+    python_requires=">=3.8",
 )
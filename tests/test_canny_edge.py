@@ -0,0 +1,69 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from skimage import feature
+
+from analysis.processor.canny_edge import PREFILTER_SIGMA, EdgeDetection
+from analysis.processor.data_simulator import make_pattern
+
+
+@pytest.fixture(scope="module", params=range(3))
+def stack(request):
+    rng = np.random.default_rng(request.param)
+    return np.stack(
+        [make_pattern((128, 128), rng) + 2.0 * rng.random((128, 128)) for _ in range(6)]
+    )
+
+
+def prefiltered_canny(stack, sigma):
+    # the former per pulse path, pre-filter then Canny's own smoothing
+    return np.stack(
+        [
+            feature.canny(ndi.gaussian_filter(img, PREFILTER_SIGMA), sigma=sigma)
+            for img in stack
+        ]
+    )
+
+
+def further_than_a_pixel(edges, reference):
+    """Fraction of edge pixels without an edge of the other within a pixel"""
+    footprint = np.ones((1, 3, 3), bool)
+    missed = np.count_nonzero(
+        edges & ~ndi.binary_dilation(reference, footprint)
+    ) + np.count_nonzero(reference & ~ndi.binary_dilation(edges, footprint))
+    return missed / max(1, np.count_nonzero(edges) + np.count_nonzero(reference))
+
+
+@pytest.mark.parametrize("sigma", [2, 3])
+def test_merged_smoothing_matches_prefiltered_canny(stack, sigma):
+    edges = EdgeDetection(sigma=sigma).find_edges(stack)
+    reference = prefiltered_canny(stack, sigma)
+
+    assert np.count_nonzero(reference) > 0
+    # one merged Gaussian moves some edges by a pixel at most
+    assert further_than_a_pixel(edges, reference) < 0.01
+    np.testing.assert_allclose(
+        np.count_nonzero(edges), np.count_nonzero(reference), rtol=0.02
+    )
+
+
+def test_without_prefilter_is_canny(stack):
+    edges = EdgeDetection(sigma=3, apply_filter=False).find_edges(stack)
+    reference = np.stack([feature.canny(img, sigma=3, mode="reflect") for img in stack])
+
+    np.testing.assert_array_equal(edges, reference)
+
+
+def test_executor_gives_same_edges(stack):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threaded = EdgeDetection(sigma=3, executor=executor).find_edges(stack)
+
+    np.testing.assert_array_equal(threaded, EdgeDetection(sigma=3).find_edges(stack))
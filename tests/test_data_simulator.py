@@ -0,0 +1,41 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+import numpy as np
+import pytest
+
+from analysis.config import config
+from analysis.processor.data_processor import AZIMUTHAL_DEFAULTS, parse_azimuthal_config
+from analysis.processor.data_simulator import DTYPES, DataSimulator, _cycle_into
+from analysis.processor.masking import StackMask
+
+
+def simulated_frame(dtype, shape=(4, 128, 128)):
+    """A frame as DataSimulator.run puts it together from its bank"""
+    simulator = DataSimulator(None, data_shape=shape, dtype=dtype, bank_size=4)
+    patterns, noise = simulator._make_bank()
+    image = np.empty(shape, dtype=dtype)
+    _cycle_into(image, patterns, 0)
+    _cycle_into(image, noise, 1, add=True)
+    return image
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_default_threshold_mask_keeps_pixels(dtype):
+    image = simulated_frame(dtype)
+    threshold_mask = parse_azimuthal_config(AZIMUTHAL_DEFAULTS)["threshold_mask"]
+
+    masked = StackMask().build(image, threshold_mask).mean()
+    assert masked < 1
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_default_stats_range_holds_pixels(dtype):
+    image = simulated_frame(dtype)
+    low, high = config["stats_range"]
+
+    inside = ((image >= low) & (image <= high)).mean()
+    assert inside > 0
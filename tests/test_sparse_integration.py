@@ -0,0 +1,77 @@
+"""
+Analysis and visualization software
+
+Author: Ebad Kamil <ebad.kamil@xfel.eu>
+All rights reserved.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from analysis.processor.azimuthal_integration import BATCH_CSR, ImageIntegrator
+
+SHAPE = (4, 128, 128)
+
+
+def ai_config(method, pts=100):
+    return dict(
+        energy=9.3,
+        pixel_size=0.5e-3,
+        centrex=SHAPE[-1] / 2,
+        centrey=SHAPE[-2] / 2,
+        distance=0.2,
+        intg_rng=(0.1, 2.0),
+        intg_method=method,
+        intg_pts=pts,
+        threshold_mask=(0, 100),
+        user_mask=None,
+    )
+
+
+@pytest.fixture(scope="module")
+def image():
+    rng = np.random.default_rng(0)
+    image = rng.uniform(-10, 110, SHAPE)
+    # masked pixels which differ from pulse to pulse
+    image[:, ::31, ::29] = np.nan
+    image[1, :10] = 200
+    return image
+
+
+def integrate(method, image, executor=None):
+    integrator = ImageIntegrator()
+    integrator.executor = executor
+    return integrator.integrate(ai_config(method), image)
+
+
+def relative_error(intensities, reference):
+    return np.abs(intensities - reference).max() / np.abs(reference).max()
+
+
+def test_batch_csr_matches_numpy(image):
+    # pyFAI "numpy" does not split pixels either, the reference of the engine
+    ref_momentum, ref_intensities = integrate("numpy", image)
+    momentum, intensities = integrate(BATCH_CSR, image)
+
+    assert intensities.shape == ref_intensities.shape == (SHAPE[0], 100)
+    np.testing.assert_allclose(momentum, ref_momentum, rtol=1e-6)
+    assert relative_error(intensities, ref_intensities) < 1e-5
+
+
+def test_batch_csr_matches_nosplit_csr(image):
+    # pyFAI csr splits pixels, which its nosplit engine leaves out. Its
+    # first bin also takes pixels just below the radial range
+    ref_momentum, ref_intensities = integrate("nosplit_csr", image)
+    momentum, intensities = integrate(BATCH_CSR, image)
+
+    np.testing.assert_allclose(momentum, ref_momentum, rtol=1e-6)
+    assert relative_error(intensities[:, 1:], ref_intensities[:, 1:]) < 1e-5
+
+
+def test_batch_csr_with_executor(image):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        _, threaded = integrate(BATCH_CSR, image, executor)
+    _, intensities = integrate(BATCH_CSR, image)
+
+    np.testing.assert_array_equal(threaded, intensities)